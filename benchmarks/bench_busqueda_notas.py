@@ -0,0 +1,121 @@
+"""
+Compara /searchnotes con el índice ciego frente a la alternativa sin él:
+descifrar todas las notas del usuario y buscar las palabras en claro.
+Cada usuario tiene `notas` notas con la mezcla habitual de longitudes; las
+consultas mezclan palabras frecuentes y palabras que aparecen en pocas notas.
+
+Uso: python benchmarks/bench_busqueda_notas.py [notas] [usuarios] [consultas]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from functools import partial
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# pylint: disable=wrong-import-position
+from bench_sobre_notas import PALABRAS, corpus
+from core.notes import MAX_RESULTADOS_BUSQUEDA, cifrar_notas
+from models.database import SecureDB
+from models.encryption import CifradoManager, terminos
+from models.metrics import Histograma
+from models.repositories import NotesRepo
+
+LOTE = 1_000
+# Palabras que solo aparecen en unas pocas notas de cada usuario
+RARAS = [f"expediente{i}" for i in range(200)]
+CUBOS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def poblar(db, cifrado, notas, usuarios) -> dict:
+    """Crea los usuarios con sus notas; devuelve {usuario_id: cifrador}."""
+    azar = random.Random(11)
+    cifradores = {}
+    for telegram_id in range(1, usuarios + 1):
+        usuario_id = db.conn.execute(
+            "INSERT INTO usuarios (telegram_id) VALUES (?)", (telegram_id,)
+        ).lastrowid
+        cifrador = cifradores[usuario_id] = cifrado.para_usuario(usuario_id, os.urandom(16))
+        textos = [
+            f"{texto} {azar.choice(RARAS)}" if azar.random() < 0.05 else texto
+            for texto in corpus(notas)
+        ]
+        for desde in range(0, notas, LOTE):
+            for nota in cifrar_notas(cifrador, textos[desde:desde + LOTE]):
+                NotesRepo.insertar(db.conn, usuario_id, nota)
+            db.conn.commit()
+    return cifradores
+
+
+def buscar_descifrando(db, cifrador, usuario_id, consulta) -> list:
+    """Sin índice: descifra cada nota completa y filtra en Python."""
+    buscados = terminos(consulta)
+    filas = db.conn.execute(
+        "SELECT id, contenido_cifrado FROM notas WHERE usuario_id = ? ORDER BY id DESC",
+        (usuario_id,)
+    ).fetchall()
+    textos = cifrador.descifrar_lote(token for _, token in filas)
+    return [
+        nota_id for (nota_id, _), texto in zip(filas, textos) if buscados <= terminos(texto)
+    ][:MAX_RESULTADOS_BUSQUEDA]
+
+
+def buscar_indice(repo, cifrador, usuario_id, consulta) -> list:
+    """Con índice: consulta indexada y solo se descifran las vistas previas del resultado."""
+    filas = repo.buscar(usuario_id, cifrador.tokens_busqueda(consulta), MAX_RESULTADOS_BUSQUEDA)
+    cifrador.descifrar_lote(fila[1] for fila in filas)
+    return [fila[0] for fila in filas]
+
+
+def main():
+    notas = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    usuarios = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    consultas = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+
+    db = SecureDB(os.path.join(tempfile.mkdtemp(prefix="reconotas-busqueda-"), "bot.db"))
+    cifrado = CifradoManager(os.urandom(16), "bench")
+    inicio = time.perf_counter()
+    cifradores = poblar(db, cifrado, notas, usuarios)
+    carga = time.perf_counter() - inicio
+    filas_indice = db.conn.execute("SELECT COUNT(*) FROM notas_indice").fetchone()[0]
+    print(f"{usuarios} usuarios con {notas} notas cada uno, cargados en {carga:.1f} s; "
+          f"{filas_indice / (notas * usuarios):.1f} tokens de índice por nota\n")
+
+    # El coste de indexar al crear: HMAC de cada palabra distinta de la nota
+    cifrador = next(iter(cifradores.values()))
+    muestra = corpus(5_000)
+    inicio = time.perf_counter()
+    for texto in muestra:
+        cifrador.indice_ciego(texto)
+    print(f"indexar una nota: {(time.perf_counter() - inicio) / len(muestra) * 1e6:.1f} µs\n")
+
+    azar = random.Random(5)
+    repo = NotesRepo(db)
+    busquedas = {
+        "descifrar todo": (partial(buscar_descifrando, db), Histograma("sin_indice", cubos=CUBOS)),
+        "índice ciego": (partial(buscar_indice, repo), Histograma("indice", cubos=CUBOS)),
+    }
+    for _ in range(consultas):
+        usuario_id = azar.choice(list(cifradores))
+        consulta = (azar.choice(RARAS) if azar.random() < 0.5
+                    else " ".join(azar.sample(PALABRAS, azar.randint(1, 2))))
+        resultados = []
+        for buscar, medida in busquedas.values():
+            inicio = time.perf_counter()
+            resultados.append(buscar(cifradores[usuario_id], usuario_id, consulta))
+            medida.observar(time.perf_counter() - inicio)
+        assert resultados[0] == resultados[1], consulta
+
+    print(f"{'búsqueda':<16} {'p50 ms':>10} {'p99 ms':>10} {'media ms':>10}")
+    for nombre, (_, medida) in busquedas.items():
+        print(f"{nombre:<16} {medida.percentil(0.5) * 1000:>10.2f} "
+              f"{medida.percentil(0.99) * 1000:>10.2f} "
+              f"{medida.suma / medida.total * 1000:>10.2f}")
+    cifrado.cerrar()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""
+Compara el rendimiento del cifrado/descifrado en serie frente a
+CifradoManager.cifrar_lote/descifrar_lote con hilos y con procesos.
+
+Uso: python benchmarks/bench_cifrado_lote.py [numero_notas]
+"""
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from models.encryption import CifradoManager  # pylint: disable=wrong-import-position
+
+
+def medir(nombre, funcion, total):
+    inicio = time.perf_counter()
+    resultado = funcion()
+    duracion = time.perf_counter() - inicio
+    print(f"{nombre:<26} {duracion:8.2f} s {total / duracion:12.0f} notas/s")
+    return resultado
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    notas = [f"Nota de prueba {i} " + "x" * (i % 400) for i in range(total)]
+    print(f"{total} notas, longitud media {sum(map(len, notas)) // total} caracteres\n")
+
+    serie = CifradoManager(b"benchmark-salt", "benchmark")
+    tokens = medir("cifrar (serie)", lambda: [serie.cifrar(n) for n in notas], total)
+    medir("descifrar (serie)", lambda: [serie.descifrar(t) for t in tokens], total)
+
+    for modo in ('hilos', 'procesos'):
+        cifrado = CifradoManager(b"benchmark-salt", "benchmark", modo_paralelo=modo)
+        try:
+            medir(f"cifrar_lote ({modo})", lambda c=cifrado: c.cifrar_lote(notas), total)
+            descifradas = medir(f"descifrar_lote ({modo})",
+                                lambda c=cifrado: c.descifrar_lote(tokens), total)
+            assert descifradas == notas
+        finally:
+            cifrado.cerrar()
+
+
+if __name__ == "__main__":
+    main()
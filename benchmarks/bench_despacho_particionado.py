@@ -0,0 +1,113 @@
+"""
+Compara el despacho de una ráfaga de recordatorios con 1, 2, 4 y 8 procesos
+(DespachoParticionado) contra una Bot API falsa local que responde a
+sendMessage con una latencia fija.
+
+Uso: python benchmarks/bench_despacho_particionado.py [recordatorios] [latencia_ms]
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from threading import Lock, Thread
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# pylint: disable=wrong-import-position
+from core.dispatch import DespachoParticionado
+from models.database import SecureDB
+
+USUARIOS = 1000
+RESPUESTA = json.dumps({"ok": True, "result": {
+    "message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"}, "text": ""
+}}).encode()
+
+
+class BotApiFalsa(BaseHTTPRequestHandler):
+    """Responde a cualquier método como si fuera un sendMessage correcto"""
+    latencia = 0.03
+    recibidos = 0
+    ultimo = 0.0
+    lock = Lock()
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.latencia)
+        with self.lock:
+            BotApiFalsa.recibidos += 1
+            BotApiFalsa.ultimo = time.time()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(RESPUESTA)))
+        self.end_headers()
+        self.wfile.write(RESPUESTA)
+
+    do_GET = do_POST
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+def preparar_db(ruta, total, fire_at):
+    db = SecureDB(ruta)
+    db.conn.executemany(
+        "INSERT INTO usuarios (telegram_id) VALUES (?)",
+        [(telegram_id,) for telegram_id in range(1, USUARIOS + 1)]
+    )
+    db.conn.executemany(
+        """INSERT INTO recordatorios
+        (usuario_id, texto, hora_recordatorio, recurrente, next_fire_at)
+        VALUES (?, ?, '00:00', 0, ?)""",
+        [(i % USUARIOS + 1, f"Recordatorio {i}", fire_at) for i in range(total)]
+    )
+    db.conn.commit()
+    db.conn.close()
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    BotApiFalsa.latencia = (float(sys.argv[2]) if len(sys.argv) > 2 else 30) / 1000
+
+    servidor = ThreadingHTTPServer(("127.0.0.1", 0), BotApiFalsa)
+    Thread(target=servidor.serve_forever, daemon=True).start()
+    api_url = f"http://127.0.0.1:{servidor.server_port}/bot{{0}}/{{1}}"
+    print(f"{total} recordatorios para {USUARIOS} usuarios, "
+          f"latencia de la API {BotApiFalsa.latencia * 1000:.0f} ms\n")
+
+    for procesos in (1, 2, 4, 8):
+        directorio = tempfile.mkdtemp(prefix="reconotas-despacho-")
+        fire_at = int(time.time()) + 6
+        preparar_db(os.path.join(directorio, "bot.db"), total, fire_at)
+        BotApiFalsa.recibidos = 0
+        despacho = DespachoParticionado({
+            "ruta_db": os.path.join(directorio, "bot.db"),
+            "perfil_bd": "durable",
+            "token": "123:falso",
+            "api_url": api_url,
+            "locales_dir": str(Path(__file__).resolve().parent.parent / "locales"),
+            "idiomas": ["es"],
+            "idioma_defecto": "es",
+            "zona_defecto": None,
+            "politica_recuperacion": "entregar",
+            "gracia": 3600,
+            "tasa_recuperacion": 0,
+            "ttl_liderazgo": 15,
+            "id_instancia": "bench",
+            "tasa_despacho": 0
+        }, procesos)
+        despacho.iniciar()
+        limite = fire_at + 120
+        while BotApiFalsa.recibidos < total and time.time() < limite:
+            time.sleep(0.05)
+        duracion = BotApiFalsa.ultimo - fire_at
+        despacho.detener()
+        print(f"{procesos} procesos: {BotApiFalsa.recibidos}/{total} en {duracion:6.2f} s "
+              f"-> {BotApiFalsa.recibidos / duracion:8.0f} mensajes/s")
+    servidor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Compara el arranque del planificador reconstruyendo los pendientes desde la
+BD frente a cargarlos de la instantánea binaria proyectada en memoria.
+
+Uso: python benchmarks/bench_instantanea.py [recordatorios]
+"""
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# pylint: disable=wrong-import-position
+from core.scheduler import ReminderScheduler
+from models.database import SecureDB
+
+USUARIOS = 10_000
+
+
+def medir(nombre, funcion):
+    inicio = time.perf_counter()
+    resultado = funcion()
+    print(f"{nombre:<32} {time.perf_counter() - inicio:8.3f} s")
+    return resultado
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    ruta = os.path.join(tempfile.mkdtemp(prefix="reconotas-instantanea-"), "bot.db")
+    db = SecureDB(ruta)
+    db.conn.executemany(
+        "INSERT INTO usuarios (telegram_id) VALUES (?)",
+        [(telegram_id,) for telegram_id in range(1, USUARIOS + 1)]
+    )
+    ahora = int(time.time())
+    db.conn.executemany(
+        """INSERT INTO recordatorios
+        (usuario_id, texto, hora_recordatorio, recurrente, next_fire_at)
+        VALUES (?, ?, '00:00', 0, ?)""",
+        ((i % USUARIOS + 1, f"Recordatorio {i}", ahora + 3600 + i % 86400)
+         for i in range(total))
+    )
+    db.conn.commit()
+    print(f"{total} recordatorios pendientes\n")
+
+    def planificador():
+        instancia = ReminderScheduler(db, print, ruta_instantanea=ruta + ".snap")
+        instancia.conn = db.nueva_conexion()
+        return instancia
+
+    medir("reconstrucción desde la BD", planificador().cargar_pendientes)
+    medir("escritura de la instantánea", planificador().guardar_instantanea)
+    cargado = planificador()
+    assert medir("carga de la instantánea", cargado.cargar_instantanea)
+    assert len(cargado._heap) == total  # pylint: disable=protected-access
+    print(f"\ntamaño de la instantánea: {os.path.getsize(ruta + '.snap') / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
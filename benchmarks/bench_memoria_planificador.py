@@ -0,0 +1,72 @@
+"""
+Mide los bytes por recordatorio programado de cada representación en
+memoria: un threading.Timer por recordatorio (diseño original), un montículo
+de tuplas y el MonticuloCompacto de columnas array('q').
+
+Uso: python benchmarks/bench_memoria_planificador.py [recordatorios]
+"""
+import heapq
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from threading import Timer
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from core.schedule_heap import MonticuloCompacto  # pylint: disable=wrong-import-position
+
+# Los Timer no se arrancan: cada uno arrancado añadiría además un hilo con su pila
+MUESTRA_TIMERS = 10_000
+
+
+def medir(nombre, total, construir):
+    tracemalloc.start()
+    inicio = time.perf_counter()
+    estructura = construir(total)
+    duracion = time.perf_counter() - inicio
+    usados = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"{nombre:<34} {usados / total:8.1f} bytes/recordatorio "
+          f"{usados / 1e6:9.1f} MB {duracion:7.2f} s")
+    return estructura
+
+
+def timers(total):
+    ahora = time.time()
+    return [Timer(3600, print, args=(1000 + i, f"Recordatorio {i}", ahora + i))
+            for i in range(total)]
+
+
+def tuplas(total):
+    ahora = int(time.time())
+    monticulo = []
+    for i in range(total):
+        heapq.heappush(monticulo, (ahora + (i * 7919) % 86400, i, 1000 + i % 10_000))
+    return monticulo
+
+
+def compacto(total):
+    ahora = int(time.time())
+    monticulo = MonticuloCompacto()
+    for i in range(total):
+        monticulo.insertar(ahora + (i * 7919) % 86400, i, 1000 + i % 10_000)
+    return monticulo
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    print(f"{total} recordatorios programados\n")
+    medir(f"Timer por recordatorio (muestra {MUESTRA_TIMERS})", MUESTRA_TIMERS, timers)
+    medir("montículo de tuplas", total, tuplas)
+    monticulo = medir("MonticuloCompacto", total, compacto)
+
+    anterior = monticulo.extraer()[0]
+    while monticulo:
+        actual = monticulo.extraer()[0]
+        assert anterior <= actual
+        anterior = actual
+
+
+if __name__ == "__main__":
+    main()
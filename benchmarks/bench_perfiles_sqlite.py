@@ -0,0 +1,91 @@
+"""
+Compara los perfiles de almacenamiento de SQLite (DB_PROFILE) sobre un
+conjunto sintético de usuarios y notas: escrituras por segundo con una
+transacción por nota (como un handler), en lotes, y latencia de lectura
+de las notas de un usuario.
+
+Uso: python benchmarks/bench_perfiles_sqlite.py [notas] [usuarios]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# pylint: disable=wrong-import-position
+from models.database import PERFILES_ALMACENAMIENTO, SecureDB
+from models.metrics import Histograma
+
+LOTE = 500
+LECTURAS = 5_000
+CONTENIDO = os.urandom(240)
+
+
+def medir_perfil(perfil, notas, usuarios):
+    ruta = os.path.join(tempfile.mkdtemp(prefix=f"reconotas-{perfil}-"), "bot.db")
+    db = SecureDB(ruta, perfil)
+    conn = db.conn
+    conn.executemany(
+        "INSERT INTO usuarios (telegram_id) VALUES (?)",
+        [(telegram_id,) for telegram_id in range(1, usuarios + 1)]
+    )
+    conn.commit()
+
+    # Una transacción por nota: es lo que hace /newnote y donde pesa synchronous
+    individuales = min(notas, 2_000)
+    inicio = time.perf_counter()
+    for i in range(individuales):
+        conn.execute(
+            "INSERT INTO notas (usuario_id, contenido_cifrado) VALUES (?, ?)",
+            (i % usuarios + 1, CONTENIDO)
+        )
+        conn.commit()
+    por_transaccion = individuales / (time.perf_counter() - inicio)
+
+    inicio = time.perf_counter()
+    for desde in range(individuales, notas, LOTE):
+        conn.executemany(
+            "INSERT INTO notas (usuario_id, contenido_cifrado) VALUES (?, ?)",
+            [(i % usuarios + 1, CONTENIDO) for i in range(desde, min(desde + LOTE, notas))]
+        )
+        conn.commit()
+    en_lote = (notas - individuales) / max(time.perf_counter() - inicio, 1e-9)
+
+    # Conexión nueva: lee con la caché de páginas de SQLite vacía, como otro proceso
+    lector = db.nueva_conexion()
+    latencias = Histograma("lectura", cubos=(
+        0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05
+    ))
+    azar = random.Random(42)
+    for _ in range(LECTURAS):
+        telegram_id = azar.randint(1, usuarios)
+        inicio = time.perf_counter()
+        lector.execute(
+            """SELECT n.id, n.contenido_cifrado, n.fecha_creacion FROM notas n
+            JOIN usuarios u ON u.id = n.usuario_id WHERE u.telegram_id = ?""",
+            (telegram_id,)
+        ).fetchall()
+        latencias.observar(time.perf_counter() - inicio)
+    lector.close()
+    conn.close()
+    return por_transaccion, en_lote, latencias
+
+
+def main():
+    notas = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    usuarios = int(sys.argv[2]) if len(sys.argv) > 2 else 1_000
+    print(f"{notas} notas de {usuarios} usuarios, {LECTURAS} lecturas\n")
+    print(f"{'perfil':<12} {'escr/s (1 tx)':>14} {'escr/s (lote)':>14} "
+          f"{'lect p50 ms':>12} {'lect p99 ms':>12}")
+    for perfil in PERFILES_ALMACENAMIENTO:
+        por_transaccion, en_lote, latencias = medir_perfil(perfil, notas, usuarios)
+        print(f"{perfil:<12} {por_transaccion:>14.0f} {en_lote:>14.0f} "
+              f"{latencias.percentil(0.5) * 1000:>12.3f} "
+              f"{latencias.percentil(0.99) * 1000:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
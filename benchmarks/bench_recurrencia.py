@@ -0,0 +1,48 @@
+"""
+Mide el cálculo de la siguiente ocurrencia para un gran número de reglas de
+recurrencia mezcladas (diarias, laborables, semanales, mensuales y cada N
+horas), incluyendo el salto tras semanas sin disparar.
+
+Uso: python benchmarks/bench_recurrencia.py [numero_reglas]
+"""
+import sys
+import time
+from pathlib import Path
+from zoneinfo import ZoneInfo
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from core.recurrence import parsear_regla  # pylint: disable=wrong-import-position
+
+REGLAS = (
+    "FREQ=DAILY",
+    "FREQ=DAILY;INTERVAL=3",
+    "FREQ=WEEKLY;BYDAY=MO,TU,WE,TH,FR",
+    "FREQ=WEEKLY;BYDAY=SA",
+    "FREQ=MONTHLY;BYMONTHDAY=31",
+    "FREQ=HOURLY;INTERVAL=4",
+)
+ZONAS = (None, ZoneInfo("Europe/Madrid"), ZoneInfo("America/New_York"), ZoneInfo("Asia/Tokyo"))
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    ahora = int(time.time())
+    casos = [
+        (parsear_regla(REGLAS[i % len(REGLAS)]), f"{i % 24:02d}:{i % 60:02d}",
+         ZONAS[i % len(ZONAS)], ahora - (i % 90) * 86400)
+        for i in range(total)
+    ]
+    print(f"{total} reglas ({len(REGLAS)} tipos, {len(ZONAS)} zonas)\n")
+
+    for nombre, con_anterior in (("primera ocurrencia", False), ("tras disparo atrasado", True)):
+        inicio = time.perf_counter()
+        for regla, hora, zona, anterior in casos:
+            regla.siguiente(hora, ahora, zona, anterior if con_anterior else None)
+        duracion = time.perf_counter() - inicio
+        print(f"{nombre:<24} {duracion:8.2f} s {total / duracion:12.0f} reglas/s "
+              f"{duracion / total * 1e6:8.2f} µs/regla")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Compara tamaño almacenado y rendimiento de cifrado/descifrado de los tokens
+Fernet frente al sobre compacto AES-GCM, con y sin compresión, sobre un
+corpus de notas con la mezcla habitual de longitudes (muchas cortas, algunas
+de varios párrafos).
+
+Uso: python benchmarks/bench_sobre_notas.py [numero_notas]
+"""
+import random
+import sys
+import time
+from pathlib import Path
+
+from cryptography.fernet import Fernet
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# pylint: disable=wrong-import-position
+from models import encryption
+from models.encryption import SobreCompacto
+
+PALABRAS = (
+    "comprar leche pan huevos reunión con el equipo mañana a las diez llamar al "
+    "médico revisar presupuesto enviar informe trimestral cumpleaños de Ana "
+    "recoger paquete en correos pagar factura de la luz idea para el proyecto "
+    "lista de tareas pendientes notas de la clase de historia receta de tortilla "
+    "contraseña del wifi no olvidar renovar el pasaporte antes de junio"
+).split()
+
+
+def corpus(total: int) -> list:
+    """60 % notas cortas, 30 % de un párrafo y 10 % de varios párrafos."""
+    azar = random.Random(7)
+    notas = []
+    for _ in range(total):
+        tipo = azar.random()
+        palabras = (azar.randint(2, 12) if tipo < 0.6
+                    else azar.randint(15, 80) if tipo < 0.9 else azar.randint(100, 350))
+        notas.append(" ".join(azar.choice(PALABRAS) for _ in range(palabras)))
+    return notas
+
+
+def medir(cifrar, descifrar, datos):
+    inicio = time.perf_counter()
+    tokens = [cifrar(texto) for texto in datos]
+    duracion_cifrado = time.perf_counter() - inicio
+    inicio = time.perf_counter()
+    claros = [descifrar(token) for token in tokens]
+    duracion_descifrado = time.perf_counter() - inicio
+    assert claros == datos
+    return sum(map(len, tokens)), duracion_cifrado, duracion_descifrado
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    datos = [nota.encode('utf-8') for nota in corpus(total)]
+    texto = sum(map(len, datos))
+    mb = texto / 1e6
+    print(f"{total} notas, {mb:.1f} MB de texto, media {texto // total} bytes\n")
+    print(f"{'formato':<24} {'almacenado':>11} {'bytes/nota':>11} {'vs texto':>9} "
+          f"{'cifrar MB/s':>12} {'descifrar MB/s':>15}")
+
+    clave = Fernet.generate_key()
+    fernet = Fernet(clave)
+    sobre = SobreCompacto((clave,))
+    umbral = encryption.UMBRAL_COMPRESION
+    formatos = [
+        ("fernet", fernet.encrypt, fernet.decrypt, umbral),
+        ("sobre AES-GCM", sobre.cifrar, sobre.descifrar, float('inf')),
+        ("sobre AES-GCM + zlib", sobre.cifrar, sobre.descifrar, umbral),
+    ]
+    try:
+        for nombre, cifrar, descifrar, umbral_formato in formatos:
+            encryption.UMBRAL_COMPRESION = umbral_formato
+            almacenado, t_cifrado, t_descifrado = medir(cifrar, descifrar, datos)
+            print(f"{nombre:<24} {almacenado / 1e6:>9.1f}MB {almacenado / total:>11.1f} "
+                  f"{almacenado / texto:>8.2f}x {mb / t_cifrado:>12.1f} {mb / t_descifrado:>15.1f}")
+    finally:
+        encryption.UMBRAL_COMPRESION = umbral
+
+
+if __name__ == "__main__":
+    main()
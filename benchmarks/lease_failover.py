@@ -0,0 +1,106 @@
+"""
+Demostración de conmutación del planificador con varias instancias locales.
+
+Lanza N procesos con su ReminderScheduler sobre la misma base de datos,
+programa un recordatorio por segundo, mata con SIGKILL al líder a mitad de
+la prueba y comprueba que cada recordatorio se entregó una sola vez y cuánto
+tardó otra instancia en retomar el despacho.
+
+Uso: python benchmarks/lease_failover.py [instancias] [ttl_segundos] [duracion]
+"""
+import multiprocessing
+import os
+import signal
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# pylint: disable=wrong-import-position
+from core.leader import ArrendamientoLider, RECURSO_PLANIFICADOR
+from core.scheduler import ReminderScheduler
+from models.database import SecureDB
+
+
+def instancia(ruta_db, ruta_entregas, nombre, ttl):
+    """Proceso que solo despacha recordatorios y anota cada entrega"""
+    db = SecureDB(ruta_db)
+
+    def enviar(telegram_id, texto, programado):  # pylint: disable=unused-argument
+        with open(ruta_entregas, "a", encoding="utf-8") as fichero:
+            fichero.write(f"{nombre} {texto} {time.time():.3f}\n")
+
+    lider = ArrendamientoLider(db, ttl=ttl, propietario=nombre)
+    planificador = ReminderScheduler(
+        db, enviar, politica_recuperacion='entregar', tasa_recuperacion=0,
+        intervalo_latido=1, lider=lider, intervalo_sondeo=min(1.0, ttl / 3)
+    )
+    planificador.iniciar()
+    while True:
+        time.sleep(3600)
+
+
+def main():
+    instancias = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    ttl = float(sys.argv[2]) if len(sys.argv) > 2 else 6.0
+    duracion = int(sys.argv[3]) if len(sys.argv) > 3 else 30
+
+    directorio = tempfile.mkdtemp(prefix="reconotas-lease-")
+    ruta_db = os.path.join(directorio, "bot.db")
+    ruta_entregas = os.path.join(directorio, "entregas.log")
+    db = SecureDB(ruta_db)
+    db.conn.execute("INSERT INTO usuarios (telegram_id) VALUES (1)")
+    inicio = int(time.time()) + 3
+    db.conn.executemany(
+        """INSERT INTO recordatorios
+        (usuario_id, texto, hora_recordatorio, recurrente, next_fire_at)
+        VALUES (1, ?, '00:00', 0, ?)""",
+        [(str(inicio + i), inicio + i) for i in range(duracion)]
+    )
+    db.conn.commit()
+
+    procesos = {}
+    for i in range(instancias):
+        nombre = f"instancia-{i}"
+        proceso = multiprocessing.Process(
+            target=instancia, args=(ruta_db, ruta_entregas, nombre, ttl), daemon=True
+        )
+        proceso.start()
+        procesos[nombre] = proceso
+    print(f"{instancias} instancias, ttl {ttl:.1f} s, {duracion} recordatorios (uno por segundo)")
+
+    time.sleep(inicio - time.time() + duracion / 3)
+    lider = db.conn.execute(
+        "SELECT propietario FROM arrendamientos WHERE recurso = ?", (RECURSO_PLANIFICADOR,)
+    ).fetchone()[0]
+    muerte = time.time()
+    os.kill(procesos[lider].pid, signal.SIGKILL)
+    print(f"SIGKILL a {lider} en t+{muerte - inicio:.1f} s")
+
+    time.sleep(inicio + duracion - time.time() + ttl * 2)
+    for proceso in procesos.values():
+        proceso.kill()
+
+    entregas = {}
+    with open(ruta_entregas, encoding="utf-8") as fichero:
+        for linea in fichero:
+            nombre, texto, instante = linea.split()
+            entregas.setdefault(int(texto), []).append((nombre, float(instante)))
+
+    duplicados = sum(len(e) - 1 for e in entregas.values())
+    perdidos = duracion - len(entregas)
+    retrasos = [min(t for _, t in e) - fire_at for fire_at, e in entregas.items()]
+    tras_muerte = sorted((min(t for _, t in e), e[0][0]) for e in entregas.values()
+                         if e[0][0] != lider)
+    print(f"entregados {len(entregas)}/{duracion}, duplicados {duplicados}, perdidos {perdidos}")
+    print(f"retraso máximo {max(retrasos):.2f} s "
+          f"(límite teórico ttl + ttl/3 = {ttl * 4 / 3:.1f} s)")
+    if tras_muerte:
+        print(f"{tras_muerte[0][1]} retomó el despacho {tras_muerte[0][0] - muerte:.2f} s "
+              "después de la caída")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+# ------------------------- EXPORTACIÓN / IMPORTACIÓN DE NOTAS -------------------------
+"""
+Exporta e importa las notas de un usuario como JSONL comprimido con gzip,
+procesando las filas por lotes para no cargar todas las notas en memoria
+"""
+import gzip
+import json
+
+from core.notes import MAX_LONGITUD_NOTA_LARGA, cifrar_notas
+from models.repositories import NotesRepo
+
+TAMANO_LOTE = 1000
+MAX_NOTAS_IMPORTACION = 10000
+MAX_LONGITUD_NOTA = MAX_LONGITUD_NOTA_LARGA
+# Un lote se inserta al llegar a TAMANO_LOTE notas o a estos caracteres de texto
+MAX_CARACTERES_LOTE = 2_000_000
+# Texto descomprimido máximo de una importación: un gzip pequeño de texto muy
+# repetitivo no puede escribir gigas en una transacción
+MAX_CARACTERES_IMPORTACION = 50_000_000
+# Bytes de una línea del JSONL con la nota más larga (hasta 6 bytes por carácter escapado)
+MAX_BYTES_LINEA = 6 * MAX_LONGITUD_NOTA + 4096
+
+
+def exportar_notas(db, cifrado, usuario_id: int, destino) -> int:
+    """
+    Escribe en `destino` (fichero binario) las notas descifradas del usuario,
+    una por línea en JSON y comprimidas con gzip. Devuelve el número de notas.
+    """
+    total = 0
+    cursor = db.conn.cursor()
+    cursor.execute(
+        """SELECT id, contenido_cifrado, fecha_creacion, fecha_modificacion, fragmentos
+        FROM notas WHERE usuario_id = ? ORDER BY id""",
+        (usuario_id,)
+    )
+    with gzip.GzipFile(fileobj=destino, mode='wb') as gz:
+        while True:
+            filas = cursor.fetchmany(TAMANO_LOTE)
+            if not filas:
+                break
+            cortas = iter(cifrado.descifrar_lote(fila[1] for fila in filas if not fila[4]))
+            lineas = [
+                json.dumps({
+                    "id": nota_id,
+                    "contenido": (_unir_fragmentos(db, cifrado, nota_id) if fragmentos
+                                  else next(cortas)),
+                    "fecha_creacion": creacion,
+                    "fecha_modificacion": modificacion
+                }, ensure_ascii=False) + "\n"
+                for nota_id, _, creacion, modificacion, fragmentos in filas
+            ]
+            gz.write("".join(lineas).encode('utf-8'))
+            total += len(filas)
+    return total
+
+
+def _unir_fragmentos(db, cifrado, nota_id: int) -> str:
+    """Texto completo de una nota larga"""
+    tokens = [token for (token,) in db.conn.execute(
+        "SELECT contenido_cifrado FROM notas_fragmentos WHERE nota_id = ? ORDER BY indice",
+        (nota_id,)
+    )]
+    return "".join(cifrado.descifrar_lote(tokens))
+
+
+def _leer_notas(origen):
+    """
+    Genera (contenido, fecha_creacion) validados desde un JSONL comprimido.
+    Las líneas se leen con un límite, así que una línea enorme no llega a
+    descomprimirse entera en memoria.
+    """
+    with gzip.GzipFile(fileobj=origen, mode='rb') as gz:
+        numero = 0
+        while True:
+            linea = gz.readline(MAX_BYTES_LINEA + 1)
+            if not linea:
+                break
+            numero += 1
+            if len(linea) > MAX_BYTES_LINEA:
+                raise ValueError(f"Línea {numero}: nota demasiado larga")
+            if not linea.strip():
+                continue
+            try:
+                registro = json.loads(linea)
+                contenido = registro["contenido"]
+            except (ValueError, KeyError, TypeError) as e:
+                raise ValueError(f"Línea {numero}: registro inválido") from e
+            if not isinstance(contenido, str) or not contenido.strip():
+                raise ValueError(f"Línea {numero}: nota vacía")
+            if len(contenido) > MAX_LONGITUD_NOTA:
+                raise ValueError(f"Línea {numero}: nota demasiado larga")
+            yield contenido, registro.get("fecha_creacion")
+
+
+def importar_notas(db, cifrado, usuario_id: int, origen) -> int:
+    """
+    Cifra por lotes las notas de un JSONL comprimido y las inserta en una
+    única transacción, sobre una conexión propia para que los commits y
+    rollbacks de otros handlers no la partan. Si alguna línea es inválida o
+    se supera el número de notas o de caracteres permitido no se importa
+    nada. Devuelve el número de notas importadas.
+    """
+    total = caracteres = caracteres_lote = 0
+    lote = []
+    conn = db.nueva_conexion()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN")
+        for contenido, fecha in _leer_notas(origen):
+            total += 1
+            caracteres += len(contenido)
+            if total > MAX_NOTAS_IMPORTACION:
+                raise ValueError(f"Se superó el máximo de {MAX_NOTAS_IMPORTACION} notas")
+            if caracteres > MAX_CARACTERES_IMPORTACION:
+                raise ValueError(
+                    f"Se superó el máximo de {MAX_CARACTERES_IMPORTACION} caracteres"
+                )
+            lote.append((contenido, fecha))
+            caracteres_lote += len(contenido)
+            if len(lote) >= TAMANO_LOTE or caracteres_lote >= MAX_CARACTERES_LOTE:
+                _insertar(cursor, cifrado, usuario_id, lote)
+                lote, caracteres_lote = [], 0
+        if lote:
+            _insertar(cursor, cifrado, usuario_id, lote)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return total
+
+
+def _insertar(cursor, cifrado, usuario_id, lote):
+    notas = cifrar_notas(cifrado, [contenido for contenido, _ in lote])
+    for nota, (_, fecha) in zip(notas, lote):
+        NotesRepo.insertar(cursor, usuario_id, nota, fecha)
@@ -0,0 +1,184 @@
+# ------------------------- COPIAS DE SEGURIDAD -------------------------
+"""
+Copias de seguridad en caliente de la base de datos con la API de backup de
+SQLite, comprimidas con gzip y con retención de las más recientes
+"""
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+import time
+from datetime import datetime
+from pathlib import Path
+from threading import Event, Lock, Thread
+
+from models.database import SecureDB
+from models.metrics import REGISTRO
+
+PREFIJO = "reconotas-"
+EXTENSION = ".db.gz"
+# Las copias contienen las sales y los secretos 2FA de todos los usuarios
+PERMISOS_COPIA = 0o600
+
+
+class _CopiaReiniciada(Exception):
+    """La copia por pasos se reinició demasiadas veces por escrituras en el origen"""
+
+
+def _crear_privado(ruta: Path):
+    """Crea `ruta` vacía con PERMISOS_COPIA, independientemente del umask"""
+    os.close(os.open(ruta, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, PERMISOS_COPIA))
+    os.chmod(ruta, PERMISOS_COPIA)
+
+
+class CopiaSeguridad:
+    """
+    Copia la BD por pasos de `paginas_por_paso` páginas con una pausa de
+    `pausa` segundos entre ellos: cada paso solo mantiene una lectura sobre
+    el origen, así que los handlers pueden seguir escribiendo en el WAL.
+    Si el origen cambia a mitad de copia, SQLite la reinicia desde el
+    principio; tras `max_reinicios` reinicios se copia en un único paso, que
+    no se reinicia. Cada `intervalo` segundos deja en `directorio` un fichero
+    `reconotas-AAAAMMDD-HHMMSS.db.gz`, legible solo por el propietario, y
+    conserva los `retencion` más recientes.
+    """
+
+    def __init__(self, db: SecureDB, directorio: str, intervalo: float = 86400,
+                 retencion: int = 7, paginas_por_paso: int = 256, pausa: float = 0.05,
+                 max_reinicios: int = 10, registro=REGISTRO, logger=None):
+        self.db = db
+        self.directorio = Path(directorio)
+        self.intervalo = intervalo
+        self.retencion = retencion
+        self.paginas_por_paso = paginas_por_paso
+        self.pausa = pausa
+        self.max_reinicios = max_reinicios
+        self.logger = logger or logging.getLogger("SecureBot")
+        self._detener = Event()
+        self._lock = Lock()
+
+        self._duracion = registro.histograma(
+            "backup_duracion_segundos", "Duración de cada copia de seguridad"
+        )
+        self._ritmo = registro.indicador(
+            "backup_paginas_por_segundo", "Páginas por segundo de la última copia"
+        )
+        self._bytes = registro.indicador("backup_bytes", "Tamaño comprimido de la última copia")
+        self._ultima = registro.indicador(
+            "backup_ultima_marca_tiempo", "Hora (epoch) de la última copia completada"
+        )
+        self._fallidas = registro.contador("backups_fallidos_total", "Copias fallidas")
+
+    def iniciar(self):
+        """Lanza las copias periódicas en un hilo en segundo plano."""
+        Thread(target=self._run, name="copia-seguridad", daemon=True).start()
+
+    def detener(self):
+        """Detiene el hilo; una copia en curso termina antes."""
+        self._detener.set()
+
+    def copias(self) -> list:
+        """Copias existentes en el directorio, de la más antigua a la más reciente."""
+        return sorted(self.directorio.glob(f"{PREFIJO}*{EXTENSION}"))
+
+    def _run(self):
+        # Tras un reinicio se respeta el intervalo desde la última copia existente
+        existentes = self.copias()
+        espera = 0.0
+        if existentes:
+            espera = max(0.0, self.intervalo - (time.time() - existentes[-1].stat().st_mtime))
+        while not self._detener.wait(espera):
+            try:
+                self.copiar()
+            except Exception as e: # pylint: disable=broad-except
+                self._fallidas.incrementar()
+                self.logger.error(f"Error en la copia de seguridad: {str(e)}")
+            espera = self.intervalo
+
+    def copiar(self) -> Path:
+        """Hace una copia ahora, aplica la retención y devuelve la ruta del fichero."""
+        with self._lock:
+            self.directorio.mkdir(mode=0o700, parents=True, exist_ok=True)
+            nombre = f"{PREFIJO}{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+            temporal = self.directorio / f"{nombre}.db.tmp"
+            destino = self.directorio / f"{nombre}{EXTENSION}"
+            try:
+                inicio = time.monotonic()
+                paginas = self._copiar_paginas(temporal)
+                duracion_copia = time.monotonic() - inicio
+                self._comprimir(temporal, destino)
+                duracion = time.monotonic() - inicio
+            finally:
+                temporal.unlink(missing_ok=True)
+
+            ritmo = paginas / duracion_copia if duracion_copia else 0.0
+            tamano = destino.stat().st_size
+            self._duracion.observar(duracion)
+            self._ritmo.fijar(round(ritmo))
+            self._bytes.fijar(tamano)
+            self._ultima.fijar(int(time.time()))
+            self.logger.info(
+                "Copia de seguridad %s: %d páginas en %.2f s (%.0f páginas/s), %.1f MB comprimidos",
+                destino.name, paginas, duracion, ritmo, tamano / 1e6
+            )
+            self._aplicar_retencion()
+            return destino
+
+    def _copiar_paginas(self, temporal: Path) -> int:
+        """Copia la BD a `temporal` por pasos y devuelve el número de páginas."""
+        paginas = [0]
+        previas = [None, 0]
+
+        def progreso(_estado, restantes, total):
+            paginas[0] = total
+            # Si un paso no avanza es que SQLite reinició la copia desde el principio
+            if previas[0] is not None and restantes >= previas[0]:
+                previas[1] += 1
+                if previas[1] > self.max_reinicios:
+                    raise _CopiaReiniciada()
+            previas[0] = restantes
+            self.logger.debug("Copia de seguridad: %d de %d páginas", total - restantes, total)
+
+        # SQLite crea el journal de la copia con los mismos permisos que el fichero
+        _crear_privado(temporal)
+        origen = self.db.nueva_conexion()
+        copia = sqlite3.connect(temporal)
+        try:
+            try:
+                origen.backup(copia, pages=self.paginas_por_paso, progress=progreso,
+                              sleep=self.pausa)
+            except _CopiaReiniciada:
+                self.logger.warning(
+                    "Copia de seguridad reiniciada %d veces por escrituras; se copia en un paso",
+                    previas[1]
+                )
+                origen.backup(copia)
+                paginas[0] = copia.execute("PRAGMA page_count").fetchone()[0]
+            # Fichero autocontenido: sin WAL que acompañe a la copia al restaurarla
+            copia.execute("PRAGMA journal_mode=DELETE")
+        finally:
+            copia.close()
+            origen.close()
+        return paginas[0]
+
+    @staticmethod
+    def _comprimir(temporal: Path, destino: Path):
+        """Comprime a un fichero parcial y lo renombra, para no dejar copias a medias."""
+        parcial = destino.with_name(destino.name + ".part")
+        try:
+            _crear_privado(parcial)
+            with open(temporal, "rb") as entrada, \
+                    gzip.open(parcial, "wb", compresslevel=6) as salida:
+                shutil.copyfileobj(entrada, salida, 1024 * 1024)
+            os.replace(parcial, destino)
+        finally:
+            parcial.unlink(missing_ok=True)
+
+    def _aplicar_retencion(self):
+        for antigua in self.copias()[:-self.retencion] if self.retencion > 0 else []:
+            try:
+                antigua.unlink()
+                self.logger.info("Copia de seguridad antigua eliminada: %s", antigua.name)
+            except OSError as e:
+                self.logger.error(f"Error eliminando la copia {antigua.name}: {str(e)}")
@@ -3,17 +3,34 @@ Inports que permiten que el bot funcione correctmente
 """
 import os
 import sys
-import gettext
-from datetime import datetime, timedelta
+import tempfile
+import time
+from datetime import datetime
 from functools import partial
+from itertools import chain, islice
 from threading import Timer
 import telebot
 import pyotp
 
 # # Cambio necesario: Importar las clases desde los nuevos archivos
+from models.attachments import (MAX_TAMANO_ADJUNTO, TAMANO_BLOQUE, AlmacenAdjuntos,
+                                cargar_clave_direccion)
 from models.Config import Config
 from models.database import SecureDB
 from models.encryption import CifradoManager
+from models.key_rotation import RotacionClaves
+from models.metrics import FASES, REGISTRO, ResumenPeriodico, ServidorMetricas
+from models.repositories import AttachmentsRepo, NotesRepo, RemindersRepo, UsersRepo
+from core import importers
+from core import archive
+from core import notes as notas_largas
+from core.recurrence import extraer_regla, proximo_disparo, regla_efectiva
+from core.instrumentation import instrumentado, medir_api_telegram, vigilar_errores
+from core.dispatch import DespachoParticionado, RemitenteRecordatorios, cargar_traducciones
+from core.backup import CopiaSeguridad
+from core.leader import ArrendamientoLider
+from core.maintenance import MantenimientoBD
+from core.scheduler import HISTOGRAMA_ENTREGA, ReminderScheduler, obtener_zona
 
 
 
@@ -24,36 +41,97 @@ class RecoNotasBot:
     """
     def __init__(self, config: Config):
         self.config = config
+        if config.api_url:
+            telebot.apihelper.API_URL = config.api_url
+        # Tiempo de la Bot API y errores registrados por cada handler instrumentado
+        medir_api_telegram()
+        vigilar_errores(config.logger)
         self.bot = telebot.TeleBot(config.api_token) # type: ignore
-        self.db = SecureDB.get_instance()
-        self.cifrado = CifradoManager(config.salt, config.clave_maestra) # type: ignore
-        self.active_reminders = {}
+        self.db = SecureDB.get_instance(perfil=config.perfil_bd)
+        self.db.consultas.umbral = config.umbral_consulta_lenta
+        self.usuarios = UsersRepo(self.db)
+        self.notas = NotesRepo(self.db)
+        self.recordatorios = RemindersRepo(self.db)
+        self.cifrado = CifradoManager(
+            config.salt, config.clave_maestra, # type: ignore
+            modo_paralelo=config.modo_cifrado_paralelo,
+            trabajadores=config.trabajadores_cifrado,
+            claves_anteriores=config.claves_anteriores,
+            tamano_cache=config.tamano_cache_claves
+        )
+        self.adjuntos = AttachmentsRepo(self.db)
+        self.almacen = AlmacenAdjuntos(
+            config.directorio_adjuntos, self.cifrado,
+            cargar_clave_direccion(self.db.conn, self.cifrado)
+        )
+        # Migra a la clave actual de cada usuario las notas con claves antiguas,
+        # y después los adjuntos a la clave maestra actual
+        self.rotacion = RotacionClaves(self.db, self.cifrado, almacen=self.almacen,
+                                       logger=config.logger)
+        self.rotacion.iniciar()
+        self.mantenimiento = MantenimientoBD(
+            self.db, intervalo=config.intervalo_mantenimiento, logger=config.logger
+        )
+        if config.intervalo_mantenimiento:
+            self.mantenimiento.iniciar()
+        self.copias = None
+        if config.directorio_copias:
+            self.copias = CopiaSeguridad(
+                self.db, config.directorio_copias, intervalo=config.intervalo_copias,
+                retencion=config.retencion_copias, logger=config.logger
+            )
+            self.copias.iniciar()
         self._load_translations()
+        self.remitente = RemitenteRecordatorios(
+            self.bot, self.db.conn, self.translations, config.default_lang, config.zona_defecto
+        )
+        if config.procesos_despacho > 1:
+            self.scheduler = DespachoParticionado(
+                self._opciones_despacho(), config.procesos_despacho, config.logger
+            )
+        else:
+            self.scheduler = ReminderScheduler(
+                self.db, self.remitente, config.logger,
+                politica_recuperacion=config.politica_recuperacion,
+                gracia=config.gracia_recuperacion,
+                tasa_recuperacion=config.tasa_recuperacion,
+                zona_defecto=config.zona_defecto,
+                lider=ArrendamientoLider(
+                    self.db, ttl=config.ttl_liderazgo, propietario=config.id_instancia,
+                    logger=config.logger
+                ),
+                ruta_instantanea=(f"{self.db.ruta}.planificador.snap"
+                                  if config.intervalo_instantanea else None),
+                intervalo_instantanea=config.intervalo_instantanea,
+                ventana_dispersion=config.ventana_dispersion,
+                tasa_despacho=config.tasa_despacho,
+                sla_entrega=config.sla_entrega
+            )
+        # Con varios procesos cada trabajador resume sus propias métricas
+        if config.intervalo_metricas and config.procesos_despacho == 1:
+            ResumenPeriodico(intervalo=config.intervalo_metricas, logger=config.logger,
+                             slas={HISTOGRAMA_ENTREGA: config.sla_entrega}).iniciar()
+        if config.puerto_metricas:
+            try:
+                ServidorMetricas(config.puerto_metricas, logger=config.logger).iniciar()
+            except OSError as e:
+                config.logger.error(f"Error abriendo el puerto de métricas: {str(e)}")
         self._setup_handlers()
         self._load_pending_reminders()
         self._clear_console()
 
     def _setup_handlers(self):
         @self.bot.message_handler(commands=['start', 'menu'])
+        @instrumentado
         def send_welcome(message):
             try:
-                user = message.from_user
-                user_id = user.id
-
-                cursor = self.db.conn.cursor() # type: ignore
-                cursor.execute(
-                    "INSERT OR IGNORE INTO usuarios (telegram_id, lenguaje) VALUES (?, ?)",
-                    (user_id, self.config.default_lang)
+                usuario, con_2fa = self.usuarios.registrar(
+                    message.from_user.id, self.config.default_lang
                 )
-                self.db.conn.commit()
-
-                cursor.execute("SELECT id FROM usuarios WHERE telegram_id = ?", (user_id,))
-                db_user_id = cursor.fetchone()[0]
+                db_user_id = usuario.id
 
                 # Verificar 2FA si está activado
-                cursor.execute("SELECT secret FROM auth_2fa WHERE usuario_id = ? AND activado = 1",
-                    (db_user_id,))
-                if cursor.fetchone():
+                if con_2fa:
                     msg = self.bot.reply_to(message, "🔐 Ingresa tu código 2FA:")
                     self.bot.register_next_step_handler(
                         msg, lambda m: self._verify_2fa(m, db_user_id)
@@ -67,6 +145,7 @@ class RecoNotasBot:
                 self.bot.reply_to(message, "❌ Ocurrió un error al procesar tu solicitud")
 
         @self.bot.message_handler(commands=['help', 'tutorial'])
+        @instrumentado
         def show_tutorial(message):
             try:
                 _ = self._get_user_translation(message.from_user.id)
@@ -75,9 +154,13 @@ class RecoNotasBot:
                     "1. *Notas*:\n"
                     "   - /newnote [texto] - Crea una nota\n"
                     "   - /mynotes - Lista tus notas\n"
+                    "   - /viewnote [id] - Muestra una nota completa\n"
+                    "   - /searchnotes [palabras] - Busca notas que contengan esas palabras\n"
+                    "   - Envía una foto o un fichero para guardarlo en una nota\n"
                     "   - /deletenote - Elimina una nota\n\n"
                     "2. *Recordatorios*:\n"
                     "   - /newreminder [texto] [HH:MM] --recurrente\n"
+                    "     (o --laborables, --semanal=LU,MI, --mensual=15, --cada=3h)\n"
                     "   - /myreminders - Lista recordatorios\n"
                     "   - /deletereminder - Elimina un recordatorio\n\n"
                     "3. *Seguridad*:\n"
@@ -96,32 +179,264 @@ class RecoNotasBot:
                 self.config.logger.error(f"Error en show_tutorial: {str(e)}")
                 self.bot.reply_to(message, "❌ Error al mostrar el tutorial")
 
+        @self.bot.message_handler(commands=['export'])
+        @instrumentado
+        def export_notes(message):
+            usuario = self.usuarios.obtener(message.from_user.id)
+            _ = self._traduccion(usuario.lenguaje if usuario else None)
+            if usuario is None:
+                self._pedir_registro(message, _)
+                return
+            try:
+                db_user_id = usuario.id
+
+                # Se vuelca a disco a partir de 1 MB para no retener el archivo en memoria
+                with tempfile.SpooledTemporaryFile(max_size=1024 * 1024) as destino:
+                    total = archive.exportar_notas(
+                        self.db, self._get_user_cipher(usuario), db_user_id, destino
+                    )
+                    if not total:
+                        self.bot.reply_to(
+                            message,
+                            _("📭 No tienes ninguna nota guardada"),
+                            reply_markup=self._get_main_menu()
+                        )
+                        return
+
+                    destino.seek(0)
+                    self.bot.send_document(
+                        message.chat.id,
+                        destino,
+                        visible_file_name="reconotas_notas.jsonl.gz",
+                        caption=_("📦 {count} notas exportadas").format(count=total),
+                        reply_to_message_id=message.message_id
+                    )
+
+                self.db.registrar_auditoria(db_user_id, "NOTAS_EXPORTADAS", {"cantidad": total})
+            except Exception as e: # pylint: disable=broad-except
+                self.config.logger.error(f"Error en export_notes: {str(e)}")
+                self.bot.reply_to(message, "❌ Error al exportar las notas")
+
+        @self.bot.message_handler(commands=['timezone'])
+        @instrumentado
+        def set_timezone(message):
+            try:
+                _ = self._get_user_translation(message.from_user.id)
+                partes = message.text.split(maxsplit=1)
+                if len(partes) < 2:
+                    self.bot.reply_to(
+                        message,
+                        _("🌍 Uso: /timezone Zona/Ciudad (ej. /timezone Europe/Madrid)"),
+                        reply_markup=self._get_main_menu()
+                    )
+                    return
+
+                zona = partes[1].strip()
+                total = self._set_user_timezone(message.from_user.id, zona)
+                self.bot.reply_to(
+                    message,
+                    _("✅ Zona horaria cambiada a {tz}").format(tz=zona) + "\n" +
+                    _("⏰ {count} recordatorios reprogramados").format(count=total),
+                    reply_markup=self._get_main_menu()
+                )
+            except ValueError:
+                self.bot.reply_to(
+                    message,
+                    _("❌ Zona horaria no válida. Usa el formato Zona/Ciudad, ej. America/Bogota"),
+                    reply_markup=self._get_main_menu()
+                )
+            except Exception as e: # pylint: disable=broad-except
+                self.config.logger.error(f"Error en set_timezone: {str(e)}")
+                self.bot.reply_to(message, "❌ Error al cambiar la zona horaria")
+
+        @self.bot.message_handler(commands=['import'])
+        @instrumentado
+        def import_notes(message):
+            _ = self._get_user_translation(message.from_user.id)
+            self.bot.reply_to(
+                message,
+                _("📥 Envíame el archivo .jsonl.gz generado con /export para importar tus notas"),
+                reply_markup=telebot.types.ReplyKeyboardRemove()
+            )
+
+        @self.bot.message_handler(content_types=['document'])
+        @instrumentado
+        def handle_document(message):
+            try:
+                _ = self._get_user_translation(message.from_user.id)
+                nombre = (message.document.file_name or '').lower()
+
+                if nombre.endswith('.jsonl.gz'):
+                    self._import_notes_document(message)
+                    return
+
+                if nombre.endswith('.txt'):
+                    self._import_long_note(message)
+                    return
+
+                if nombre.endswith('.csv'):
+                    parser = importers.parsear_csv
+                elif nombre.endswith('.ics'):
+                    parser = partial(
+                        importers.parsear_ics,
+                        zona=self.scheduler.zona(self._get_user_timezone(message.from_user.id))
+                    )
+                else:
+                    # Cualquier otro documento se guarda como adjunto de una nota
+                    self._attach_file(
+                        message, message.document, "document",
+                        message.document.file_name, message.document.mime_type
+                    )
+                    return
+
+                if (message.document.file_size or 0) > 1024 * 1024:
+                    self.bot.reply_to(
+                        message,
+                        _("❌ El fichero es demasiado grande (máximo 1 MB)"),
+                        reply_markup=self._get_main_menu()
+                    )
+                    return
+
+                file_info = self.bot.get_file(message.document.file_id)
+                contenido = self.bot.download_file(file_info.file_path).decode('utf-8-sig')
+                self._import_reminders(message, *parser(contenido))
+
+            except UnicodeDecodeError:
+                self.bot.reply_to(
+                    message,
+                    _("❌ El fichero debe estar codificado en UTF-8"),
+                    reply_markup=self._get_main_menu()
+                )
+            except Exception as e: # pylint: disable=broad-except
+                self.config.logger.error(f"Error en handle_document: {str(e)}")
+                self.bot.reply_to(
+                    message,
+                    _("❌ Error al importar el fichero"),
+                    reply_markup=self._get_main_menu()
+                )
+
+        @self.bot.message_handler(content_types=['photo'])
+        @instrumentado
+        def handle_photo(message):
+            try:
+                # La última es la versión de mayor resolución
+                self._attach_file(message, message.photo[-1], "photo", None, "image/jpeg")
+            except Exception as e: # pylint: disable=broad-except
+                self.config.logger.error(f"Error en handle_photo: {str(e)}")
+                _ = self._get_user_translation(message.from_user.id)
+                self.bot.reply_to(
+                    message,
+                    _("❌ Error al guardar el adjunto"),
+                    reply_markup=self._get_main_menu()
+                )
+
+        @self.bot.message_handler(commands=['stats'])
+        @instrumentado
+        def show_stats(message):
+            try:
+                _ = self._get_user_translation(message.from_user.id)
+                if message.from_user.id not in self.config.ids_administradores:
+                    self.bot.reply_to(message, _("⛔ Comando reservado a administradores"))
+                    return
+                self.bot.reply_to(message, self._formatear_estadisticas())
+            except Exception as e: # pylint: disable=broad-except
+                self.config.logger.error(f"Error en show_stats: {str(e)}")
+                self.bot.reply_to(message, "❌ Error al mostrar las estadísticas")
+
+    def _formatear_estadisticas(self, limite: int = 15) -> str:
+        """
+        Resumen de las métricas de los handlers (los `limite` más llamados),
+        de la entrega de recordatorios y de las sentencias SQL más costosas
+        para el comando /stats
+        """
+        por_handler = {}
+        for metrica in REGISTRO.metricas():
+            handler = metrica.etiquetas.get("handler")
+            if handler is not None:
+                por_handler.setdefault(handler, {})[metrica.nombre] = metrica
+        activo = max(time.time() - REGISTRO.inicio, 1.0)
+        lineas = [f"📊 Activo {activo / 3600:.1f} h"]
+        ordenados = sorted(
+            por_handler.items(), key=lambda par: par[1]["handler_llamadas_total"].valor,
+            reverse=True
+        )
+        for handler, metricas in ordenados[:limite]:
+            llamadas = metricas["handler_llamadas_total"].valor
+            if not llamadas:
+                continue
+            duracion = metricas["handler_duracion_segundos"]
+            fases = " ".join(
+                f"{nombre} {metricas[f'handler_{nombre}_segundos'].suma / llamadas * 1000:.0f}"
+                for nombre in FASES
+            )
+            lineas.append(
+                f"\n{handler}: {llamadas} ({llamadas / activo * 60:.2f}/min), "
+                f"{metricas['handler_errores_total'].valor} errores\n"
+                f"  p50 {duracion.percentil(0.5) * 1000:.0f} ms, "
+                f"p95 {duracion.percentil(0.95) * 1000:.0f} ms, "
+                f"p99 {duracion.percentil(0.99) * 1000:.0f} ms; media ms: {fases}"
+            )
+        entrega = REGISTRO.histograma(HISTOGRAMA_ENTREGA)
+        if entrega.total:
+            lineas.append(
+                f"\n⏰ Entrega de recordatorios: {entrega.total}, "
+                f"p50 {entrega.percentil(0.5):.2f} s, p99 {entrega.percentil(0.99):.2f} s"
+            )
+        sentencias = self.db.consultas.formatear_top(5)
+        if sentencias:
+            lineas.append("\n🗄 SQL por tiempo total:\n" + sentencias)
+        return "\n".join(lineas)
+
     def _clear_console(self):
         """Limpia la consola según el sistema operativo"""
         os.system('cls' if os.name == 'nt' else 'clear')
 
     def _load_translations(self):
         """Carga las traducciones para multiidioma"""
-        self.translations = {}
-        for lang in self.config.supported_langs:
-            try:
-                self.translations[lang] = gettext.translation(
-                    'reconotas',
-                    localedir=self.config.locales_dir,
-                    languages=[lang],
-                    fallback=True
-                )
-            except FileNotFoundError:
-                self.translations[lang] = gettext.NullTranslations()
+        self.translations = cargar_traducciones(
+            self.config.locales_dir, self.config.supported_langs
+        )
+
+    def _opciones_despacho(self) -> dict:
+        """Configuración que necesitan los procesos de despacho de recordatorios"""
+        return {
+            "ruta_db": self.db.ruta,
+            "perfil_bd": self.db.perfil,
+            "token": self.config.api_token,
+            "api_url": self.config.api_url,
+            "locales_dir": str(self.config.locales_dir),
+            "idiomas": self.config.supported_langs,
+            "idioma_defecto": self.config.default_lang,
+            "zona_defecto": self.config.zona_defecto,
+            "politica_recuperacion": self.config.politica_recuperacion,
+            "gracia": self.config.gracia_recuperacion,
+            "tasa_recuperacion": self.config.tasa_recuperacion,
+            "ttl_liderazgo": self.config.ttl_liderazgo,
+            "id_instancia": self.config.id_instancia,
+            "intervalo_instantanea": self.config.intervalo_instantanea,
+            "ventana_dispersion": self.config.ventana_dispersion,
+            "tasa_despacho": self.config.tasa_despacho,
+            "sla_entrega": self.config.sla_entrega,
+            "intervalo_metricas": self.config.intervalo_metricas
+        }
 
     def _get_user_translation(self, user_id):
         """Obtiene la traducción para el idioma del usuario"""
-        cursor = self.db.conn.cursor()
-        cursor.execute("SELECT lenguaje FROM usuarios WHERE telegram_id = ?", (user_id,))
-        lang = cursor.fetchone()
-        lang = lang[0] if lang else self.config.default_lang
+        return self._traduccion(self.usuarios.idioma(user_id))
+
+    def _traduccion(self, lang):
+        """Traducción de un idioma ya conocido (None = idioma por defecto), sin consultar la BD"""
+        lang = lang or self.config.default_lang
         return self.translations.get(lang, self.translations[self.config.default_lang]).gettext
 
+    def _pedir_registro(self, message, _):
+        """Responde a quien todavía no se ha registrado con /start"""
+        self.bot.reply_to(
+            message,
+            _("❌ Primero regístrate con /start"),
+            reply_markup=self._get_main_menu()
+        )
+
     def _get_main_menu(self):
         """Devuelve el teclado principal del menú"""
         markup = telebot.types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
@@ -138,96 +453,59 @@ class RecoNotasBot:
         )
         return markup
 
+    def _get_user_cipher(self, usuario):
+        """Obtiene el cifrador con la clave de datos del usuario (un repositories.Usuario)"""
+        sal = usuario.sal_clave
+        if sal is None:
+            sal = SecureDB.obtener_sal_usuario(self.db.conn, usuario.id)
+        return self.cifrado.para_usuario(usuario.id, sal)
+
     def _load_pending_reminders(self):
         """Carga recordatorios pendientes al iniciar el bot"""
         try:
-            cursor = self.db.conn.cursor()
-            cursor.execute(
-                """SELECT r.id, u.telegram_id, r.texto, r.hora_recordatorio, r.recurrente 
-                FROM recordatorios r
-                JOIN usuarios u ON r.usuario_id = u.id
-                WHERE r.completado = 0"""
-            )
-            reminders = cursor.fetchall()
-
-            for reminder_id, user_id, text, reminder_time, recurrente in reminders:
-                self._schedule_reminder(user_id, reminder_time, text, reminder_id, recurrente)
-
+            self.scheduler.iniciar()
         except Exception as e: # pylint: disable=broad-except
             self.config.logger.error(f"Error cargando recordatorios: {str(e)}")
 
 #------------------
-    def _schedule_reminder(self, user_id, reminder_time, text, reminder_id=None, recurrente=False):
-        """Programa un recordatorio para enviarse a la hora especificada"""
-        try:
-            now = datetime.now()
-            target_time = datetime.strptime(reminder_time, "%H:%M").time()
-            target_datetime = datetime.combine(now.date(), target_time)
-
-            if target_datetime < now:
-                target_datetime += timedelta(days=1)
-
-            delay = (target_datetime - now).total_seconds()
-
-            if recurrente:
-                t = Timer(delay, self._setup_recurrent_reminder,
-                          args=(user_id, reminder_time, text, reminder_id))
-            else:
-                t = Timer(delay, self._send_reminder, args=(user_id, text, reminder_id))
-
-            t.start()
-            self.active_reminders[(user_id, text)] = t
-
-        except Exception as e:# pylint: disable=broad-except
-            self.config.logger.error(f"Error programando recordatorio: {str(e)}")
-
-    def _setup_recurrent_reminder(self, user_id, reminder_time, text, reminder_id=None):
-        """Configura un recordatorio recurrente diario"""
-        try:
-            #Update: Enviar el recordatorio actual
-            self._send_reminder(user_id, text, reminder_id)
-
-            #Update: Programar para el siguiente día
-            next_day = datetime.now() + timedelta(days=1)
-            delay = (next_day - datetime.now()).total_seconds()
-
-            t = Timer(delay, self._setup_recurrent_reminder,
-                      args=(user_id, reminder_time, text, reminder_id))
-            t.start()
-            self.active_reminders[(user_id, text)] = t
-
-        except Exception as e: # pylint: disable=broad-except
-            self.config.logger.error(f"Error en recordatorio recurrente: {str(e)}")
-
-    def _send_reminder(self, user_id, text, reminder_id=None):
-        """Envía el recordatorio al usuario y lo marca como completado"""
-        try:
-            _ = self._get_user_translation(user_id)
-            self.bot.send_message(user_id, _("🔔 Recordatorio: {text}").format(text=text))
-
-            if reminder_id:
-                cursor = self.db.conn.cursor()
-                cursor.execute(
-                    "UPDATE recordatorios SET completado = 1 WHERE id = ? AND recurrente = 0",
-                    (reminder_id,)
-                )
-                self.db.conn.commit()
+    def _schedule_reminders_batch(self, user_id, reminders):
+        """Programa de una vez los recordatorios (id, ..., next_fire_at) creados en lote"""
+        self.scheduler.programar_lote(
+            (reminder[0], user_id, reminder[-1]) for reminder in reminders
+        )
 
-        except Exception as e:# pylint: disable=broad-except
-            self.config.logger.error(f"Error enviando recordatorio: {str(e)}")
-        finally:
-            if (user_id, text) in self.active_reminders:
-                del self.active_reminders[(user_id, text)]
+    def _get_user_timezone(self, user_id):
+        """Obtiene el nombre de la zona horaria elegida por el usuario (o None)"""
+        return self.usuarios.zona(user_id)
+
+    def _set_user_timezone(self, user_id, zona):
+        """
+        Guarda la zona horaria del usuario y recalcula en una sola pasada el
+        próximo disparo UTC de todos sus recordatorios pendientes.
+        Devuelve cuántos recordatorios se reprogramaron.
+        """
+        if obtener_zona(zona) is None:
+            raise ValueError(zona)
+
+        nuevos = self.recordatorios.cambiar_zona(
+            user_id, zona,
+            lambda hora, recurrente, regla: proximo_disparo(
+                hora, regla_efectiva(regla, recurrente), zona=obtener_zona(zona))
+        )
+        # Las entradas antiguas del planificador quedan obsoletas y se descartan
+        self.scheduler.programar_lote(
+            (reminder_id, user_id, fire_at) for reminder_id, fire_at in nuevos
+        )
+        return len(nuevos)
 
 #------------------
 
+    @instrumentado
     def _verify_2fa(self, message, db_user_id):
         """Verifica el código 2FA del usuario"""
         try:
             user_code = message.text
-            cursor = self.db.conn.cursor()
-            cursor.execute("SELECT secret FROM auth_2fa WHERE usuario_id = ?", (db_user_id,))
-            secret = cursor.fetchone()[0]
+            secret = self.usuarios.secreto_2fa(db_user_id)
 
             if pyotp.TOTP(secret).verify(user_code):
                 self._show_main_menu(message, db_user_id)
@@ -266,6 +544,7 @@ class RecoNotasBot:
 
         # Manejador para los botones del menú
         @self.bot.message_handler(func=lambda message: True)
+        @instrumentado
         def handle_menu_buttons(message):
             try:
                 text = message.text.lower()
@@ -305,21 +584,19 @@ class RecoNotasBot:
                 )
 
         @self.bot.message_handler(func=lambda message: message.text.lower() == 'apple')
+        @instrumentado
         def show_2fa_test_code(message):
             """Muestra el código 2FA actual para propósitos de prueba"""
+            # Usuario y secreto cifrado en una sola consulta
+            usuario, encrypted_secret = self.usuarios.con_2fa(message.from_user.id)
+            _ = self._traduccion(usuario.lenguaje if usuario else None)
+            if usuario is None:
+                self._pedir_registro(message, _)
+                return
             try:
-                user_id = message.from_user.id
-                _ = self._get_user_translation(user_id)
-
-                cursor = self.db.conn.cursor()
-                cursor.execute("SELECT id FROM usuarios WHERE telegram_id = ?", (user_id,))
-                db_user_id = cursor.fetchone()[0]
+                db_user_id = usuario.id
 
-                # Obtener el secreto cifrado de la base de datos
-                cursor.execute("SELECT secret FROM auth_2fa WHERE usuario_id = ?", (db_user_id,))
-                result = cursor.fetchone()
-
-                if not result:
+                if not encrypted_secret:
                     self.bot.reply_to(
                         message,
                         _("❌ 2FA no está configurado. Usa /setup2fa primero"),
@@ -328,7 +605,6 @@ class RecoNotasBot:
                     return
 
                 # Descifrar el secreto
-                encrypted_secret = result[0]
                 secret = self.cifrado.descifrar(encrypted_secret.encode('utf-8'))
 
                 # Generar código actual
@@ -374,6 +650,7 @@ class RecoNotasBot:
                 )
 
         @self.bot.message_handler(func=lambda message: message.text.lower() == 'apple')
+        @instrumentado
         def request_2fa_test_code(message):
             """Solicita confirmación antes de mostrar el código"""
             markup = telebot.types.ReplyKeyboardMarkup(one_time_keyboard=True)
@@ -386,6 +663,7 @@ class RecoNotasBot:
             )
             self.bot.register_next_step_handler(msg, process_2fa_confirmation)
 
+        @instrumentado
         def process_2fa_confirmation(message):
             if message.text == 'Confirmar Mostrar Código':
                 show_2fa_test_code(message)  # Usar la función anterior
@@ -397,12 +675,10 @@ class RecoNotasBot:
                 )
 
         @self.bot.message_handler(commands=['setup2fa'])
+        @instrumentado
         def setup_2fa(message):
             try:
                 user_id = message.from_user.id
-                cursor = self.db.conn.cursor()
-                cursor.execute("SELECT id FROM usuarios WHERE telegram_id = ?", (user_id,))
-                db_user_id = cursor.fetchone()[0]
 
                 # Generar nuevo secreto
                 secret = pyotp.random_base32()
@@ -410,12 +686,7 @@ class RecoNotasBot:
                 provisioning_uri = totp.provisioning_uri(name=str(user_id), issuer_name="RecoNotas")
 
                 # Guardar en DB
-                cursor.execute(
-                    """INSERT OR REPLACE INTO auth_2fa (usuario_id, secret, activado) 
-                    VALUES (?, ?, 1)""",
-                    (db_user_id, secret)
-                )
-                self.db.conn.commit()
+                self.usuarios.guardar_2fa(user_id, secret)
 
                 self.bot.reply_to(
                     message,
@@ -430,14 +701,17 @@ class RecoNotasBot:
                 self.bot.reply_to(message, "❌ Error al configurar 2FA")
 
         @self.bot.message_handler(commands=['settings'])
+        @instrumentado
         def show_settings(message):
+            usuario = self.usuarios.obtener(message.from_user.id)
+            _ = self._traduccion(usuario.lenguaje if usuario else None)
+            if usuario is None:
+                self._pedir_registro(message, _)
+                return
             try:
-                user_id = message.from_user.id
-                _ = self._get_user_translation(user_id)
-
-                cursor = self.db.conn.cursor()
-                cursor.execute("SELECT lenguaje FROM usuarios WHERE telegram_id = ?", (user_id,))
-                current_lang = cursor.fetchone()[0] or self.config.default_lang
+                current_lang, current_tz = usuario.lenguaje, usuario.zona_horaria
+                current_lang = current_lang or self.config.default_lang
+                current_tz = current_tz or self.config.zona_defecto or _("hora del servidor")
 
                 markup = telebot.types.InlineKeyboardMarkup()
                 markup.row(
@@ -445,19 +719,56 @@ class RecoNotasBot:
                     telebot.types.InlineKeyboardButton("Español", callback_data="setlang_es"),
                     telebot.types.InlineKeyboardButton("Português", callback_data="setlang_pt")
                 )
+                zonas = self.config.zonas_sugeridas
+                for i in range(0, len(zonas), 2):
+                    markup.row(*(
+                        telebot.types.InlineKeyboardButton(zona, callback_data=f"settz_{zona}")
+                        for zona in zonas[i:i + 2]
+                    ))
 
                 self.bot.reply_to(
                     message,
                     _("⚙️ Configuración actual:\n"
                         "Idioma: {lang}\n"
-                        "Selecciona un nuevo idioma:").format(lang=current_lang.upper()),
+                        "Selecciona un nuevo idioma:").format(lang=current_lang.upper())
+                    + "\n\n" + _("🌍 Zona horaria: {tz}\n"
+                        "Elige una zona o usa /timezone Zona/Ciudad").format(tz=current_tz),
                     reply_markup=markup
                 )
             except Exception as e: # pylint: disable=broad-except
                 self.config.logger.error(f"Error en show_settings: {str(e)}")
                 self.bot.reply_to(message, "❌ Error al cargar configuración")
 
+        @self.bot.callback_query_handler(func=lambda call: call.data.startswith('settz_'))
+        @instrumentado
+        def set_timezone_button(call):
+            try:
+                _ = self._get_user_translation(call.from_user.id)
+                zona = call.data[len('settz_'):]
+                total = self._set_user_timezone(call.from_user.id, zona)
+                self.bot.answer_callback_query(
+                    call.id,
+                    _("Zona horaria cambiada a {tz}").format(tz=zona),
+                    show_alert=True
+                )
+                self.bot.edit_message_text(
+                    chat_id=call.message.chat.id,
+                    message_id=call.message.message_id,
+                    text=_("Configuración actualizada") + f"\n🌍 {zona}\n" +
+                    _("⏰ {count} recordatorios reprogramados").format(count=total)
+                )
+            except ValueError:
+                self.bot.answer_callback_query(call.id, "❌ Zona horaria no válida", show_alert=True)
+            except Exception as e: # pylint: disable=broad-except
+                self.config.logger.error(f"Error en set_timezone_button: {str(e)}")
+                self.bot.answer_callback_query(
+                    call.id,
+                    "❌ Error al cambiar la zona horaria",
+                    show_alert=True
+                )
+
         @self.bot.callback_query_handler(func=lambda call: call.data.startswith('setlang_'))
+        @instrumentado
         def set_language(call):
             try:
                 lang = call.data.split('_')[1]
@@ -465,12 +776,7 @@ class RecoNotasBot:
                 _ = self.translations.get(lang, self.translations[self.config.default_lang]).gettext
 
                 if lang in self.config.supported_langs:
-                    cursor = self.db.conn.cursor()
-                    cursor.execute(
-                        "UPDATE usuarios SET lenguaje = ? WHERE telegram_id = ?",
-                        (lang, user_id)
-                    )
-                    self.db.conn.commit()
+                    self.usuarios.cambiar_idioma(user_id, lang)
 
                     self.bot.answer_callback_query(
                         call.id,
@@ -499,6 +805,7 @@ class RecoNotasBot:
                 )
 
         @self.bot.message_handler(commands=['addnote', 'newnote'])
+        @instrumentado
         def add_note(message):
             try:
                 _ = self._get_user_translation(message.from_user.id)
@@ -517,20 +824,12 @@ class RecoNotasBot:
                 )
 
         @self.bot.message_handler(commands=['listnotes', 'mynotes'])
+        @instrumentado
         def list_notes(message):
             try:
-                user_id = message.from_user.id
-                _ = self._get_user_translation(user_id)
-
-                cursor = self.db.conn.cursor()
-                cursor.execute("SELECT id FROM usuarios WHERE telegram_id = ?", (user_id,))
-                db_user_id = cursor.fetchone()[0]
-
-                cursor.execute(
-                    "SELECT id, contenido_cifrado, fecha_creacion FROM notas WHERE usuario_id = ?",
-                    (db_user_id,)
-                )
-                notes = cursor.fetchall()
+                # Usuario (idioma y sal) y notas en un solo JOIN
+                usuario, notes = self.notas.listar(message.from_user.id)
+                _ = self._traduccion(usuario.lenguaje if usuario else None)
 
                 if not notes:
                     self.bot.reply_to(
@@ -541,12 +840,8 @@ class RecoNotasBot:
                     return
 
                 response = _("📖 *Tus notas:*\n\n")
-                for note_id, encrypted_note, fecha in notes:
-                    decrypted_note = self.cifrado.descifrar(encrypted_note)
-                    short_note = (
-                        decrypted_note[:50] + '...') if len(decrypted_note) > 50 else decrypted_note
-                    response += _("🆔 {id}\n📅 {date}\n📝 {note}\n\n").format(
-                        id=note_id, date=fecha, note=short_note)
+                response += self._format_notes(self._get_user_cipher(usuario), notes, _)
+                response += _("👁 /viewnote [id] para leer una nota completa")
 
                 self.bot.reply_to(
                     message,
@@ -563,21 +858,84 @@ class RecoNotasBot:
                     reply_markup=self._get_main_menu()
                 )
 
-        @self.bot.message_handler(commands=['deletenote', 'delnote'])
-        def delete_note(message):
+        @self.bot.message_handler(commands=['searchnotes', 'search'])
+        @instrumentado
+        def search_notes(message):
             try:
-                user_id = message.from_user.id
-                _ = self._get_user_translation(user_id)
+                usuario = self.usuarios.obtener(message.from_user.id)
+                _ = self._traduccion(usuario.lenguaje if usuario else None)
+                partes = message.text.split(maxsplit=1)
+                cifrador = self._get_user_cipher(usuario)
+                grupos = cifrador.tokens_busqueda(partes[1]) if len(partes) > 1 else []
+                if not grupos or len(grupos) > notas_largas.MAX_TERMINOS_BUSQUEDA:
+                    self.bot.reply_to(
+                        message,
+                        _("🔎 Uso: /searchnotes [palabras] (hasta {max} palabras)").format(
+                            max=notas_largas.MAX_TERMINOS_BUSQUEDA),
+                        reply_markup=self._get_main_menu()
+                    )
+                    return
 
-                cursor = self.db.conn.cursor()
-                cursor.execute("SELECT id FROM usuarios WHERE telegram_id = ?", (user_id,))
-                db_user_id = cursor.fetchone()[0]
+                # El índice ciego resuelve los ids; solo se descifran las coincidencias
+                notes = self.notas.buscar(
+                    usuario.id, grupos, notas_largas.MAX_RESULTADOS_BUSQUEDA
+                )
+                if not notes:
+                    self.bot.reply_to(
+                        message,
+                        _("🔎 Ninguna nota contiene esas palabras"),
+                        reply_markup=self._get_main_menu()
+                    )
+                    return
 
-                cursor.execute(
-                    "SELECT id, contenido_cifrado FROM notas WHERE usuario_id = ?",
-                    (db_user_id,)
+                response = _("🔎 *Notas encontradas:*\n\n")
+                response += self._format_notes(cifrador, notes, _)
+                if len(notes) == notas_largas.MAX_RESULTADOS_BUSQUEDA:
+                    response += _("Se muestran las {count} más recientes\n").format(
+                        count=len(notes))
+                response += _("👁 /viewnote [id] para leer una nota completa")
+                self.bot.reply_to(
+                    message,
+                    response,
+                    parse_mode="Markdown",
+                    reply_markup=self._get_main_menu()
+                )
+            except Exception as e: # pylint: disable=broad-except
+                self.config.logger.error(f"Error en search_notes: {str(e)}")
+                self.bot.reply_to(
+                    message,
+                    _("❌ Error al buscar en las notas"),
+                    reply_markup=self._get_main_menu()
                 )
-                notes = cursor.fetchall()
+
+        @self.bot.message_handler(commands=['viewnote'])
+        @instrumentado
+        def view_note(message):
+            try:
+                _ = self._get_user_translation(message.from_user.id)
+                partes = message.text.split(maxsplit=1)
+                if len(partes) < 2 or not partes[1].strip().isdigit():
+                    self.bot.reply_to(
+                        message,
+                        _("👁 Uso: /viewnote [id] (el id aparece en /mynotes)"),
+                        reply_markup=self._get_main_menu()
+                    )
+                    return
+                self._send_note(message, int(partes[1]))
+            except Exception as e: # pylint: disable=broad-except
+                self.config.logger.error(f"Error en view_note: {str(e)}")
+                self.bot.reply_to(
+                    message,
+                    _("❌ Error al mostrar la nota"),
+                    reply_markup=self._get_main_menu()
+                )
+
+        @self.bot.message_handler(commands=['deletenote', 'delnote'])
+        @instrumentado
+        def delete_note(message):
+            try:
+                usuario, notes = self.notas.listar(message.from_user.id)
+                _ = self._traduccion(usuario.lenguaje if usuario else None)
 
                 if not notes:
                     self.bot.reply_to(
@@ -589,8 +947,9 @@ class RecoNotasBot:
 
                 # Crear teclado con las notas disponibles
                 markup = telebot.types.ReplyKeyboardMarkup(one_time_keyboard=True)
-                for note_id, encrypted_note in notes:
-                    decrypted_note = self.cifrado.descifrar(encrypted_note)
+                cifrador = self._get_user_cipher(usuario)
+                for note_id, encrypted_note, _fecha, _fragmentos, _adjuntos in notes:
+                    decrypted_note = cifrador.descifrar(encrypted_note)
                     short_note = (
                         decrypted_note[:20] + '...') if len(decrypted_note) > 20 else decrypted_note
                     markup.add(f"{note_id}: {short_note}")
@@ -611,24 +970,26 @@ class RecoNotasBot:
                 )
 
         @self.bot.message_handler(commands=['addreminder', 'newreminder'])
+        @instrumentado
         def add_reminder(message):
             try:
                 _ = self._get_user_translation(message.from_user.id)
-                # Verificar si el mensaje incluye parámetros
-                if len(message.text.split()) > 1:
-                    parts = message.text.split(maxsplit=2)
-                    if len(parts) >= 3:
-                        text = parts[1]
-                        time_part = parts[2]
-                        recurrente = "--recurrente" in message.text
-
-                        # Validar formato de hora
-                        try:
-                            datetime.strptime(time_part, "%H:%M")
-                            self._process_reminder_time_step(message, text, recurrente)
-                            return
-                        except ValueError:
-                            pass
+                # Varias líneas: un recordatorio por línea, creados en lote
+                if '\n' in message.text and len(message.text.split(maxsplit=1)) > 1:
+                    self._import_reminders(
+                        message, *importers.parsear_lineas(message.text.split(maxsplit=1)[1])
+                    )
+                    return
+
+                # Verificar si el mensaje incluye parámetros: texto HH:MM [opción]
+                if len(message.text.split()) > 2:
+                    validos, _errores = importers.parsear_lineas(
+                        message.text.split(maxsplit=1)[1]
+                    )
+                    if validos:
+                        text, reminder_time, regla = validos[0]
+                        self._process_reminder_time_step(message, text, regla, reminder_time)
+                        return
 
                 msg = self.bot.reply_to(
                     message,
@@ -647,23 +1008,11 @@ class RecoNotasBot:
                 )
 
         @self.bot.message_handler(commands=['listreminders', 'myreminders'])
+        @instrumentado
         def list_reminders(message):
             try:
-                user_id = message.from_user.id
-                _ = self._get_user_translation(user_id)
-
-                cursor = self.db.conn.cursor()
-                cursor.execute("SELECT id FROM usuarios WHERE telegram_id = ?", (user_id,))
-                db_user_id = cursor.fetchone()[0]
-
-                cursor.execute(
-                    """SELECT id, texto, hora_recordatorio, recurrente 
-                    FROM recordatorios 
-                    WHERE usuario_id = ? AND completado = 0
-                    ORDER BY hora_recordatorio""",
-                    (db_user_id,)
-                )
-                reminders = cursor.fetchall()
+                usuario, reminders = self.recordatorios.pendientes(message.from_user.id)
+                _ = self._traduccion(usuario.lenguaje if usuario else None)
 
                 if not reminders:
                     self.bot.reply_to(
@@ -674,8 +1023,9 @@ class RecoNotasBot:
                     return
 
                 response = _("⏰ *Tus recordatorios pendientes:*\n\n")
-                for reminder_id, text, reminder_time, recurrente in reminders:
-                    recurrente_text = _("(Recurrente)") if recurrente else ""
+                for reminder_id, text, reminder_time, recurrente, regla in reminders:
+                    regla = regla_efectiva(regla, recurrente)
+                    recurrente_text = f"(🔁 {regla.describir()})" if regla else ""
                     response += _("🆔 {id}\n⏰ {time} {recurrent}\n📝 {text}\n\n").format(
                         id=reminder_id, time=reminder_time, recurrent=recurrente_text, text=text)
 
@@ -695,22 +1045,11 @@ class RecoNotasBot:
                 )
 
         @self.bot.message_handler(commands=['deletereminder', 'delreminder'])
+        @instrumentado
         def delete_reminder(message):
             try:
-                user_id = message.from_user.id
-                _ = self._get_user_translation(user_id)
-
-                cursor = self.db.conn.cursor()
-                cursor.execute("SELECT id FROM usuarios WHERE telegram_id = ?", (user_id,))
-                db_user_id = cursor.fetchone()[0]
-
-                cursor.execute(
-                    """SELECT id, texto, hora_recordatorio 
-                    FROM recordatorios 
-                    WHERE usuario_id = ? AND completado = 0""",
-                    (db_user_id,)
-                )
-                reminders = cursor.fetchall()
+                usuario, reminders = self.recordatorios.pendientes(message.from_user.id)
+                _ = self._traduccion(usuario.lenguaje if usuario else None)
 
                 if not reminders:
                     self.bot.reply_to(
@@ -721,7 +1060,7 @@ class RecoNotasBot:
                     return
 
                 markup = telebot.types.ReplyKeyboardMarkup(one_time_keyboard=True)
-                for reminder_id, text, reminder_time in reminders:
+                for reminder_id, text, reminder_time, *_regla in reminders:
                     display_text = f"{reminder_id}: {text} @ {reminder_time}"
                     markup.add(display_text)
 
@@ -740,6 +1079,7 @@ class RecoNotasBot:
                 )
 
         @self.bot.message_handler(commands=['clearall'])
+        @instrumentado
         def clear_all_data(message):
             try:
                 user_id = message.from_user.id
@@ -765,6 +1105,7 @@ class RecoNotasBot:
                 self.bot.reply_to(message, _("❌ Error al procesar la solicitud"))
 
         @self.bot.message_handler(commands=['help', 'tutorial'])
+        @instrumentado
         def show_tutorial(message):
             try:
                 _ = self._get_user_translation(message.from_user.id)
@@ -773,9 +1114,13 @@ class RecoNotasBot:
                     "1. *Notas*:\n"
                     "   - /newnote [texto] - Crea una nota\n"
                     "   - /mynotes - Lista tus notas\n"
+                    "   - /viewnote [id] - Muestra una nota completa\n"
+                    "   - /searchnotes [palabras] - Busca notas que contengan esas palabras\n"
+                    "   - Envía una foto o un fichero para guardarlo en una nota\n"
                     "   - /deletenote - Elimina una nota\n\n"
                     "2. *Recordatorios*:\n"
                     "   - /newreminder [texto] [HH:MM] --recurrente\n"
+                    "     (o --laborables, --semanal=LU,MI, --mensual=15, --cada=3h)\n"
                     "   - /myreminders - Lista recordatorios\n"
                     "   - /deletereminder - Elimina un recordatorio\n\n"
                     "3. *Seguridad*:\n"
@@ -797,15 +1142,14 @@ class RecoNotasBot:
         @self.bot.callback_query_handler(
                 func=lambda call: call.data in ['confirm_clear', 'cancel_clear']
         )
+        @instrumentado
         def handle_clear_confirmation(call):
             try:
-                _ = self._get_user_translation(call.from_user.id)
+                usuario = self.usuarios.obtener(call.from_user.id)
+                _ = self._traduccion(usuario.lenguaje if usuario else None)
 
                 if call.data == 'confirm_clear':
-                    user_id = call.from_user.id
-                    cursor = self.db.conn.cursor()
-                    cursor.execute("SELECT id FROM usuarios WHERE telegram_id = ?", (user_id,))
-                    db_user_id = cursor.fetchone()[0]
+                    db_user_id = usuario.id
 
                     # Registrar consentimiento de eliminación
                     self.db.registrar_auditoria(
@@ -814,14 +1158,12 @@ class RecoNotasBot:
                         {"ip": "Telegram", "user_agent": "Telegram"}
                     )
 
-                    # Eliminar todos los datos
-                    cursor.execute("DELETE FROM notas WHERE usuario_id = ?", (db_user_id,))
-                    cursor.execute("DELETE FROM recordatorios WHERE usuario_id = ?", (db_user_id,))
-                    cursor.execute("DELETE FROM auth_2fa WHERE usuario_id = ?", (db_user_id,))
-                    cursor.execute("DELETE FROM auditoria WHERE usuario_id = ?", (db_user_id,))
-                    cursor.execute("DELETE FROM usuarios WHERE id = ?", (db_user_id,))
-
-                    self.db.conn.commit()
+                    # Elimina todos sus datos (ver UsersRepo.eliminar_datos)
+                    self.usuarios.eliminar_datos(db_user_id)
+                    # El WAL se trunca en segundo plano, sin hacer esperar al usuario
+                    self.mantenimiento.pedir_truncado()
+                    self.cifrado.olvidar_usuario(db_user_id)
+                    self._collect_attachments()
 
                     self.bot.edit_message_text(
                         chat_id=call.message.chat.id,
@@ -835,7 +1177,6 @@ class RecoNotasBot:
                         text=_("✅ Operación cancelada. Tus datos están seguros.")
                     )
             except Exception as e: # pylint: disable=broad-except
-                self.db.conn.rollback()
                 self.config.logger.error(f"Error en handle_clear_confirmation: {str(e)}")
                 self.bot.answer_callback_query(
                     call.id,
@@ -844,12 +1185,17 @@ class RecoNotasBot:
                 )
 
 #------------------
+    @instrumentado
     def _process_note_step(self, message):
         """Procesa el texto de la nota recibido"""
+        user_id = message.from_user.id
+        usuario = self.usuarios.obtener(user_id)
+        _ = self._traduccion(usuario.lenguaje if usuario else None)
+        if usuario is None:
+            self._pedir_registro(message, _)
+            return
         try:
-            user_id = message.from_user.id
             note_text = message.text
-            _ = self._get_user_translation(user_id)
 
             if not note_text or len(note_text.strip()) == 0:
                 self.bot.reply_to(
@@ -859,38 +1205,15 @@ class RecoNotasBot:
                 )
                 return
 
-            if len(note_text) > 2000:
-                self.bot.reply_to(
-                    message,
-                    _("❌ La nota es demasiado larga (máximo 2000 caracteres)"),
-                    reply_markup=self._get_main_menu()
-                )
-                return
-
-            cursor = self.db.conn.cursor()
-            cursor.execute("SELECT id FROM usuarios WHERE telegram_id = ?", (user_id,))
-            db_user_id = cursor.fetchone()[0]
-
-            encrypted_note = self.cifrado.cifrar(note_text)
-            cursor.execute(
-                "INSERT INTO notas (usuario_id, contenido_cifrado) VALUES (?, ?)",
-                (db_user_id, encrypted_note)
-            )
-            self.db.conn.commit()
+            nota = notas_largas.cifrar_nota(self._get_user_cipher(usuario), note_text)
+            self.notas.crear(usuario.id, user_id, nota, len(note_text))
 
             self.bot.reply_to(
                 message,
                 _("✅ Nota guardada correctamente"),
                 reply_markup=self._get_main_menu()
             )
-
-            self.db.registrar_auditoria(
-                db_user_id,
-                "NOTA_CREADA",
-                {"tamaño": len(note_text)}
-            )
         except Exception as e: # pylint: disable=broad-except
-            self.db.conn.rollback()
             self.config.logger.error(f"Error en _process_note_step: {str(e)}")
             self.bot.reply_to(
                 message,
@@ -898,6 +1221,7 @@ class RecoNotasBot:
                 reply_markup=self._get_main_menu()
             )
 
+    @instrumentado
     def _process_delete_note_step(self, message):
         """Procesa la selección de nota a eliminar"""
         try:
@@ -908,25 +1232,15 @@ class RecoNotasBot:
             # Extraer el ID de la nota del texto seleccionado
             note_id = int(selected_note.split(":")[0])
 
-            cursor = self.db.conn.cursor()
-            cursor.execute("SELECT id FROM usuarios WHERE telegram_id = ?", (user_id,))
-            db_user_id = cursor.fetchone()[0]
-
-            # Verificar que la nota pertenece al usuario antes de eliminar
-            cursor.execute(
-                "DELETE FROM notas WHERE id = ? AND usuario_id = ?",
-                (note_id, db_user_id)
-            )
-
-            if cursor.rowcount == 0:
+            # Solo se borra si la nota pertenece al usuario; la auditoría va en la misma transacción
+            if not self.notas.eliminar(user_id, note_id):
                 self.bot.reply_to(
                     message,
                     _("❌ La nota no existe o no tienes permisos para eliminarla"),
                     reply_markup=self._get_main_menu()
                 )
                 return
-
-            self.db.conn.commit()
+            self._collect_attachments()
 
             self.bot.reply_to(
                 message,
@@ -934,13 +1248,6 @@ class RecoNotasBot:
                 reply_markup=self._get_main_menu()
             )
 
-            # Registrar en auditoría
-            self.db.registrar_auditoria(
-                db_user_id,
-                "NOTA_ELIMINADA",
-                {"nota_id": note_id}
-            )
-
         except ValueError:
             self.bot.reply_to(
                 message,
@@ -948,7 +1255,6 @@ class RecoNotasBot:
                 reply_markup=self._get_main_menu()
             )
         except Exception as e: # pylint: disable=broad-except
-            self.db.conn.rollback()
             self.config.logger.error(f"Error en _process_delete_note_step: {str(e)}")
             self.bot.reply_to(
                 message,
@@ -956,6 +1262,7 @@ class RecoNotasBot:
                 reply_markup=self._get_main_menu()
             )
 
+    @instrumentado
     def _process_reminder_text_step(self, message):
         """Procesa el texto del recordatorio y pide la hora"""
         try:
@@ -987,6 +1294,7 @@ class RecoNotasBot:
                 reply_markup=self._get_main_menu()
             )
 
+    @instrumentado
     def _process_delete_reminder_step(self, message):
         """Procesa la selección de recordatorio a eliminar"""
         try:
@@ -997,25 +1305,8 @@ class RecoNotasBot:
             # Extraer el ID del recordatorio del texto seleccionado
             reminder_id = int(selected_reminder.split(":")[0])
 
-            cursor = self.db.conn.cursor()
-            cursor.execute("SELECT id FROM usuarios WHERE telegram_id = ?", (user_id,))
-            db_user_id = cursor.fetchone()[0]
-
-            # Cancelar el recordatorio si está programado
-            for (uid, text), timer in list(self.active_reminders.items()):
-                if uid == user_id:
-                    cursor.execute("SELECT id FROM recordatorios WHERE id = ?", (reminder_id,))
-                    if cursor.fetchone():
-                        timer.cancel()
-                        del self.active_reminders[(uid, text)]
-
-            # Eliminar de la base de datos
-            cursor.execute(
-                "DELETE FROM recordatorios WHERE id = ? AND usuario_id = ?",
-                (reminder_id, db_user_id)
-            )
-
-            if cursor.rowcount == 0:
+            # Al eliminarlo de la base de datos el planificador lo descarta al vencer
+            if not self.recordatorios.eliminar(user_id, reminder_id):
                 self.bot.reply_to(
                     message,
                     _("❌ El recordatorio no existe o no tienes permisos para eliminarlo"),
@@ -1023,21 +1314,12 @@ class RecoNotasBot:
                 )
                 return
 
-            self.db.conn.commit()
-
             self.bot.reply_to(
                 message,
                 _("✅ Recordatorio {id} eliminado correctamente").format(id=reminder_id),
                 reply_markup=self._get_main_menu()
             )
 
-            # Registrar en auditoría
-            self.db.registrar_auditoria(
-                db_user_id,
-                "RECORDATORIO_ELIMINADO",
-                {"reminder_id": reminder_id}
-            )
-
         except ValueError:
             self.bot.reply_to(
                 message,
@@ -1045,7 +1327,6 @@ class RecoNotasBot:
                 reply_markup=self._get_main_menu()
             )
         except Exception as e:  # pylint: disable=broad-except
-            self.db.conn.rollback()
             self.config.logger.error(f"Error en _process_delete_reminder_step: {str(e)}")
             self.bot.reply_to(
                 message,
@@ -1053,15 +1334,23 @@ class RecoNotasBot:
                 reply_markup=self._get_main_menu()
             )
 
-    def _process_reminder_time_step(self, message, reminder_text, recurrente=False):
-        """Procesa la hora del recordatorio y lo guarda"""
+    @instrumentado
+    def _process_reminder_time_step(self, message, reminder_text, regla=None,
+                                    reminder_time=None):
+        """Procesa la hora (y la opción de recurrencia) del recordatorio y lo guarda"""
+        # Idioma, id y zona del usuario en una sola consulta
+        usuario = self.usuarios.obtener(message.from_user.id)
+        _ = self._traduccion(usuario.lenguaje if usuario else None)
+        if usuario is None:
+            self._pedir_registro(message, _)
+            return
         try:
-            reminder_time = message.text
-            _ = self._get_user_translation(message.from_user.id)
-
-            # Validar formato de hora
+            # Validar formato de hora y opción de recurrencia (ej. 14:30 --laborables)
             try:
-                datetime.strptime(reminder_time, "%H:%M")
+                if reminder_time is None:
+                    tokens, regla = extraer_regla(message.text.split())
+                    reminder_time = tokens[0] if len(tokens) == 1 else ''
+                reminder_time = datetime.strptime(reminder_time, "%H:%M").strftime("%H:%M")
             except ValueError:
                 self.bot.reply_to(
                     message,
@@ -1070,36 +1359,22 @@ class RecoNotasBot:
                 )
                 return
 
-            cursor = self.db.conn.cursor()
-            cursor.execute("SELECT id FROM usuarios WHERE telegram_id = ?", (message.from_user.id,))
-            db_user_id = cursor.fetchone()[0]
-
-            cursor.execute(
-                "INSERT INTO recordatorios (usuario_id, texto, hora_recordatorio, recurrente) VALUES (?, ?, ?, ?)",
-                (db_user_id, reminder_text, reminder_time, recurrente)
+            next_fire_at = proximo_disparo(
+                reminder_time, regla, zona=self.scheduler.zona(usuario.zona_horaria)
             )
-            reminder_id = cursor.lastrowid
-            self.db.conn.commit()
-
-            self._schedule_reminder(
-                message.from_user.id, reminder_time, reminder_text, reminder_id, recurrente
+            reminder_id = self.recordatorios.crear(
+                usuario.id, message.from_user.id, reminder_text, reminder_time, regla, next_fire_at
             )
 
+            self.scheduler.programar(reminder_id, message.from_user.id, next_fire_at)
+
             self.bot.reply_to(
                 message,
                 _("✅ Recordatorio programado para las {time}\n📝 Texto: {text}").format(
                     time=reminder_time, text=reminder_text),
                 reply_markup=self._get_main_menu()
             )
-
-            self.db.registrar_auditoria(
-                db_user_id,
-                "RECORDATORIO_CREADO",
-                {"hora": reminder_time, "tamaño_texto":
-                 len(reminder_text), "recurrente": recurrente}
-            )
         except Exception as e: # pylint: disable=broad-except
-            self.db.conn.rollback()
             self.config.logger.error(f"Error en _process_reminder_time_step: {str(e)}")
             self.bot.reply_to(
                 message,
@@ -1107,6 +1382,273 @@ class RecoNotasBot:
                 reply_markup=self._get_main_menu()
             )
 
+    def _import_reminders(self, message, reminders, errores):
+        """Guarda en una sola transacción los recordatorios ya validados y los programa"""
+        user_id = message.from_user.id
+        usuario = self.usuarios.obtener(user_id)
+        _ = self._traduccion(usuario.lenguaje if usuario else None)
+        if usuario is None:
+            self._pedir_registro(message, _)
+            return
+
+        if not reminders:
+            detalle = "\n".join(
+                _("Línea {line}: {error}").format(line=linea, error=error)
+                for linea, error in errores[:10]
+            )
+            self.bot.reply_to(
+                message,
+                _("❌ No se encontró ningún recordatorio válido") + f"\n{detalle}",
+                reply_markup=self._get_main_menu()
+            )
+            return
+
+        zona = self.scheduler.zona(usuario.zona_horaria)
+
+        creados = self.recordatorios.crear_lote(
+            usuario.id,
+            [(text, hora, regla is not None, str(regla) if regla else None,
+              proximo_disparo(hora, regla, zona=zona))
+             for text, hora, regla in reminders]
+        )
+        self._schedule_reminders_batch(user_id, creados)
+
+        response = _("✅ {count} recordatorios programados").format(count=len(creados))
+        if errores:
+            response += "\n" + _("⚠️ {count} líneas ignoradas:").format(count=len(errores))
+            for linea, error in errores[:10]:
+                response += "\n" + _("Línea {line}: {error}").format(line=linea, error=error)
+
+        self.bot.reply_to(message, response, reply_markup=self._get_main_menu())
+
+    @staticmethod
+    def _format_notes(cifrador, notes, _) -> str:
+        """Líneas de un listado de notas; solo se descifra la vista previa."""
+        texto = ""
+        previews = cifrador.descifrar_lote(note[1] for note in notes)
+        for (note_id, _preview, fecha, _fragmentos, adjuntos), preview in zip(notes, previews):
+            short_note = (preview[:50] + '...') if len(preview) > 50 else preview
+            if adjuntos:
+                short_note = f"📎 {short_note}"
+            texto += _("🆔 {id}\n📅 {date}\n📝 {note}\n\n").format(
+                id=note_id, date=fecha, note=short_note)
+        return texto
+
+    def _send_note(self, message, note_id):
+        """
+        Envía la nota descifrando fragmento a fragmento: un mensaje por
+        fragmento o, si son muchos, un .txt escrito a medida que se descifran.
+        Después envía sus adjuntos.
+        """
+        usuario, tokens = self.notas.contenido(message.from_user.id, note_id)
+        _ = self._traduccion(usuario.lenguaje if usuario else None)
+        if usuario is None:
+            self._pedir_registro(message, _)
+            return
+        if tokens is None:
+            self.bot.reply_to(
+                message,
+                _("❌ La nota no existe o no tienes permisos para verla"),
+                reply_markup=self._get_main_menu()
+            )
+            return
+
+        textos = notas_largas.descifrar_fragmentos(self._get_user_cipher(usuario), tokens)
+        primeros = list(islice(textos, notas_largas.MAX_MENSAJES_NOTA + 1))
+        if len(primeros) <= notas_largas.MAX_MENSAJES_NOTA:
+            for texto in primeros:
+                self.bot.send_message(message.chat.id, texto)
+        else:
+            with tempfile.SpooledTemporaryFile(max_size=1024 * 1024) as destino:
+                for texto in chain(primeros, textos):
+                    destino.write(texto.encode('utf-8'))
+                destino.seek(0)
+                self.bot.send_document(
+                    message.chat.id,
+                    destino,
+                    visible_file_name=f"nota_{note_id}.txt",
+                    reply_to_message_id=message.message_id
+                )
+
+        for adjunto in self.adjuntos.de_nota(note_id):
+            self._send_attachment(message.chat.id, usuario, adjunto)
+
+    def _send_attachment(self, chat_id, usuario, adjunto):
+        """
+        Reenvía el adjunto por su file_id, sin volver a subirlo. Si Telegram ya
+        no lo acepta, lo sube desde el almacén y guarda el nuevo file_id.
+        """
+        adjunto_id, direccion, tipo, nombre_cifrado, _mime, file_id = adjunto
+        nombre = self._get_user_cipher(usuario).descifrar(nombre_cifrado) if nombre_cifrado else None
+        enviar = (self.bot.send_photo if tipo == "photo"
+                  else partial(self.bot.send_document, visible_file_name=nombre))
+        if file_id:
+            try:
+                enviar(chat_id, file_id)
+                return
+            except telebot.apihelper.ApiTelegramException as e:
+                self.config.logger.warning(
+                    f"file_id del adjunto {adjunto_id} rechazado, se sube de nuevo: {str(e)}"
+                )
+
+        with tempfile.SpooledTemporaryFile(max_size=1024 * 1024) as fichero:
+            self.almacen.copiar_a(direccion, fichero)
+            fichero.seek(0)
+            enviado = enviar(chat_id, fichero)
+        nuevo = enviado.photo[-1] if tipo == "photo" else enviado.document
+        self.adjuntos.guardar_file_id(adjunto_id, nuevo.file_id)
+
+    def _attach_file(self, message, fichero, tipo, nombre, mime):
+        """
+        Guarda una foto o documento como nota: el pie (o el nombre) es el
+        texto de la nota y el fichero va, cifrado, al almacén de adjuntos.
+        """
+        usuario = self.usuarios.obtener(message.from_user.id)
+        _ = self._traduccion(usuario.lenguaje if usuario else None)
+        if usuario is None:
+            self._pedir_registro(message, _)
+            return
+
+        if (fichero.file_size or 0) > MAX_TAMANO_ADJUNTO:
+            self.bot.reply_to(
+                message,
+                _("❌ El fichero es demasiado grande (máximo 20 MB)"),
+                reply_markup=self._get_main_menu()
+            )
+            return
+
+        cifrador = self._get_user_cipher(usuario)
+        texto = message.caption or nombre or _("Foto")
+        nota = notas_largas.cifrar_nota(cifrador, texto)
+        nombre_cifrado = cifrador.cifrar(nombre) if nombre else None
+        file_info = self.bot.get_file(fichero.file_id)
+
+        def registrar(direccion, tamano):
+            return self.adjuntos.crear(usuario.id, message.from_user.id, nota, {
+                "direccion": direccion, "tamano": tamano, "tipo": tipo,
+                "nombre_cifrado": nombre_cifrado, "mime": mime, "file_id": fichero.file_id
+            })
+
+        try:
+            note_id = self.almacen.guardar(self._download_chunks(file_info.file_path), registrar)
+        except ValueError:
+            self.bot.reply_to(
+                message,
+                _("❌ El fichero es demasiado grande (máximo 20 MB)"),
+                reply_markup=self._get_main_menu()
+            )
+            return
+
+        self.bot.reply_to(
+            message,
+            _("✅ Nota {id} guardada con su adjunto").format(id=note_id),
+            reply_markup=self._get_main_menu()
+        )
+
+    def _download_chunks(self, file_path):
+        """Descarga un fichero de Telegram por bloques, sin tenerlo entero en memoria."""
+        apihelper = telebot.apihelper
+        plantilla = apihelper.FILE_URL or "https://api.telegram.org/file/bot{0}/{1}"
+        sesion = apihelper._get_req_session() # pylint: disable=protected-access
+        with sesion.get(plantilla.format(self.config.api_token, file_path),
+                        proxies=apihelper.proxy, stream=True,
+                        timeout=apihelper.READ_TIMEOUT) as respuesta:
+            if respuesta.status_code != 200:
+                raise apihelper.ApiHTTPException('Download file', respuesta)
+            yield from respuesta.iter_content(TAMANO_BLOQUE)
+
+    def _collect_attachments(self):
+        """Borra del almacén los blobs que ya no usa ninguna nota."""
+        try:
+            self.almacen.recolectar(self.adjuntos.huerfanos)
+        except Exception as e: # pylint: disable=broad-except
+            self.config.logger.error(f"Error recolectando adjuntos: {str(e)}")
+
+    def _import_long_note(self, message):
+        """Guarda como nota (troceada si es larga) un fichero .txt"""
+        usuario = self.usuarios.obtener(message.from_user.id)
+        _ = self._traduccion(usuario.lenguaje if usuario else None)
+        if usuario is None:
+            self._pedir_registro(message, _)
+            return
+
+        if (message.document.file_size or 0) > 4 * notas_largas.MAX_LONGITUD_NOTA_LARGA:
+            self.bot.reply_to(
+                message,
+                _("❌ El fichero es demasiado grande"),
+                reply_markup=self._get_main_menu()
+            )
+            return
+
+        file_info = self.bot.get_file(message.document.file_id)
+        texto = self.bot.download_file(file_info.file_path).decode('utf-8-sig')
+        if not texto.strip():
+            self.bot.reply_to(
+                message,
+                _("❌ El texto de la nota no puede estar vacío"),
+                reply_markup=self._get_main_menu()
+            )
+            return
+        if len(texto) > notas_largas.MAX_LONGITUD_NOTA_LARGA:
+            self.bot.reply_to(
+                message,
+                _("❌ La nota es demasiado larga (máximo {max} caracteres)").format(
+                    max=notas_largas.MAX_LONGITUD_NOTA_LARGA),
+                reply_markup=self._get_main_menu()
+            )
+            return
+
+        nota = notas_largas.cifrar_nota(self._get_user_cipher(usuario), texto)
+        note_id = self.notas.crear(usuario.id, message.from_user.id, nota, len(texto))
+        self.bot.reply_to(
+            message,
+            _("✅ Nota {id} guardada ({count} caracteres)").format(id=note_id, count=len(texto)),
+            reply_markup=self._get_main_menu()
+        )
+
+    def _import_notes_document(self, message):
+        """Importa en una sola transacción las notas de un archivo generado con /export"""
+        usuario = self.usuarios.obtener(message.from_user.id)
+        _ = self._traduccion(usuario.lenguaje if usuario else None)
+        if usuario is None:
+            self._pedir_registro(message, _)
+            return
+
+        if (message.document.file_size or 0) > 20 * 1024 * 1024:
+            self.bot.reply_to(
+                message,
+                _("❌ El fichero es demasiado grande (máximo 20 MB)"),
+                reply_markup=self._get_main_menu()
+            )
+            return
+
+        db_user_id = usuario.id
+
+        file_info = self.bot.get_file(message.document.file_id)
+        # Hasta 1 MB en memoria; el resto del archivo pasa a disco
+        with tempfile.SpooledTemporaryFile(max_size=1024 * 1024) as origen:
+            for bloque in self._download_chunks(file_info.file_path):
+                origen.write(bloque)
+            origen.seek(0)
+            try:
+                total = archive.importar_notas(
+                    self.db, self._get_user_cipher(usuario), db_user_id, origen
+                )
+            except (ValueError, OSError, EOFError) as e:
+                self.bot.reply_to(
+                    message,
+                    _("❌ Archivo de notas inválido: {error}").format(error=str(e)),
+                    reply_markup=self._get_main_menu()
+                )
+                return
+
+        self.bot.reply_to(
+            message,
+            _("✅ {count} notas importadas").format(count=total),
+            reply_markup=self._get_main_menu()
+        )
+        self.db.registrar_auditoria(db_user_id, "NOTAS_IMPORTADAS", {"cantidad": total})
+
     def run(self):
         """Inicia el bot"""
         self.config.logger.info(
@@ -1116,6 +1658,10 @@ class RecoNotasBot:
             self.bot.polling(none_stop=True)
         except KeyboardInterrupt:
             self.config.logger.info("Bot detenido por el usuario")
+            self.scheduler.detener()
+            self.mantenimiento.detener()
+            if self.copias:
+                self.copias.detener()
             sys.exit(0)
         except Exception as e: # pylint: disable=broad-except
             self.config.logger.critical(f"Error crítico: {str(e)}")
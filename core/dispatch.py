@@ -0,0 +1,188 @@
+# ------------------------- DESPACHO DE RECORDATORIOS -------------------------
+"""
+Envío de recordatorios y modo de despacho repartido entre varios procesos,
+cada uno con su partición de usuarios, su conexión y su propio TeleBot
+"""
+import gettext
+import logging
+import multiprocessing
+import queue
+import time
+from datetime import datetime
+
+import telebot
+
+from core.leader import ArrendamientoLider, RECURSO_PLANIFICADOR
+from core.scheduler import HISTOGRAMA_ENTREGA, ReminderScheduler, obtener_zona
+from models.database import PERFIL_DEFECTO, SecureDB
+from models.metrics import REGISTRO, ResumenPeriodico
+
+
+def cargar_traducciones(locales_dir, idiomas) -> dict:
+    """Carga el catálogo gettext de cada idioma soportado"""
+    traducciones = {}
+    for lang in idiomas:
+        try:
+            traducciones[lang] = gettext.translation(
+                'reconotas',
+                localedir=locales_dir,
+                languages=[lang],
+                fallback=True
+            )
+        except FileNotFoundError:
+            traducciones[lang] = gettext.NullTranslations()
+    return traducciones
+
+
+def particion_de(telegram_id: int, total: int) -> int:
+    """Partición del usuario; coincide con el filtro SQL del planificador."""
+    return abs(telegram_id) % total
+
+
+class RemitenteRecordatorios:
+    """
+    Da formato al recordatorio en el idioma del usuario (con aviso de retraso
+    en su zona horaria si se entrega tarde) y lo envía con `bot`, midiendo
+    la latencia de la llamada a la API de Telegram.
+    """
+
+    def __init__(self, bot, conn, traducciones: dict, idioma_defecto: str,
+                 zona_defecto: str = None):
+        self.bot = bot
+        self.conn = conn
+        self.traducciones = traducciones
+        self.idioma_defecto = idioma_defecto
+        self.zona_defecto = zona_defecto
+        self._latencia_api = REGISTRO.histograma(
+            "telegram_api_latencia_segundos", "Duración de sendMessage en la Bot API"
+        )
+
+    def __call__(self, telegram_id: int, texto: str, programado: int = None):
+        fila = self.conn.execute(
+            "SELECT lenguaje, zona_horaria FROM usuarios WHERE telegram_id = ?",
+            (telegram_id,)
+        ).fetchone()
+        lang, zona = fila if fila else (self.idioma_defecto, None)
+        _ = self.traducciones.get(lang, self.traducciones[self.idioma_defecto]).gettext
+
+        mensaje = _("🔔 Recordatorio: {text}").format(text=texto)
+        if programado is not None:
+            zona = obtener_zona(zona or self.zona_defecto)
+            mensaje += "\n" + _("⌛ Entregado con retraso (programado para las {time})").format(
+                time=datetime.fromtimestamp(programado, tz=zona).strftime("%H:%M"))
+        inicio = time.perf_counter()
+        try:
+            self.bot.send_message(telegram_id, mensaje)
+        finally:
+            self._latencia_api.observar(time.perf_counter() - inicio)
+
+
+def _proceso_despacho(opciones: dict, indice: int, total: int, cola):
+    """
+    Punto de entrada de cada proceso trabajador: despacha su partición y
+    recibe por `cola` los recordatorios recién creados (None para terminar).
+    """
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    logger = logging.getLogger("SecureBot")
+    if opciones.get("api_url"):
+        telebot.apihelper.API_URL = opciones["api_url"]
+
+    db = SecureDB(opciones["ruta_db"], opciones.get("perfil_bd", PERFIL_DEFECTO))
+    remitente = RemitenteRecordatorios(
+        telebot.TeleBot(opciones["token"]), db.conn,
+        cargar_traducciones(opciones["locales_dir"], opciones["idiomas"]),
+        opciones["idioma_defecto"], opciones["zona_defecto"]
+    )
+    planificador = ReminderScheduler(
+        db, remitente, logger,
+        politica_recuperacion=opciones["politica_recuperacion"],
+        gracia=opciones["gracia"],
+        tasa_recuperacion=opciones["tasa_recuperacion"],
+        zona_defecto=opciones["zona_defecto"],
+        lider=ArrendamientoLider(
+            db, recurso=f"{RECURSO_PLANIFICADOR}-{indice}-de-{total}",
+            ttl=opciones["ttl_liderazgo"],
+            propietario=f"{opciones['id_instancia']}/{indice}" if opciones["id_instancia"]
+            else None,
+            logger=logger
+        ),
+        intervalo_sondeo=opciones.get("intervalo_sondeo", 5.0),
+        particion=(indice, total),
+        ruta_instantanea=(f"{opciones['ruta_db']}.planificador-{indice}-de-{total}.snap"
+                          if opciones.get("intervalo_instantanea") else None),
+        intervalo_instantanea=opciones.get("intervalo_instantanea") or 300,
+        ventana_dispersion=opciones.get("ventana_dispersion", 20),
+        # Cada proceso atiende su parte del ritmo total
+        tasa_despacho=opciones.get("tasa_despacho", 25) / total,
+        sla_entrega=opciones.get("sla_entrega", 60)
+    )
+    planificador.iniciar()
+    if opciones.get("intervalo_metricas"):
+        ResumenPeriodico(intervalo=opciones["intervalo_metricas"], logger=logger,
+                         slas={HISTOGRAMA_ENTREGA: opciones.get("sla_entrega", 60)}).iniciar()
+    while True:
+        entradas = cola.get()
+        if entradas is None:
+            planificador.detener()
+            return
+        planificador.programar_lote(entradas)
+
+
+class DespachoParticionado:
+    """
+    Reparte el despacho de recordatorios entre `total` procesos según
+    abs(telegram_id) % total. Expone la misma interfaz que ReminderScheduler
+    para el bot; cada partición tiene su propio arrendamiento, de modo que
+    con varias instancias las particiones pueden repartirse entre ellas.
+    """
+
+    def __init__(self, opciones: dict, total: int, logger=None):
+        self.opciones = opciones
+        self.total = total
+        self.zona_defecto = opciones["zona_defecto"]
+        self.logger = logger or logging.getLogger("SecureBot")
+        # 'spawn' evita heredar hilos y conexiones SQLite abiertas del proceso padre
+        self._contexto = multiprocessing.get_context("spawn")
+        self._colas = []
+        self._procesos = []
+
+    def iniciar(self):
+        """Lanza un proceso trabajador por partición."""
+        for indice in range(self.total):
+            cola = self._contexto.Queue()
+            proceso = self._contexto.Process(
+                target=_proceso_despacho, args=(self.opciones, indice, self.total, cola),
+                name=f"recordatorios-{indice}", daemon=True
+            )
+            proceso.start()
+            self._colas.append(cola)
+            self._procesos.append(proceso)
+        self.logger.info("Despacho de recordatorios repartido en %d procesos", self.total)
+
+    def detener(self, espera: float = 5.0):
+        """Pide a cada trabajador que termine y espera a que lo haga."""
+        for cola in self._colas:
+            cola.put(None)
+        for proceso in self._procesos:
+            proceso.join(espera)
+
+    def zona(self, nombre: str):
+        """Zona de un usuario, o la zona por defecto si no eligió ninguna."""
+        return obtener_zona(nombre or self.zona_defecto)
+
+    def programar(self, reminder_id: int, telegram_id: int, fire_at: int):
+        """Envía un recordatorio ya guardado al proceso de su partición."""
+        self.programar_lote([(reminder_id, telegram_id, fire_at)])
+
+    def programar_lote(self, entradas):
+        """Agrupa por partición y envía cada grupo en un único mensaje a su cola."""
+        por_particion = {}
+        for entrada in entradas:
+            por_particion.setdefault(particion_de(entrada[1], self.total), []).append(entrada)
+        for indice, grupo in por_particion.items():
+            try:
+                self._colas[indice].put_nowait(grupo)
+            except queue.Full:
+                # El sondeo periódico del trabajador lo recogerá igualmente
+                self.logger.warning("Cola de la partición %d llena", indice)
@@ -0,0 +1,158 @@
+# ------------------------- IMPORTACIÓN -------------------------
+"""
+Convierte listas de recordatorios (texto multilínea, CSV o ICS) en filas
+validadas listas para insertarse en lote
+"""
+import csv
+import io
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from core.recurrence import REGLA_DIARIA, ReglaRecurrencia, extraer_regla
+
+MAX_RECORDATORIOS_LOTE = 200
+MAX_LONGITUD_TEXTO = 2000
+VALORES_VERDADEROS = {'1', 'true', 'si', 'sí', 'yes', 'x', 'recurrente'}
+
+
+def _validar(texto, hora, regla, linea, validos, errores):
+    """Valida una fila y la añade a `validos` o a `errores`"""
+    texto = (texto or '').strip()
+    hora = (hora or '').strip()
+    if not texto:
+        errores.append((linea, "texto vacío"))
+        return
+    if len(texto) > MAX_LONGITUD_TEXTO:
+        errores.append((linea, f"texto demasiado largo (máximo {MAX_LONGITUD_TEXTO})"))
+        return
+    try:
+        hora = datetime.strptime(hora, "%H:%M").strftime("%H:%M")
+    except ValueError:
+        errores.append((linea, f"hora inválida '{hora}'"))
+        return
+    if len(validos) >= MAX_RECORDATORIOS_LOTE:
+        errores.append((linea, f"se superó el máximo de {MAX_RECORDATORIOS_LOTE} recordatorios"))
+        return
+    validos.append((texto, hora, regla))
+
+
+def parsear_lineas(texto):
+    """
+    Parsea un recordatorio por línea con el formato `texto HH:MM [opción]`,
+    donde la opción de recurrencia es una de las de `extraer_regla`.
+    Devuelve (validos, errores) donde validos son tuplas (texto, hora, regla)
+    y regla es None para los recordatorios puntuales.
+    """
+    validos, errores = [], []
+    for numero, linea in enumerate(texto.splitlines(), start=1):
+        tokens = linea.split()
+        if not tokens:
+            continue
+        try:
+            tokens, regla = extraer_regla(tokens)
+        except ValueError as e:
+            errores.append((numero, str(e)))
+            continue
+        if len(tokens) < 2:
+            errores.append((numero, "formato esperado: texto HH:MM"))
+            continue
+        _validar(' '.join(tokens[:-1]), tokens[-1], regla, numero, validos, errores)
+    return validos, errores
+
+
+def parsear_csv(contenido):
+    """
+    Parsea un CSV con columnas `texto,hora[,recurrente]` (cabecera opcional).
+    La tercera columna admite un valor verdadero (diario) o una regla RRULE.
+    Devuelve (validos, errores).
+    """
+    validos, errores = [], []
+    lector = csv.reader(io.StringIO(contenido))
+    for numero, fila in enumerate(lector, start=1):
+        if not fila or not any(campo.strip() for campo in fila):
+            continue
+        if numero == 1 and fila[0].strip().lower() in ('texto', 'text'):
+            continue
+        if len(fila) < 2:
+            errores.append((numero, "se esperaban al menos las columnas texto,hora"))
+            continue
+        recurrente = fila[2].strip() if len(fila) > 2 else ''
+        regla = None
+        if recurrente.upper().startswith(('FREQ=', 'RRULE:')):
+            try:
+                regla = ReglaRecurrencia.parsear(recurrente)
+            except ValueError as e:
+                errores.append((numero, str(e)))
+                continue
+        elif recurrente.lower() in VALORES_VERDADEROS:
+            regla = REGLA_DIARIA
+        _validar(fila[0], fila[1], regla, numero, validos, errores)
+    return validos, errores
+
+
+def _hora_ics(valor, tzid=None, zona=None):
+    """
+    Extrae HH:MM de un valor DTSTART de iCalendar, convertida a `zona`
+    (hora local del servidor si es None) cuando el valor es UTC o lleva TZID.
+    """
+    valor = valor.strip()
+    if 'T' not in valor:
+        raise ValueError(valor)
+    instante = datetime.strptime(valor.rstrip('Z')[:15], "%Y%m%dT%H%M%S")
+    origen = timezone.utc if valor.endswith('Z') else None
+    if origen is None and tzid:
+        try:
+            origen = ZoneInfo(tzid)
+        except (ZoneInfoNotFoundError, ValueError):
+            origen = None
+    if origen is not None:
+        instante = instante.replace(tzinfo=origen).astimezone(zona)
+    return instante.strftime("%H:%M")
+
+
+def parsear_ics(contenido, zona=None):
+    """
+    Parsea los VEVENT de un fichero iCalendar usando SUMMARY como texto y
+    DTSTART (convertido a la zona del usuario) como hora y RRULE como regla
+    de recurrencia. Devuelve (validos, errores).
+    """
+    validos, errores = [], []
+
+    # Desplegar líneas continuadas (RFC 5545, sección 3.1)
+    lineas = []
+    for linea in contenido.splitlines():
+        if linea[:1] in (' ', '\t') and lineas:
+            lineas[-1] += linea[1:]
+        else:
+            lineas.append(linea)
+
+    evento, inicio = None, 0
+    for numero, linea in enumerate(lineas, start=1):
+        nombre, _, valor = linea.partition(':')
+        nombre, *parametros = nombre.split(';')
+        nombre = nombre.upper()
+        if nombre == 'BEGIN' and valor.upper() == 'VEVENT':
+            evento, inicio = {}, numero
+        elif nombre == 'END' and valor.upper() == 'VEVENT' and evento is not None:
+            try:
+                hora = _hora_ics(evento.get('DTSTART', ''), evento.get('TZID'), zona)
+            except ValueError:
+                errores.append((inicio, "DTSTART ausente o sin hora"))
+                evento = None
+                continue
+            try:
+                regla = ReglaRecurrencia.parsear(evento['RRULE']) if 'RRULE' in evento else None
+            except ValueError as e:
+                errores.append((inicio, f"RRULE no soportada: {str(e)}"))
+            else:
+                _validar(evento.get('SUMMARY', '').replace('\\,', ','), hora,
+                         regla, inicio, validos, errores)
+            evento = None
+        elif evento is not None:
+            evento[nombre] = valor
+            if nombre == 'DTSTART':
+                for parametro in parametros:
+                    clave, _, dato = parametro.partition('=')
+                    if clave.upper() == 'TZID':
+                        evento['TZID'] = dato
+    return validos, errores
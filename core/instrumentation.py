@@ -0,0 +1,95 @@
+# ------------------------- INSTRUMENTACIÓN DE HANDLERS -------------------------
+"""
+Mide cada handler del bot: llamadas, errores y latencia total repartida en
+tiempo de base de datos, de cifrado y de la API de Telegram
+"""
+import logging
+import time
+from functools import wraps
+
+from telebot import apihelper
+
+from models.metrics import FASE_TELEGRAM, FASES, REGISTRO, pila_fases, sumar_fase
+
+CONTADOR_LLAMADAS = "handler_llamadas_total"
+# Clave del acumulador que marca que el handler registró un error en el log
+ERROR_REGISTRADO = "error"
+
+
+def instrumentado(funcion):
+    """
+    Decorador para handlers y pasos `_process_*_step`. Cuenta como error
+    tanto la excepción que escapa como el error que el handler captura y
+    registra en el log (ver `vigilar_errores`).
+    """
+    etiquetas = {"handler": funcion.__name__}
+    llamadas = REGISTRO.contador(CONTADOR_LLAMADAS, "Llamadas por handler", etiquetas)
+    errores = REGISTRO.contador("handler_errores_total", "Llamadas con error", etiquetas)
+    duracion = REGISTRO.histograma(
+        "handler_duracion_segundos", "Duración total del handler", etiquetas=etiquetas
+    )
+    por_fase = {
+        nombre: REGISTRO.histograma(
+            f"handler_{nombre}_segundos", f"Tiempo de {nombre} dentro del handler",
+            etiquetas=etiquetas
+        )
+        for nombre in FASES
+    }
+
+    @wraps(funcion)
+    def envoltura(*args, **kwargs):
+        pila = pila_fases()
+        tiempos = {}
+        pila.append(tiempos)
+        inicio = time.perf_counter()
+        fallo = False
+        try:
+            return funcion(*args, **kwargs)
+        except Exception:
+            fallo = True
+            raise
+        finally:
+            total = time.perf_counter() - inicio
+            pila.pop()
+            fallo = tiempos.pop(ERROR_REGISTRADO, False) or fallo
+            # Un handler que llama a otro incluye su tiempo en sus propias fases
+            for nombre, segundos in tiempos.items():
+                sumar_fase(nombre, segundos)
+            llamadas.incrementar()
+            if fallo:
+                errores.incrementar()
+            duracion.observar(total)
+            for nombre, histograma in por_fase.items():
+                histograma.observar(tiempos.get(nombre, 0.0))
+    return envoltura
+
+
+class _ErroresRegistrados(logging.Handler):
+    """Marca el handler en curso cuando registra un mensaje de nivel ERROR o superior"""
+
+    def emit(self, record):
+        pila = pila_fases()
+        if pila:
+            pila[-1][ERROR_REGISTRADO] = True
+
+
+def vigilar_errores(logger: logging.Logger):
+    """Cuenta como fallidos los handlers que registran errores en `logger`."""
+    if not any(isinstance(handler, _ErroresRegistrados) for handler in logger.handlers):
+        logger.addHandler(_ErroresRegistrados(logging.ERROR))
+
+
+def medir_api_telegram():
+    """
+    Instala un CUSTOM_REQUEST_SENDER de pyTelegramBotAPI que mide cada
+    petición a la Bot API como tiempo de Telegram del handler en curso.
+    """
+    def enviar(method, url, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            # pylint: disable=protected-access
+            return apihelper._get_req_session().request(method, url, **kwargs)
+        finally:
+            sumar_fase(FASE_TELEGRAM, time.perf_counter() - inicio)
+
+    apihelper.CUSTOM_REQUEST_SENDER = enviar
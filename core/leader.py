@@ -0,0 +1,110 @@
+# ------------------------- LIDERAZGO ENTRE INSTANCIAS -------------------------
+"""
+Arrendamiento (lease) guardado en SQLite para que, con varias instancias del
+bot sobre la misma base de datos, solo una despache los recordatorios
+"""
+import logging
+import os
+import socket
+import time
+
+RECURSO_PLANIFICADOR = "planificador"
+
+
+class ArrendamientoLider:
+    """
+    Arrendamiento con caducidad sobre la fila `recurso` de `arrendamientos`.
+    La adquisición y la renovación son un único UPDATE condicional, atómico en
+    SQLite: solo prospera si la fila es nuestra o ya caducó. `epoca` aumenta
+    con cada cambio de dueño y sirve como testigo para los logs.
+    El dueño renueva cada ttl/3 y deja de considerarse líder (reloj monotónico
+    local) antes de que otra instancia pueda quitarle el arrendamiento, así que
+    la conmutación tarda como mucho ttl + ttl/3 segundos.
+    """
+
+    def __init__(self, db, recurso: str = RECURSO_PLANIFICADOR, ttl: float = 15.0,
+                 propietario: str = None, logger=None):
+        self.db = db
+        self.recurso = recurso
+        self.ttl = ttl
+        self.propietario = propietario or f"{socket.gethostname()}:{os.getpid()}"
+        self.logger = logger or logging.getLogger("SecureBot")
+        self.epoca = None
+        self.conn = None
+        self._vigente_hasta = 0.0
+        self._ultima_renovacion = 0.0
+
+    @property
+    def intervalo_renovacion(self) -> float:
+        """Cada cuánto renovar (o reintentar la adquisición)."""
+        return self.ttl / 3
+
+    @property
+    def es_lider(self) -> bool:
+        """Si esta instancia tiene ahora mismo un arrendamiento vigente."""
+        return time.monotonic() < self._vigente_hasta
+
+    def intentar(self) -> bool:
+        """Adquiere o renueva el arrendamiento. Devuelve si somos líderes."""
+        if self.conn is None:
+            self.conn = self.db.nueva_conexion()
+        inicio = time.monotonic()
+        ahora = time.time()
+        era_lider = self.es_lider
+        try:
+            self.conn.execute(
+                """INSERT OR IGNORE INTO arrendamientos (recurso, propietario, expira, epoca)
+                VALUES (?, '', 0, 0)""",
+                (self.recurso,)
+            )
+            cursor = self.conn.execute(
+                """UPDATE arrendamientos
+                SET epoca = epoca + (propietario != ?), propietario = ?, expira = ?
+                WHERE recurso = ? AND (propietario = ? OR expira < ?)""",
+                (self.propietario, self.propietario, ahora + self.ttl,
+                 self.recurso, self.propietario, ahora)
+            )
+            obtenido = cursor.rowcount == 1
+            if obtenido:
+                self.epoca = self.conn.execute(
+                    "SELECT epoca FROM arrendamientos WHERE recurso = ?", (self.recurso,)
+                ).fetchone()[0]
+            self.conn.commit()
+        except Exception as e: # pylint: disable=broad-except
+            self.conn.rollback()
+            self.logger.error(f"Error renovando el arrendamiento '{self.recurso}': {str(e)}")
+            obtenido = False
+
+        self._ultima_renovacion = inicio
+        if obtenido:
+            # Se cuenta desde antes de la escritura para no sobrestimar la vigencia
+            self._vigente_hasta = inicio + self.ttl
+            if not era_lider:
+                self.logger.info("Instancia %s es líder de '%s' (época %s)",
+                                 self.propietario, self.recurso, self.epoca)
+        elif era_lider or self._vigente_hasta:
+            self._vigente_hasta = 0.0
+            self.logger.warning("Instancia %s perdió el liderazgo de '%s'",
+                                self.propietario, self.recurso)
+        return obtenido
+
+    def mantener(self) -> bool:
+        """Renueva si toca y devuelve si seguimos siendo líderes."""
+        if time.monotonic() - self._ultima_renovacion >= self.intervalo_renovacion:
+            return self.intentar()
+        return self.es_lider
+
+    def liberar(self):
+        """Cede el arrendamiento para que otra instancia lo tome sin esperar al ttl."""
+        if self.conn is None or not self.es_lider:
+            return
+        self._vigente_hasta = 0.0
+        try:
+            self.conn.execute(
+                "UPDATE arrendamientos SET expira = 0 WHERE recurso = ? AND propietario = ?",
+                (self.recurso, self.propietario)
+            )
+            self.conn.commit()
+        except Exception as e: # pylint: disable=broad-except
+            self.conn.rollback()
+            self.logger.error(f"Error liberando el arrendamiento '{self.recurso}': {str(e)}")
@@ -0,0 +1,173 @@
+# ------------------------- MANTENIMIENTO DE LA BASE DE DATOS -------------------------
+"""
+Mantiene acotados el WAL y las páginas libres de la base de datos y al día
+las estadísticas del planificador de consultas de SQLite
+"""
+import logging
+import os
+import time
+from threading import Event, Thread
+
+from models.database import SecureDB
+from models.metrics import REGISTRO
+from core.instrumentation import CONTADOR_LLAMADAS
+
+CLAVE_ESTADO = "mantenimiento_bd"
+# Valor de PRAGMA auto_vacuum con el modo incremental
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+class MantenimientoBD:
+    """
+    Cada `intervalo` segundos hace un checkpoint PASSIVE del WAL, que no
+    espera a nadie. Si desde la pasada anterior ningún handler atendió a un
+    usuario, el momento se considera tranquilo y además trunca el WAL
+    (TRUNCATE), devuelve al sistema hasta `paginas_por_pasada` páginas libres
+    con `incremental_vacuum` y, cada `intervalo_optimizar` segundos, ejecuta
+    ANALYZE la primera vez y `PRAGMA optimize` las siguientes. Publica el
+    tamaño del WAL y de la BD y las páginas libres como indicadores.
+
+    `pedir_truncado` fuerza el TRUNCATE en la siguiente pasada aunque haya
+    actividad (p. ej. tras borrar los datos de un usuario), sin que el
+    handler que lo pide espere al checkpoint.
+    """
+
+    def __init__(self, db: SecureDB, intervalo: float = 300, paginas_por_pasada: int = 2000,
+                 intervalo_optimizar: float = 6 * 3600, registro=REGISTRO, logger=None):
+        self.db = db
+        self.intervalo = intervalo
+        self.paginas_por_pasada = paginas_por_pasada
+        self.intervalo_optimizar = intervalo_optimizar
+        self.registro = registro
+        self.logger = logger or logging.getLogger("SecureBot")
+        self._detener = Event()
+        self._truncar = Event()
+        self._llamadas_previas = None
+
+        self._wal = registro.indicador("sqlite_wal_bytes", "Tamaño del fichero WAL")
+        self._tamano = registro.indicador("sqlite_bd_bytes", "Tamaño de la base de datos")
+        self._libres = registro.indicador("sqlite_paginas_libres", "Páginas en la lista libre")
+        self._paginas = registro.indicador("sqlite_paginas_totales", "Páginas de la base de datos")
+        self._liberadas = registro.contador(
+            "sqlite_paginas_liberadas_total", "Páginas devueltas por incremental_vacuum"
+        )
+
+    def iniciar(self):
+        """Lanza el mantenimiento en un hilo en segundo plano."""
+        Thread(target=self._run, name="mantenimiento-bd", daemon=True).start()
+
+    def detener(self):
+        """Detiene el hilo tras la pasada en curso."""
+        self._detener.set()
+
+    def pedir_truncado(self):
+        """Pide truncar el WAL en la siguiente pasada."""
+        self._truncar.set()
+
+    def _run(self):
+        conn = self.db.nueva_conexion()
+        try:
+            while not self._detener.wait(self.intervalo):
+                try:
+                    self.pasada(conn)
+                except Exception as e: # pylint: disable=broad-except
+                    if conn.in_transaction:
+                        conn.rollback()
+                    self.logger.error(f"Error en el mantenimiento de la BD: {str(e)}")
+        finally:
+            conn.close()
+
+    def _tranquilo(self) -> bool:
+        """True si ningún handler se ejecutó desde la pasada anterior."""
+        llamadas = sum(
+            metrica.valor for metrica in self.registro.metricas()
+            if metrica.nombre == CONTADOR_LLAMADAS
+        )
+        tranquilo = llamadas == self._llamadas_previas
+        self._llamadas_previas = llamadas
+        return tranquilo
+
+    def _medir(self, tarea: str, funcion, *argumentos):
+        inicio = time.perf_counter()
+        resultado = funcion(*argumentos)
+        self.registro.histograma(
+            "sqlite_mantenimiento_segundos", "Duración de cada tarea de mantenimiento",
+            etiquetas={"tarea": tarea}
+        ).observar(time.perf_counter() - inicio)
+        return resultado
+
+    def pasada(self, conn, tranquilo: bool = None):
+        """
+        Una pasada de mantenimiento sobre `conn`. Sin `tranquilo`, lo decide
+        la actividad de los handlers desde la pasada anterior.
+        """
+        if tranquilo is None:
+            tranquilo = self._tranquilo()
+        if tranquilo:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+                self._medir("vacuum", self._convertir_incremental, conn)
+            elif conn.execute("PRAGMA freelist_count").fetchone()[0]:
+                self._medir("incremental_vacuum", self._vacuum_incremental, conn)
+            self._optimizar(conn)
+
+        # El checkpoint va al final para que TRUNCATE vacíe también lo escrito arriba
+        modo = "TRUNCATE" if tranquilo or self._truncar.is_set() else "PASSIVE"
+        ocupado, paginas_wal, copiadas = self._medir(
+            f"checkpoint_{modo.lower()}", self._checkpoint, conn, modo
+        )
+        if modo == "TRUNCATE" and not ocupado:
+            self._truncar.clear()
+        self.registro.contador(
+            "sqlite_checkpoints_total", "Checkpoints del WAL", etiquetas={"modo": modo}
+        ).incrementar()
+        if ocupado:
+            self.logger.debug("Checkpoint %s incompleto: %d de %d páginas",
+                              modo, copiadas, paginas_wal)
+        self._actualizar_indicadores(conn)
+
+    @staticmethod
+    def _checkpoint(conn, modo: str) -> tuple:
+        """(ocupado, páginas en el WAL, páginas copiadas a la BD)"""
+        return conn.execute(f"PRAGMA wal_checkpoint({modo})").fetchone()
+
+    def _convertir_incremental(self, conn):
+        """Pasa a auto_vacuum=INCREMENTAL una BD creada sin él; requiere un VACUUM."""
+        inicio = time.monotonic()
+        conn.executescript("PRAGMA auto_vacuum=INCREMENTAL; VACUUM;")
+        self.logger.info("Base de datos convertida a auto_vacuum incremental en %.1f s",
+                         time.monotonic() - inicio)
+
+    def _vacuum_incremental(self, conn):
+        antes = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        # execute solo avanza un paso de la pragma (una página); executescript la completa
+        conn.executescript(f"PRAGMA incremental_vacuum({int(self.paginas_por_pasada)});")
+        liberadas = antes - conn.execute("PRAGMA freelist_count").fetchone()[0]
+        self._liberadas.incrementar(liberadas)
+        if liberadas:
+            self.logger.info("Mantenimiento de la BD: %d páginas libres devueltas", liberadas)
+
+    def _optimizar(self, conn):
+        estado = SecureDB.leer_estado(conn, CLAVE_ESTADO, {})
+        if time.time() - estado.get("optimizado", 0) < self.intervalo_optimizar:
+            return
+        analizada = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'"
+        ).fetchone()
+        if analizada:
+            self._medir("optimize", conn.execute, "PRAGMA optimize")
+        else:
+            self._medir("analyze", conn.execute, "ANALYZE")
+        estado["optimizado"] = time.time()
+        SecureDB.guardar_estado(conn, CLAVE_ESTADO, estado)
+        conn.commit()
+
+    def _actualizar_indicadores(self, conn):
+        paginas = conn.execute("PRAGMA page_count").fetchone()[0]
+        tamano_pagina = conn.execute("PRAGMA page_size").fetchone()[0]
+        self._paginas.fijar(paginas)
+        self._tamano.fijar(paginas * tamano_pagina)
+        self._libres.fijar(conn.execute("PRAGMA freelist_count").fetchone()[0])
+        try:
+            self._wal.fijar(os.path.getsize(f"{self.db.ruta}-wal"))
+        except OSError:
+            self._wal.fijar(0)
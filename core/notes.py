@@ -0,0 +1,70 @@
+# ------------------------- NOTAS LARGAS -------------------------
+"""
+Preparación de las notas para guardarlas: las cortas se cifran enteras y
+las largas en fragmentos cifrados por separado, con una vista previa cifrada
+aparte para que los listados no tengan que descifrar la nota completa y los
+tokens del índice ciego con el que se buscan
+"""
+from collections import namedtuple
+
+# Cada fragmento cabe en un mensaje de Telegram (4096 caracteres)
+TAMANO_FRAGMENTO = 3500
+# Caracteres de la vista previa; las notas más cortas se listan con su contenido
+LONGITUD_VISTA_PREVIA = 100
+# Límite de una nota subida como .txt
+MAX_LONGITUD_NOTA_LARGA = 500_000
+# Con más fragmentos /viewnote envía la nota como .txt en lugar de en mensajes
+MAX_MENSAJES_NOTA = 3
+
+# Palabras como mucho en una búsqueda
+MAX_TERMINOS_BUSQUEDA = 10
+# Notas como mucho en el resultado de una búsqueda
+MAX_RESULTADOS_BUSQUEDA = 20
+
+NotaCifrada = namedtuple("NotaCifrada", "contenido vista_previa fragmentos indice")
+
+
+def trocear(texto: str) -> list:
+    """Parte el texto en fragmentos de como mucho TAMANO_FRAGMENTO caracteres."""
+    return [texto[i:i + TAMANO_FRAGMENTO] for i in range(0, len(texto), TAMANO_FRAGMENTO)]
+
+
+def cifrar_notas(cifrador, textos) -> list:
+    """
+    Devuelve una NotaCifrada por texto. Todas las piezas (contenidos, vistas
+    previas y fragmentos) se cifran en una sola llamada a `cifrar_lote`.
+    Las notas largas tienen `contenido` vacío y sus fragmentos en orden;
+    `indice` son los tokens del índice ciego del texto completo.
+    """
+    textos = list(textos)
+    piezas, formas = [], []
+    for texto in textos:
+        partes = trocear(texto) if len(texto) > TAMANO_FRAGMENTO else [texto]
+        vista = texto[:LONGITUD_VISTA_PREVIA] if len(texto) > LONGITUD_VISTA_PREVIA else None
+        formas.append((len(partes), vista is not None))
+        piezas += partes
+        if vista is not None:
+            piezas.append(vista)
+
+    tokens = iter(cifrador.cifrar_lote(piezas))
+    notas = []
+    for texto, (numero_partes, con_vista) in zip(textos, formas):
+        partes = [next(tokens) for _ in range(numero_partes)]
+        vista = next(tokens) if con_vista else None
+        indice = cifrador.indice_ciego(texto)
+        if numero_partes == 1:
+            notas.append(NotaCifrada(partes[0], vista, [], indice))
+        else:
+            notas.append(NotaCifrada(b"", vista, partes, indice))
+    return notas
+
+
+def cifrar_nota(cifrador, texto: str) -> NotaCifrada:
+    """NotaCifrada de un único texto."""
+    return cifrar_notas(cifrador, [texto])[0]
+
+
+def descifrar_fragmentos(cifrador, tokens):
+    """Genera el texto de la nota fragmento a fragmento."""
+    for token in tokens:
+        yield cifrador.descifrar(token)
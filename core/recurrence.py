@@ -0,0 +1,258 @@
+# ------------------------- RECURRENCIA -------------------------
+"""
+Reglas de recurrencia al estilo RRULE (diaria, laborables, semanal por días,
+mensual y cada N horas) y cálculo de la siguiente ocurrencia en tiempo
+constante, sin expandir la serie
+"""
+import calendar
+import time
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+
+FRECUENCIAS = ('HOURLY', 'DAILY', 'WEEKLY', 'MONTHLY')
+DIAS = ('MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU')
+DIAS_ES = {'LU': 'MO', 'MA': 'TU', 'MI': 'WE', 'JU': 'TH', 'VI': 'FR', 'SA': 'SA', 'DO': 'SU'}
+NOMBRES_DIAS = ('LU', 'MA', 'MI', 'JU', 'VI', 'SA', 'DO')
+MASCARA_LABORABLES = 0b0011111
+MAX_INTERVALO = 1000
+OPCIONES_RECURRENCIA = ('--recurrente', '--diario', '--laborables', '--semanal',
+                        '--mensual', '--cada', '--rrule')
+
+
+@lru_cache(maxsize=2048)
+def _hora(hora: str):
+    return datetime.strptime(hora, "%H:%M").time()
+
+
+def calcular_proximo_disparo(hora: str, desde: float = None, zona=None) -> int:
+    """
+    Devuelve el próximo instante (epoch UTC) en que la hora HH:MM de la zona
+    `zona` (hora local del servidor si es None) ocurre a partir de `desde`.
+    En los cambios de horario una hora inexistente se desplaza a la hora
+    equivalente tras el salto y una hora repetida dispara solo la primera vez.
+    """
+    ahora = datetime.fromtimestamp(time.time() if desde is None else desde, tz=zona)
+    objetivo = datetime.combine(ahora.date(), _hora(hora), tzinfo=zona)
+    if objetivo < ahora:
+        # Sumar días sobre la hora de pared respeta los cambios de horario
+        objetivo += timedelta(days=1)
+    return int(objetivo.timestamp())
+
+
+class ReglaRecurrencia:
+    """
+    Regla de recurrencia inmutable. Se serializa con un subconjunto de RRULE:
+    FREQ=HOURLY|DAILY;INTERVAL=n, FREQ=WEEKLY;BYDAY=MO,WE y
+    FREQ=MONTHLY;BYMONTHDAY=d.
+    """
+    __slots__ = ('frecuencia', 'intervalo', 'dias', 'dia_mes')
+
+    def __init__(self, frecuencia: str, intervalo: int = 1, dias: int = 0, dia_mes: int = None):
+        if frecuencia not in FRECUENCIAS:
+            raise ValueError(f"Frecuencia no soportada: {frecuencia}")
+        if not 1 <= intervalo <= MAX_INTERVALO:
+            raise ValueError(f"Intervalo fuera de rango: {intervalo}")
+        if intervalo > 1 and frecuencia in ('WEEKLY', 'MONTHLY'):
+            raise ValueError("INTERVAL solo está soportado con HOURLY y DAILY")
+        if frecuencia == 'WEEKLY' and not dias:
+            raise ValueError("WEEKLY necesita BYDAY")
+        if frecuencia == 'MONTHLY' and not (dia_mes and 1 <= dia_mes <= 31):
+            raise ValueError("MONTHLY necesita BYMONTHDAY entre 1 y 31")
+        self.frecuencia = frecuencia
+        self.intervalo = intervalo
+        self.dias = dias
+        self.dia_mes = dia_mes
+
+    @classmethod
+    def parsear(cls, texto: str) -> "ReglaRecurrencia":
+        """Crea una regla a partir de su forma RRULE (con o sin prefijo 'RRULE:')."""
+        texto = texto.strip()
+        if texto.upper().startswith('RRULE:'):
+            texto = texto[6:]
+        partes = {}
+        for parte in texto.split(';'):
+            clave, _, valor = parte.partition('=')
+            if clave:
+                partes[clave.strip().upper()] = valor.strip().upper()
+
+        # WKST solo afecta a reglas semanales con intervalo, que no se admiten
+        partes.pop('WKST', None)
+        frecuencia = partes.pop('FREQ', '')
+        try:
+            intervalo = int(partes.pop('INTERVAL', '1'))
+            dia_mes = int(partes.pop('BYMONTHDAY')) if 'BYMONTHDAY' in partes else None
+        except ValueError as e:
+            raise ValueError(f"Regla inválida: {texto}") from e
+        dias = 0
+        for dia in filter(None, partes.pop('BYDAY', '').split(',')):
+            dia = DIAS_ES.get(dia, dia) if dia not in DIAS else dia
+            if dia not in DIAS:
+                raise ValueError(f"Día no reconocido: {dia}")
+            dias |= 1 << DIAS.index(dia)
+        if partes:
+            raise ValueError(f"Partes no soportadas: {', '.join(partes)}")
+
+        # DAILY;BYDAY=... equivale a WEEKLY;BYDAY=...
+        if frecuencia == 'DAILY' and dias:
+            frecuencia = 'WEEKLY'
+        return cls(frecuencia, intervalo, dias, dia_mes)
+
+    def __str__(self):
+        partes = [f"FREQ={self.frecuencia}"]
+        if self.intervalo > 1:
+            partes.append(f"INTERVAL={self.intervalo}")
+        if self.dias:
+            partes.append("BYDAY=" + ",".join(d for i, d in enumerate(DIAS) if self.dias >> i & 1))
+        if self.dia_mes:
+            partes.append(f"BYMONTHDAY={self.dia_mes}")
+        return ";".join(partes)
+
+    def describir(self) -> str:
+        """Descripción corta para mostrar al usuario."""
+        if self.frecuencia == 'HOURLY':
+            return f"cada {self.intervalo} h"
+        if self.frecuencia == 'DAILY':
+            return "diario" if self.intervalo == 1 else f"cada {self.intervalo} días"
+        if self.frecuencia == 'WEEKLY':
+            if self.dias == MASCARA_LABORABLES:
+                return "laborables"
+            return "semanal: " + ", ".join(
+                n for i, n in enumerate(NOMBRES_DIAS) if self.dias >> i & 1)
+        return f"mensual (día {self.dia_mes})"
+
+    def siguiente(self, hora: str, desde: float, zona=None, anterior: int = None) -> int:
+        """
+        Devuelve la primera ocurrencia (epoch UTC) en o después de `desde`.
+        `anterior` es la última ocurrencia disparada y fija la fase de las
+        reglas con intervalo. El coste no depende de cuántas ocurrencias se salten.
+        """
+        if self.frecuencia == 'HOURLY':
+            return self._siguiente_horaria(hora, desde, zona, anterior)
+
+        ahora = datetime.fromtimestamp(desde, tz=zona)
+        hora_dia = _hora(hora)
+
+        if self.frecuencia == 'DAILY':
+            if anterior is None or self.intervalo == 1:
+                return calcular_proximo_disparo(hora, desde, zona)
+            dia = datetime.fromtimestamp(anterior, tz=zona).date() + timedelta(days=self.intervalo)
+            retraso = (ahora.date() - dia).days
+            if retraso > 0:
+                dia += timedelta(days=-(-retraso // self.intervalo) * self.intervalo)
+            candidato = datetime.combine(dia, hora_dia, tzinfo=zona)
+            if candidato < ahora:
+                candidato += timedelta(days=self.intervalo)
+            return int(candidato.timestamp())
+
+        if self.frecuencia == 'WEEKLY':
+            for i in range(8):
+                dia = ahora.date() + timedelta(days=i)
+                if self.dias >> dia.weekday() & 1:
+                    candidato = datetime.combine(dia, hora_dia, tzinfo=zona)
+                    if candidato >= ahora:
+                        return int(candidato.timestamp())
+            raise ValueError("Regla semanal sin días")
+
+        # MONTHLY: el día se ajusta al último del mes cuando no existe (p. ej. 31)
+        anio, mes = ahora.year, ahora.month
+        for _ in range(3):
+            dia = min(self.dia_mes, calendar.monthrange(anio, mes)[1])
+            candidato = datetime.combine(date(anio, mes, dia), hora_dia, tzinfo=zona)
+            if candidato >= ahora:
+                return int(candidato.timestamp())
+            anio, mes = (anio + 1, 1) if mes == 12 else (anio, mes + 1)
+        raise ValueError("No se encontró la siguiente ocurrencia mensual")
+
+    def _siguiente_horaria(self, hora, desde, zona, anterior):
+        paso = self.intervalo * 3600
+        if anterior is None:
+            # La serie arranca a la hora indicada del día de `desde`
+            ahora = datetime.fromtimestamp(desde, tz=zona)
+            base = int(datetime.combine(ahora.date(), _hora(hora), tzinfo=zona).timestamp())
+        else:
+            base = anterior + paso
+        if base >= desde:
+            return base
+        return base + -(-(int(desde) - base) // paso) * paso
+
+
+REGLA_DIARIA = ReglaRecurrencia('DAILY')
+
+
+@lru_cache(maxsize=4096)
+def parsear_regla(texto: str) -> ReglaRecurrencia:
+    """Versión con caché de `ReglaRecurrencia.parsear` para reglas leídas de la BD."""
+    return ReglaRecurrencia.parsear(texto)
+
+
+def regla_efectiva(regla: str, recurrente) -> ReglaRecurrencia:
+    """
+    Devuelve la regla de un recordatorio, tratando los recurrentes antiguos
+    (sin regla) como diarios. None si no es recurrente.
+    """
+    if regla:
+        return parsear_regla(regla)
+    return REGLA_DIARIA if recurrente else None
+
+
+def proximo_disparo(hora: str, regla, desde: float = None, zona=None, anterior: int = None) -> int:
+    """Próximo disparo de un recordatorio, recurrente (`regla`) o puntual (`regla` None)."""
+    desde = time.time() if desde is None else desde
+    if regla is None:
+        return calcular_proximo_disparo(hora, desde, zona)
+    return regla.siguiente(hora, desde, zona, anterior)
+
+
+def _es_hora(token: str) -> bool:
+    try:
+        datetime.strptime(token, "%H:%M")
+    except ValueError:
+        return False
+    return True
+
+
+def extraer_regla(tokens, hoy: date = None):
+    """
+    Separa de `tokens` las opciones de recurrencia y devuelve
+    (tokens_restantes, regla_o_None). Opciones admitidas:
+    --recurrente/--diario, --laborables, --semanal=LU,MI, --mensual[=15],
+    --cada=3h, --cada=2d y --rrule=FREQ=...
+    Solo son opciones los `--` del final que siguen a la hora HH:MM (o que
+    son todos opciones conocidas); un `--palabra` dentro del texto se conserva.
+    """
+    tokens = list(tokens)
+    inicio = len(tokens)
+    while inicio > 0 and tokens[inicio - 1].startswith('--'):
+        inicio -= 1
+    tras_hora = inicio > 0 and _es_hora(tokens[inicio - 1])
+    if not tras_hora and not all(
+        token.partition('=')[0].lower() in OPCIONES_RECURRENCIA for token in tokens[inicio:]
+    ):
+        return tokens, None
+
+    regla = None
+    restantes = tokens[:inicio]
+    for token in tokens[inicio:]:
+        opcion, _, valor = token.partition('=')
+        opcion = opcion.lower()
+        if regla is not None:
+            raise ValueError("Solo se admite una opción de recurrencia")
+        if opcion in ('--recurrente', '--diario'):
+            regla = REGLA_DIARIA
+        elif opcion == '--laborables':
+            regla = ReglaRecurrencia('WEEKLY', dias=MASCARA_LABORABLES)
+        elif opcion == '--semanal':
+            regla = ReglaRecurrencia.parsear(f"FREQ=WEEKLY;BYDAY={valor}")
+        elif opcion == '--mensual':
+            dia = int(valor) if valor else (hoy or date.today()).day
+            regla = ReglaRecurrencia('MONTHLY', dia_mes=dia)
+        elif opcion == '--cada':
+            unidad = valor[-1:].lower()
+            if unidad not in ('h', 'd') or not valor[:-1].isdigit():
+                raise ValueError(f"Intervalo no reconocido: {valor} (usa p. ej. 3h o 2d)")
+            regla = ReglaRecurrencia('HOURLY' if unidad == 'h' else 'DAILY', int(valor[:-1]))
+        elif opcion == '--rrule':
+            regla = ReglaRecurrencia.parsear(valor)
+        else:
+            raise ValueError(f"Opción no reconocida: {token}")
+    return restantes, regla
@@ -0,0 +1,102 @@
+# ------------------------- MONTÍCULO COMPACTO -------------------------
+"""
+Montículo mínimo de recordatorios programados guardado en tres columnas
+array('q') paralelas (fire_at, reminder_id, telegram_id): 24 bytes por
+entrada en lugar de una tupla con tres enteros de Python
+"""
+from array import array
+
+
+def construir_columnas(filas) -> tuple:
+    """Convierte filas (fire_at, reminder_id, telegram_id) en tres columnas array('q')."""
+    fire, rid, uid = array('q'), array('q'), array('q')
+    for fire_at, reminder_id, telegram_id in filas:
+        fire.append(fire_at)
+        rid.append(reminder_id)
+        uid.append(telegram_id)
+    return fire, rid, uid
+
+
+class MonticuloCompacto:
+    """
+    Montículo mínimo por fire_at. Las entradas con el mismo fire_at salen en
+    cualquier orden. Una secuencia ordenada por fire_at ya es un montículo
+    válido, por eso las cargas masivas (consulta ORDER BY o instantánea) no
+    necesitan reordenar nada.
+    """
+    __slots__ = ('_fire', '_rid', '_uid')
+
+    def __init__(self):
+        self._fire = array('q')
+        self._rid = array('q')
+        self._uid = array('q')
+
+    def __len__(self):
+        return len(self._fire)
+
+    def __iter__(self):
+        """Recorre las entradas (fire_at, reminder_id, telegram_id) sin orden."""
+        return zip(self._fire, self._rid, self._uid)
+
+    def proximo(self):
+        """fire_at de la entrada más próxima, o None si está vacío."""
+        return self._fire[0] if self._fire else None
+
+    def bytes_usados(self) -> int:
+        """Memoria reservada por las tres columnas."""
+        return sum(columna.buffer_info()[1] * columna.itemsize
+                   for columna in (self._fire, self._rid, self._uid))
+
+    def limpiar(self):
+        """Vacía el montículo liberando la memoria de las columnas."""
+        self._fire, self._rid, self._uid = array('q'), array('q'), array('q')
+
+    def insertar(self, fire_at: int, reminder_id: int, telegram_id: int):
+        """Añade una entrada en O(log n)."""
+        fire, rid, uid = self._fire, self._rid, self._uid
+        fire.append(fire_at)
+        rid.append(reminder_id)
+        uid.append(telegram_id)
+        # Subir el hueco hasta su sitio y escribir la entrada una sola vez
+        pos = len(fire) - 1
+        while pos:
+            padre = (pos - 1) >> 1
+            if fire[padre] <= fire_at:
+                break
+            fire[pos], rid[pos], uid[pos] = fire[padre], rid[padre], uid[padre]
+            pos = padre
+        fire[pos], rid[pos], uid[pos] = fire_at, reminder_id, telegram_id
+
+    def extraer(self) -> tuple:
+        """Quita y devuelve la entrada (fire_at, reminder_id, telegram_id) más próxima."""
+        fire, rid, uid = self._fire, self._rid, self._uid
+        primero = (fire[0], rid[0], uid[0])
+        ultimo_fire, ultimo_rid, ultimo_uid = fire.pop(), rid.pop(), uid.pop()
+        total = len(fire)
+        if total:
+            pos = 0
+            while True:
+                hijo = 2 * pos + 1
+                if hijo >= total:
+                    break
+                if hijo + 1 < total and fire[hijo + 1] < fire[hijo]:
+                    hijo += 1
+                if fire[hijo] >= ultimo_fire:
+                    break
+                fire[pos], rid[pos], uid[pos] = fire[hijo], rid[hijo], uid[hijo]
+                pos = hijo
+            fire[pos], rid[pos], uid[pos] = ultimo_fire, ultimo_rid, ultimo_uid
+        return primero
+
+    def cargar_columnas(self, fire: array, rid: array, uid: array):
+        """
+        Adopta columnas ordenadas por fire_at (ver `construir_columnas`)
+        conservando las entradas que ya hubiera, que se reinsertan una a una.
+        """
+        previas = list(self)
+        self._fire, self._rid, self._uid = fire, rid, uid
+        self._reinsertar(previas)
+
+    def _reinsertar(self, entradas):
+        for entrada in entradas:
+            self.insertar(*entrada)
@@ -0,0 +1,689 @@
+# ------------------------- PLANIFICADOR DE RECORDATORIOS -------------------------
+"""
+Planificador de recordatorios basado en la columna `next_fire_at`
+(instante UTC en segundos) en lugar de un Timer por recordatorio
+"""
+import logging
+import time
+from functools import lru_cache
+from threading import Condition, Thread
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from core.recurrence import proximo_disparo, regla_efectiva
+from core.schedule_heap import MonticuloCompacto, construir_columnas
+from core.snapshot import CLAVE_VERSION, escribir_instantanea, leer_instantanea
+from models.database import SecureDB
+from models.metrics import REGISTRO, Histograma
+
+# Espera máxima entre comprobaciones aunque no haya nada programado antes
+ESPERA_MAXIMA = 60.0
+CLAVE_LATIDO = "planificador_latido"
+POLITICAS_RECUPERACION = ('gracia', 'entregar', 'omitir')
+TRAMO_RECUPERACION = 50
+# A partir de este tamaño cada tramo de envíos se resume en el log
+TRAMO_MINIMO_LOG = 10
+# Histograma sobre el que se comprueba el SLA de entrega
+HISTOGRAMA_ENTREGA = "recordatorios_retraso_entrega_segundos"
+# Un envío fallido se reintenta tras ESPERA_REINTENTO segundos, el doble cada
+# vez, hasta REINTENTOS_ENVIO veces (unos 30 minutos en total)
+REINTENTOS_ENVIO = 6
+ESPERA_REINTENTO = 30
+# La base IANA tiene unas 600 zonas; el límite acota los nombres inválidos
+# que escriben los usuarios, que también se cachean (como None)
+MAX_ZONAS_CACHE = 1024
+
+
+@lru_cache(maxsize=MAX_ZONAS_CACHE)
+def obtener_zona(nombre: str):
+    """
+    Devuelve la ZoneInfo de `nombre`, o None (hora local del servidor) si no
+    se indica zona o no existe.
+    """
+    if not nombre:
+        return None
+    try:
+        return ZoneInfo(nombre)
+    except (ZoneInfoNotFoundError, ValueError):
+        return None
+
+
+def orden_equitativo(vencidos) -> list:
+    """
+    Ordena las entradas vencidas por turnos entre usuarios (una de cada
+    usuario por ronda, en orden de fire_at) para que quien tiene muchos
+    recordatorios a la misma hora no retrase a los demás. Quita repetidos.
+    """
+    por_usuario = {}
+    for entrada in sorted(set(vencidos)):
+        por_usuario.setdefault(entrada[2], []).append(entrada)
+    colas = list(por_usuario.values())
+    orden = []
+    for ronda in range(max(map(len, colas), default=0)):
+        orden.extend(cola[ronda] for cola in colas if ronda < len(cola))
+    return orden
+
+
+class ReminderScheduler:
+    """
+    Mantiene en memoria un montículo compacto (fire_at, reminder_id,
+    telegram_id) con los recordatorios pendientes, sin su texto, y un único
+    hilo que los despacha. La base de
+    datos es la fuente de verdad: al disparar se relee la fila, de modo que
+    los recordatorios borrados o reprogramados se descartan sin cancelar nada.
+
+    Con `particion` (indice, total) solo atiende a los usuarios cuyo
+    abs(telegram_id) % total == indice, para repartir el despacho entre procesos.
+
+    Con `lider` (un ArrendamientoLider) varias instancias pueden compartir la
+    base de datos: solo la que tiene el arrendamiento despacha, y cada
+    `intervalo_sondeo` segundos encola lo que hayan creado las demás. Las
+    entradas repetidas en el montículo son inofensivas por la misma relectura.
+
+    Con `ruta_instantanea` guarda cada `intervalo_instantanea` segundos (y al
+    detenerse) una instantánea binaria de los pendientes que, si el contador
+    de cambios de la BD no se ha movido, evita la consulta completa al arrancar.
+
+    Los recordatorios que vencen a la vez (las horas redondas concentran
+    muchos) se envían por turnos entre usuarios y repartidos a `tasa_despacho`
+    mensajes por segundo, sin alargar el tramo más de `ventana_dispersion`
+    segundos; se registra la profundidad del tramo y el p99 del retraso
+    frente a `sla_entrega`.
+
+    Al asumir el despacho, lo que venció durante la caída (desde el último
+    latido) lo envía un hilo aparte a `tasa_recuperacion` mensajes por
+    segundo según `politica_recuperacion`, mientras el despachador sigue con
+    los recordatorios futuros.
+
+    Cada entrega se mide en los histogramas de `metricas` (el registro del
+    proceso por defecto): retraso hasta salir del montículo, espera por el
+    reparto del tramo y retraso hasta completar el envío.
+    """
+
+    def __init__(self, db, enviar, logger=None, politica_recuperacion: str = 'gracia',
+                 gracia: float = 3600, tasa_recuperacion: float = 20,
+                 intervalo_latido: float = 30, zona_defecto: str = None,
+                 lider=None, intervalo_sondeo: float = 5.0, particion: tuple = None,
+                 ruta_instantanea: str = None, intervalo_instantanea: float = 300,
+                 ventana_dispersion: float = 20, tasa_despacho: float = 25,
+                 sla_entrega: float = 60, metricas=None):
+        self.db = db
+        self.lider = lider
+        self.intervalo_sondeo = intervalo_sondeo
+        # (total, indice) listo para la consulta; (1, 0) equivale a sin partición
+        self._particion = (particion[1], particion[0]) if particion else (1, 0)
+        self.ruta_instantanea = ruta_instantanea
+        self.intervalo_instantanea = intervalo_instantanea
+        self._ultima_instantanea = 0.0
+        self._version_instantanea = None
+        self._despachando = False
+        self.ventana_dispersion = ventana_dispersion
+        self.tasa_despacho = tasa_despacho
+        self.sla_entrega = sla_entrega
+        self.zona_defecto = zona_defecto
+        self.enviar = enviar
+        self.logger = logger or logging.getLogger("SecureBot")
+        if politica_recuperacion not in POLITICAS_RECUPERACION:
+            raise ValueError(f"Política de recuperación desconocida: {politica_recuperacion}")
+        self.politica_recuperacion = politica_recuperacion
+        self.gracia = gracia
+        self.tasa_recuperacion = tasa_recuperacion
+        self.intervalo_latido = intervalo_latido
+        self.conn = None
+        self._heap = MonticuloCompacto()
+        self._cond = Condition()
+        self._detener = False
+        self._hilo = None
+        # Ventana (desde, hasta) de fire_at que atiende el hilo de recuperación;
+        # cada cambio de turno (asumir o ceder el despacho) detiene la anterior
+        self._ventana_recuperacion = None
+        self._turno = 0
+        self._anteriores_caida = 0
+        self._hilo_recuperacion = None
+        self._ultimo_latido = 0.0
+        self._ultimo_sondeo = 0.0
+        # reminder_id -> (fire_at programado, intentos, fire_at del reintento encolado);
+        # lo usa el hilo despachador y, para los envíos fallidos de la recuperación
+        # (recordatorios que el despachador no toca), el hilo de recuperación
+        self._reintentos = {}
+        metricas = metricas or REGISTRO
+        self._retraso_desencolado = metricas.histograma(
+            "recordatorios_retraso_desencolado_segundos",
+            "Desde la hora programada hasta salir del montículo"
+        )
+        self._espera_envio = metricas.histograma(
+            "recordatorios_espera_envio_segundos",
+            "Desde que sale del montículo hasta que empieza el envío (reparto del tramo)"
+        )
+        self._retraso_entrega = metricas.histograma(
+            HISTOGRAMA_ENTREGA, "Desde la hora programada hasta completar el envío"
+        )
+        self._enviados = metricas.contador("recordatorios_enviados_total", "Recordatorios enviados")
+        self._descartados = metricas.contador(
+            "recordatorios_descartados_total", "Entradas borradas o reprogramadas al disparar"
+        )
+        self._fallidos = metricas.contador("recordatorios_fallidos_total", "Envíos con error")
+        self._recuperados = metricas.contador(
+            "recordatorios_recuperados_total", "Recordatorios vencidos entregados al recuperar"
+        )
+        self._omitidos = metricas.contador(
+            "recordatorios_omitidos_total", "Recordatorios vencidos omitidos al recuperar"
+        )
+
+    def iniciar(self):
+        """Arranca el hilo despachador, que lanza a su vez la recuperación de lo perdido."""
+        self.conn = self.db.nueva_conexion()
+        self._rellenar_next_fire_at()
+        self._hilo = Thread(target=self._run, name="recordatorios", daemon=True)
+        self._hilo.start()
+
+    def detener(self, espera: float = 5.0):
+        """Detiene el hilo despachador y cede el liderazgo si lo tenía."""
+        with self._cond:
+            self._detener = True
+            self._cond.notify_all()
+        if self._hilo is not None:
+            self._hilo.join(espera)
+        if self._hilo_recuperacion is not None:
+            self._hilo_recuperacion.join(espera)
+
+    def cargar_pendientes(self):
+        """Carga en el montículo los recordatorios pendientes con un recorrido por rango."""
+        columnas = construir_columnas(self._consultar_pendientes())
+        with self._cond:
+            # Conserva lo que se haya programado mientras tanto
+            self._heap.cargar_columnas(*columnas)
+            self._cond.notify_all()
+        self.logger.info("Recordatorios pendientes cargados: %d", len(columnas[0]))
+
+    def _consultar_pendientes(self):
+        """Cursor sobre los pendientes de la partición ordenados por fire_at"""
+        return self.conn.execute(
+            """SELECT r.next_fire_at, r.id, u.telegram_id
+            FROM recordatorios r
+            JOIN usuarios u ON r.usuario_id = u.id
+            WHERE r.completado = 0 AND r.next_fire_at IS NOT NULL
+            AND abs(u.telegram_id) % ? = ?
+            ORDER BY r.next_fire_at""",
+            self._particion
+        )
+
+    def cargar_instantanea(self) -> bool:
+        """
+        Carga los pendientes desde la instantánea si sigue vigente.
+        Devuelve False si no hay instantánea o está obsoleta.
+        """
+        if not self.ruta_instantanea:
+            return False
+        inicio = time.perf_counter()
+        version = SecureDB.leer_estado(self.conn, CLAVE_VERSION)
+        columnas = leer_instantanea(self.ruta_instantanea, version, self._particion)
+        if columnas is None:
+            self.logger.info("Instantánea del planificador ausente u obsoleta; se reconstruye")
+            return False
+        with self._cond:
+            self._heap.cargar_columnas(*columnas)
+            self._cond.notify_all()
+        self._version_instantanea = version
+        self.logger.info("Recordatorios pendientes cargados de la instantánea: %d en %.3f s",
+                         len(columnas[0]), time.perf_counter() - inicio)
+        return True
+
+    def guardar_instantanea(self):
+        """Escribe la instantánea si la BD cambió desde la última."""
+        self._ultima_instantanea = time.time()
+        if SecureDB.leer_estado(self.conn, CLAVE_VERSION) == self._version_instantanea:
+            return
+        # Versión y filas en la misma transacción de lectura para que casen;
+        # si ya hay una abierta se lee dentro de ella y no se confirma aquí
+        propia = not self.conn.in_transaction
+        if propia:
+            self.conn.execute("BEGIN")
+        try:
+            version = SecureDB.leer_estado(self.conn, CLAVE_VERSION)
+            columnas = construir_columnas(self._consultar_pendientes())
+        finally:
+            if propia:
+                self.conn.commit()
+        total = escribir_instantanea(self.ruta_instantanea, version, self._particion, columnas)
+        self._version_instantanea = version
+        self.logger.debug("Instantánea del planificador guardada: %d entradas", total)
+
+    def _rellenar_next_fire_at(self):
+        """Calcula `next_fire_at` para recordatorios creados antes de existir la columna"""
+        filas = self.conn.execute(
+            """SELECT r.id, r.hora_recordatorio, r.recurrente, r.regla_recurrencia,
+                u.zona_horaria
+            FROM recordatorios r
+            JOIN usuarios u ON r.usuario_id = u.id
+            WHERE r.completado = 0 AND r.next_fire_at IS NULL
+            AND abs(u.telegram_id) % ? = ?""",
+            self._particion
+        ).fetchall()
+        if filas:
+            self.conn.executemany(
+                "UPDATE recordatorios SET next_fire_at = ? WHERE id = ?",
+                [(proximo_disparo(hora, regla_efectiva(regla, recurrente), zona=self.zona(nombre)),
+                  reminder_id)
+                 for reminder_id, hora, recurrente, regla, nombre in filas]
+            )
+            self.conn.commit()
+
+    def zona(self, nombre: str):
+        """Zona de un usuario, o la zona por defecto si no eligió ninguna."""
+        return obtener_zona(nombre or self.zona_defecto)
+
+    def programar(self, reminder_id: int, telegram_id: int, fire_at: int):
+        """Añade un recordatorio ya guardado en la base de datos."""
+        self.programar_lote([(reminder_id, telegram_id, fire_at)])
+
+    def programar_lote(self, entradas):
+        """Añade varios recordatorios (reminder_id, telegram_id, fire_at) de una vez."""
+        with self._cond:
+            for reminder_id, telegram_id, fire_at in entradas:
+                self._heap.insertar(fire_at, reminder_id, telegram_id)
+            self._cond.notify_all()
+
+    def abrir_ventana_recuperacion(self, conn=None) -> tuple:
+        """
+        Fija la ventana de la caída: desde el último latido (menos un
+        intervalo de margen) hasta ahora. Las entradas del montículo que
+        vencen dentro de ella las atiende la recuperación y el despachador
+        las salta; sin latido previo la ventana empieza en 0. Cuenta antes
+        los pendientes anteriores a la ventana, que despacha el montículo.
+        """
+        conn = conn or self.conn
+        latido = SecureDB.leer_estado(conn, CLAVE_LATIDO)
+        desde = max(0, latido - int(self.intervalo_latido)) if latido else 0
+        self._anteriores_caida = conn.execute(
+            """SELECT COUNT(*)
+            FROM recordatorios r
+            JOIN usuarios u ON r.usuario_id = u.id
+            WHERE r.completado = 0 AND r.next_fire_at < ?
+            AND abs(u.telegram_id) % ? = ?""",
+            (desde, *self._particion)
+        ).fetchone()[0]
+        with self._cond:
+            self._turno += 1
+            self._ventana_recuperacion = (desde, int(time.time()))
+        return self._ventana_recuperacion
+
+    def _en_recuperacion(self, fire_at: int) -> bool:
+        """Si la entrada vence dentro de la ventana que atiende la recuperación"""
+        ventana = self._ventana_recuperacion
+        return ventana is not None and ventana[0] <= fire_at < ventana[1]
+
+    def recuperar_perdidos(self, conn=None) -> dict:
+        """
+        Trata los recordatorios que vencían dentro de la ventana de la caída
+        (ver abrir_ventana_recuperacion) según la política configurada:
+        'entregar' los envía todos, 'omitir' ninguno y 'gracia' solo los que
+        llevan menos de `gracia` segundos de retraso. Los vencidos antes de
+        la ventana los despacha el montículo como cualquier otro. Los envíos
+        se limitan a `tasa_recuperacion` mensajes por segundo y se abandona si
+        el planificador se detiene o cede el despacho. Devuelve los contadores.
+        """
+        conn = conn or self.conn
+        if self._ventana_recuperacion is None:
+            self.abrir_ventana_recuperacion(conn)
+        turno = self._turno
+        desde, hasta = self._ventana_recuperacion
+        resumen = {"ventana_caida": hasta - desde if desde else None,
+                   "entregados": 0, "omitidos": 0, "fallidos": 0,
+                   "anteriores_caida": self._anteriores_caida}
+        filas = conn.execute(
+            """SELECT r.id, u.telegram_id, r.texto, r.hora_recordatorio,
+                r.recurrente, r.regla_recurrencia, r.next_fire_at, u.zona_horaria
+            FROM recordatorios r
+            JOIN usuarios u ON r.usuario_id = u.id
+            WHERE r.completado = 0 AND r.next_fire_at >= ? AND r.next_fire_at < ?
+            AND abs(u.telegram_id) % ? = ?
+            ORDER BY r.next_fire_at""",
+            (desde, hasta, *self._particion)
+        ).fetchall()
+
+        pausa = 1.0 / self.tasa_recuperacion if self.tasa_recuperacion > 0 else 0
+        cambios_recurrentes, completados = [], []
+        for reminder_id, telegram_id, texto, hora, recurrente, regla, fire_at, nombre in filas:
+            with self._cond:
+                if self._detener or self._turno != turno:
+                    break
+            entregar = (self.politica_recuperacion == 'entregar' or
+                        (self.politica_recuperacion == 'gracia' and hasta - fire_at <= self.gracia))
+            if entregar:
+                try:
+                    self.enviar(telegram_id, texto, fire_at)
+                    resumen["entregados"] += 1
+                    self._recuperados.incrementar()
+                except Exception as e: # pylint: disable=broad-except
+                    resumen["fallidos"] += 1
+                    self._fallidos.incrementar()
+                    self.logger.error(f"Error recuperando recordatorio {reminder_id}: {str(e)}")
+                    # Sigue pendiente con su next_fire_at; el despachador lo reintenta
+                    with self._cond:
+                        self._reintentar(fire_at, reminder_id, telegram_id)
+                    continue
+                finally:
+                    if pausa:
+                        with self._cond:
+                            self._cond.wait_for(
+                                lambda: self._detener or self._turno != turno, pausa
+                            )
+            else:
+                resumen["omitidos"] += 1
+                self._omitidos.incrementar()
+
+            regla = regla_efectiva(regla, recurrente)
+            if regla is not None:
+                # Una sola ocurrencia futura aunque se hayan perdido varias
+                cambios_recurrentes.append((
+                    regla.siguiente(hora, max(time.time(), hasta) + 1, self.zona(nombre), fire_at),
+                    reminder_id, telegram_id, fire_at
+                ))
+            else:
+                completados.append((reminder_id, fire_at))
+            # Confirmar por tramos para no reenviar todo si el proceso cae a mitad
+            if len(cambios_recurrentes) + len(completados) >= TRAMO_RECUPERACION:
+                self._confirmar_recuperados(conn, cambios_recurrentes, completados)
+                cambios_recurrentes, completados = [], []
+
+        self._confirmar_recuperados(conn, cambios_recurrentes, completados)
+        return resumen
+
+    def _confirmar_recuperados(self, conn, cambios_recurrentes, completados):
+        # Solo si la fila no se reprogramó o borró mientras se recuperaba
+        conn.executemany(
+            "UPDATE recordatorios SET next_fire_at = ? WHERE id = ? AND next_fire_at = ?",
+            [(siguiente, reminder_id, fire_at)
+             for siguiente, reminder_id, _, fire_at in cambios_recurrentes]
+        )
+        conn.executemany(
+            """UPDATE recordatorios SET completado = 1, next_fire_at = NULL
+            WHERE id = ? AND next_fire_at = ?""",
+            completados
+        )
+        conn.commit()
+        # Las entradas ya cargadas de estos recordatorios quedan obsoletas
+        self.programar_lote((reminder_id, telegram_id, siguiente)
+                            for siguiente, reminder_id, telegram_id, _ in cambios_recurrentes)
+
+    def _recuperar_en_segundo_plano(self):
+        """Hilo de recuperación con su propia conexión, sin frenar al despachador"""
+        conn = self.db.nueva_conexion()
+        try:
+            resumen = self.recuperar_perdidos(conn)
+            self.logger.info("Recuperación de recordatorios tras el arranque: %s", resumen)
+        except Exception as e: # pylint: disable=broad-except
+            conn.rollback()
+            self.logger.error(f"Error recuperando recordatorios perdidos: {str(e)}")
+        finally:
+            conn.close()
+
+    def _latir(self):
+        """Guarda la última vez que el planificador estuvo vivo"""
+        self._ultimo_latido = time.time()
+        SecureDB.guardar_estado(self.conn, CLAVE_LATIDO, int(self._ultimo_latido))
+        self.conn.commit()
+
+    def _asumir_despacho(self):
+        """
+        Carga los pendientes y lanza la recuperación de lo perdido en su
+        propio hilo, para que su ritmo no retrase los recordatorios futuros
+        """
+        self._ultimo_sondeo = self._ultima_instantanea = time.time()
+        self.abrir_ventana_recuperacion()
+        # Antes de recuperar, porque la recuperación cambia la versión de la BD;
+        # las entradas que deje obsoletas se descartan al disparar
+        if not self.cargar_instantanea():
+            self.cargar_pendientes()
+        if self._hilo_recuperacion is not None:
+            # Un turno anterior que aún termina su tramo; ve el cambio de turno
+            self._hilo_recuperacion.join()
+        self._hilo_recuperacion = Thread(target=self._recuperar_en_segundo_plano,
+                                         name="recuperacion", daemon=True)
+        self._hilo_recuperacion.start()
+
+    def _sondear(self):
+        """
+        Encola los recordatorios que vencen antes del próximo sondeo. Los
+        creados o reprogramados por otras instancias siempre tienen
+        `next_fire_at` posterior al sondeo anterior, así que las ventanas
+        sucesivas no dejan huecos.
+        """
+        ahora = time.time()
+        filas = self.conn.execute(
+            """SELECT r.next_fire_at, r.id, u.telegram_id
+            FROM recordatorios r
+            JOIN usuarios u ON r.usuario_id = u.id
+            WHERE r.completado = 0 AND r.next_fire_at BETWEEN ? AND ?
+            AND abs(u.telegram_id) % ? = ?""",
+            (int(self._ultimo_sondeo) - 1, int(ahora + self.intervalo_sondeo) + 1,
+             *self._particion)
+        ).fetchall()
+        self._ultimo_sondeo = ahora
+        if filas:
+            self.programar_lote((reminder_id, telegram_id, fire_at)
+                                for fire_at, reminder_id, telegram_id in filas)
+
+    def _es_despachador(self) -> bool:
+        """Si esta instancia debe despachar ahora (siempre sin arrendamiento)"""
+        return self.lider is None or self.lider.mantener()
+
+    def _run(self):
+        try:
+            self._bucle()
+        finally:
+            if self._despachando and self.ruta_instantanea:
+                try:
+                    self.guardar_instantanea()
+                except Exception as e: # pylint: disable=broad-except
+                    self.logger.error(f"Error guardando la instantánea del planificador: {str(e)}")
+            if self.lider is not None:
+                self.lider.liberar()
+
+    def _bucle(self):
+        while True:
+            if not self._es_despachador():
+                if self._despachando:
+                    self.logger.warning("Despacho de recordatorios cedido a otra instancia")
+                self._despachando = False
+                with self._cond:
+                    # Lo despacha el líder; se recargará al recuperar el liderazgo
+                    self._heap.limpiar()
+                    self._turno += 1
+                    self._ventana_recuperacion = None
+                    self._cond.notify_all()
+                    if self._cond.wait_for(lambda: self._detener,
+                                           self.lider.intervalo_renovacion):
+                        return
+                continue
+            if not self._despachando:
+                self._despachando = True
+                self._asumir_despacho()
+
+            if time.time() - self._ultimo_latido >= self.intervalo_latido:
+                try:
+                    self._latir()
+                except Exception as e: # pylint: disable=broad-except
+                    self.conn.rollback()
+                    self.logger.error(f"Error guardando el latido del planificador: {str(e)}")
+            sondear = time.time() - self._ultimo_sondeo >= self.intervalo_sondeo
+            if self.lider is not None and sondear:
+                try:
+                    self._sondear()
+                except Exception as e: # pylint: disable=broad-except
+                    self.logger.error(f"Error sondeando recordatorios nuevos: {str(e)}")
+            instantanea = time.time() - self._ultima_instantanea >= self.intervalo_instantanea
+            if self.ruta_instantanea and instantanea:
+                try:
+                    self.guardar_instantanea()
+                except Exception as e: # pylint: disable=broad-except
+                    self.conn.rollback()
+                    self.logger.error(f"Error guardando la instantánea del planificador: {str(e)}")
+
+            with self._cond:
+                while not self._detener:
+                    ahora = time.time()
+                    proximo = self._heap.proximo()
+                    if proximo is not None and proximo <= ahora:
+                        break
+                    espera = proximo - ahora if proximo is not None else ESPERA_MAXIMA
+                    espera = min(espera, self._ultimo_latido + self.intervalo_latido - ahora)
+                    if self.lider is not None:
+                        espera = min(espera, self._ultimo_sondeo + self.intervalo_sondeo - ahora,
+                                     self.lider.intervalo_renovacion)
+                    if self.ruta_instantanea:
+                        espera = min(espera, self._ultima_instantanea
+                                     + self.intervalo_instantanea - ahora)
+                    if espera <= 0:
+                        break
+                    self._cond.wait(min(espera, ESPERA_MAXIMA))
+                if self._detener:
+                    return
+                vencidos = []
+                ahora = time.time()
+                while self._heap and self._heap.proximo() <= ahora:
+                    entrada = self._heap.extraer()
+                    # Las de la ventana de la caída las envía la recuperación
+                    if not self._en_recuperacion(entrada[0]):
+                        vencidos.append(entrada)
+
+            if self._despachar_tramo(vencidos, ahora):
+                return
+
+    def _despachar_tramo(self, vencidos, desencolado: float = None) -> bool:
+        """
+        Envía un tramo de recordatorios vencidos (sacados del montículo en
+        `desencolado`) en orden equitativo y espaciado. Devuelve True si se
+        pidió detener el planificador.
+        """
+        desencolado = desencolado or time.time()
+        orden = orden_equitativo(vencidos)
+        for fire_at, _, _ in orden:
+            self._retraso_desencolado.observar(max(0.0, desencolado - fire_at))
+        ventana = 0.0
+        if self.tasa_despacho > 0:
+            ventana = min(self.ventana_dispersion, len(orden) / self.tasa_despacho)
+        intervalo = ventana / len(orden) if orden else 0.0
+        inicio = time.monotonic()
+        retrasos, enviados = [], 0
+        for fire_at, reminder_id, telegram_id in orden:
+            espera = inicio + enviados * intervalo - time.monotonic()
+            if espera > 0:
+                with self._cond:
+                    if self._cond.wait_for(lambda: self._detener, espera):
+                        return True
+            # Un envío largo no debe prolongar un liderazgo ya caducado
+            if not self._es_despachador():
+                break
+            self._espera_envio.observar(time.time() - desencolado)
+            try:
+                if self._disparar(fire_at, reminder_id, telegram_id):
+                    enviados += 1
+                    retrasos.append(max(0.0, time.time() - fire_at))
+                    self._retraso_entrega.observar(retrasos[-1])
+                    self._enviados.incrementar()
+                else:
+                    self._descartados.incrementar()
+            except Exception as e: # pylint: disable=broad-except
+                self.conn.rollback()
+                self._fallidos.incrementar()
+                self.logger.error(f"Error disparando recordatorio {reminder_id}: {str(e)}")
+        self._resumir_tramo(orden, retrasos, time.monotonic() - inicio)
+        return False
+
+    def _resumir_tramo(self, orden, retrasos, duracion):
+        """Registra la profundidad por minuto del tramo y su p99 de retraso"""
+        if len(orden) < TRAMO_MINIMO_LOG and not any(r > self.sla_entrega for r in retrasos):
+            return
+        profundidad = {}
+        for fire_at, _, _ in orden:
+            minuto = time.strftime("%H:%M", time.gmtime(fire_at - fire_at % 60))
+            profundidad[minuto] = profundidad.get(minuto, 0) + 1
+        tramo = Histograma("tramo")
+        for retraso in retrasos:
+            tramo.observar(retraso)
+        p99 = tramo.percentil(0.99)
+        nivel = logging.WARNING if p99 > self.sla_entrega else logging.INFO
+        self.logger.log(
+            nivel,
+            "Tramo de recordatorios: %d en cola (por minuto UTC: %s), %d enviados en %.1f s, "
+            "retraso p50 %.2f s, p99 %.2f s (SLA %.0f s)",
+            len(orden), profundidad, len(retrasos), duracion,
+            tramo.percentil(0.5), p99, self.sla_entrega
+        )
+
+    def _disparar(self, fire_at: int, reminder_id: int, telegram_id: int) -> bool:
+        """
+        Envía el recordatorio si sigue vigente. Devuelve si se envió. Si el
+        envío falla, programa un reintento y relanza el error.
+        """
+        reintento = self._reintentos.get(reminder_id)
+        if reintento is not None and reintento[2] == fire_at:
+            # La entrada es un reintento: la fila conserva la hora programada
+            fire_at = reintento[0]
+        fila = self.conn.execute(
+            """SELECT r.texto, r.hora_recordatorio, r.recurrente, r.regla_recurrencia,
+                r.next_fire_at, r.completado, u.zona_horaria
+            FROM recordatorios r
+            JOIN usuarios u ON r.usuario_id = u.id
+            WHERE r.id = ?""",
+            (reminder_id,)
+        ).fetchone()
+        if fila is None:
+            self._reintentos.pop(reminder_id, None)
+            return False
+        texto, hora, recurrente, regla, next_fire_at, completado, nombre = fila
+        if completado or next_fire_at != fire_at:
+            # Borrado, completado o reprogramado desde que se encoló
+            if reintento is not None and reintento[0] != next_fire_at:
+                del self._reintentos[reminder_id]
+            return False
+
+        try:
+            self.enviar(telegram_id, texto, None)
+        except Exception:
+            if self._reintentar(fire_at, reminder_id, telegram_id):
+                raise
+            self.logger.error("Recordatorio %s abandonado tras %d intentos",
+                              reminder_id, REINTENTOS_ENVIO + 1)
+            self._avanzar(fire_at, reminder_id, telegram_id, hora, regla, recurrente, nombre)
+            raise
+        self._reintentos.pop(reminder_id, None)
+        self._avanzar(fire_at, reminder_id, telegram_id, hora, regla, recurrente, nombre)
+        return True
+
+    def _reintentar(self, fire_at: int, reminder_id: int, telegram_id: int) -> bool:
+        """
+        Vuelve a encolar, con espera exponencial, un recordatorio cuyo envío
+        falló. `next_fire_at` no cambia, así que si el proceso cae entretanto
+        lo entrega la recuperación del arranque. Devuelve False si se agotaron
+        los reintentos.
+        """
+        intentos = self._reintentos.get(reminder_id, (fire_at, 0, None))[1] + 1
+        if intentos > REINTENTOS_ENVIO:
+            self._reintentos.pop(reminder_id, None)
+            return False
+        cuando = int(time.time() + ESPERA_REINTENTO * 2 ** (intentos - 1))
+        self._reintentos[reminder_id] = (fire_at, intentos, cuando)
+        self.programar(reminder_id, telegram_id, cuando)
+        return True
+
+    def _avanzar(self, fire_at, reminder_id, telegram_id, hora, regla, recurrente, nombre):
+        """Pasa el recordatorio a su siguiente ocurrencia o lo da por completado"""
+        regla = regla_efectiva(regla, recurrente)
+        if regla is not None:
+            siguiente = regla.siguiente(
+                hora, max(time.time(), fire_at) + 1, self.zona(nombre), fire_at
+            )
+            self.conn.execute(
+                "UPDATE recordatorios SET next_fire_at = ? WHERE id = ?",
+                (siguiente, reminder_id)
+            )
+            self.conn.commit()
+            self.programar(reminder_id, telegram_id, siguiente)
+        else:
+            self.conn.execute(
+                "UPDATE recordatorios SET completado = 1, next_fire_at = NULL WHERE id = ?",
+                (reminder_id,)
+            )
+            self.conn.commit()
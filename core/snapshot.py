@@ -0,0 +1,57 @@
+# ------------------------- INSTANTÁNEAS DEL PLANIFICADOR -------------------------
+"""
+Instantánea binaria de los recordatorios pendientes para arrancar el
+planificador sin volver a consultar y parsear todas las filas
+"""
+import mmap
+import os
+import struct
+from array import array
+
+MAGIA = b"RNSNAP01"
+# magia, versión de la BD, total e índice de la partición, número de entradas
+CABECERA = struct.Struct("=8sqqqq")
+CLAVE_VERSION = "version_recordatorios"
+
+
+def escribir_instantanea(ruta: str, version: int, particion: tuple, columnas: tuple) -> int:
+    """
+    Escribe las columnas (fire_at, reminder_id, telegram_id), ordenadas por
+    fire_at, como tres bloques int64 tras la cabecera. El fichero se
+    sustituye de forma atómica. Devuelve el número de entradas.
+    """
+    total, indice = particion
+    temporal = f"{ruta}.{os.getpid()}.tmp"
+    with open(temporal, "wb") as fichero:
+        fichero.write(CABECERA.pack(MAGIA, version, total, indice, len(columnas[0])))
+        for columna in columnas:
+            columna.tofile(fichero)
+        fichero.flush()
+        os.fsync(fichero.fileno())
+    os.replace(temporal, ruta)
+    return len(columnas[0])
+
+
+def leer_instantanea(ruta: str, version: int, particion: tuple):
+    """
+    Proyecta en memoria la instantánea y copia sus tres columnas a
+    array('q'), ya ordenadas por fire_at. Devuelve None si no existe, está
+    dañada o no corresponde a `version` y `particion`.
+    """
+    try:
+        with open(ruta, "rb") as fichero, \
+                mmap.mmap(fichero.fileno(), 0, access=mmap.ACCESS_READ) as mapa:
+            if len(mapa) < CABECERA.size:
+                return None
+            magia, guardada, total, indice, cantidad = CABECERA.unpack_from(mapa)
+            bloque = 8 * cantidad
+            if (magia != MAGIA or guardada != version or (total, indice) != tuple(particion)
+                    or len(mapa) != CABECERA.size + 3 * bloque):
+                return None
+            columnas = (array('q'), array('q'), array('q'))
+            for numero, columna in enumerate(columnas):
+                inicio = CABECERA.size + numero * bloque
+                columna.frombytes(mapa[inicio:inicio + bloque])
+            return columnas
+    except (OSError, ValueError, struct.error):
+        return None
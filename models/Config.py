@@ -8,9 +8,12 @@ import sys
 import io
 import logging
 from pathlib import Path
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 from dotenv import load_dotenv
 import pyotp
 
+from models.database import PERFIL_DEFECTO, PERFILES_ALMACENAMIENTO
+
 
 class Config:
     """
@@ -38,6 +41,94 @@ class Config:
         if not self.clave_maestra:
             raise ValueError("❌ ENCRYPTION_MASTER_PASSWORD no está configurado en el archivo .env")
 
+        # Clave anterior (opcional) mientras se rotan las notas a la clave actual
+        self.claves_anteriores = []
+        clave_anterior = os.getenv("ENCRYPTION_PREVIOUS_MASTER_PASSWORD")
+        if clave_anterior:
+            salt_anterior = os.getenv("ENCRYPTION_PREVIOUS_SALT", salt).encode()
+            self.claves_anteriores.append((salt_anterior, clave_anterior))
+
+        # Cifrado por lotes: 'hilos' o 'procesos' y número de trabajadores (0 = núcleos)
+        self.modo_cifrado_paralelo = os.getenv("ENCRYPTION_PARALLEL_MODE", "hilos")
+        if self.modo_cifrado_paralelo not in ('hilos', 'procesos'):
+            raise ValueError("❌ ENCRYPTION_PARALLEL_MODE debe ser 'hilos' o 'procesos'")
+        self.trabajadores_cifrado = int(os.getenv("ENCRYPTION_WORKERS", "0")) or None
+        # Número máximo de claves de usuario derivadas que se mantienen en memoria
+        self.tamano_cache_claves = int(os.getenv("ENCRYPTION_KEY_CACHE_SIZE", "1024"))
+
+        # Recuperación de recordatorios vencidos mientras el bot estaba parado:
+        # 'gracia' (solo los de menos de N minutos de retraso), 'entregar' u 'omitir'
+        self.politica_recuperacion = os.getenv("REMINDER_CATCHUP_POLICY", "gracia")
+        if self.politica_recuperacion not in ('gracia', 'entregar', 'omitir'):
+            raise ValueError(
+                "❌ REMINDER_CATCHUP_POLICY debe ser 'gracia', 'entregar' u 'omitir'"
+            )
+        self.gracia_recuperacion = float(os.getenv("REMINDER_CATCHUP_GRACE_MINUTES", "60")) * 60
+        self.tasa_recuperacion = float(os.getenv("REMINDER_CATCHUP_RATE", "20"))
+
+        # Varias instancias sobre la misma BD: solo la que tiene el arrendamiento
+        # despacha recordatorios. Un INSTANCE_ID estable permite retomarlo al reiniciar
+        self.id_instancia = os.getenv("INSTANCE_ID") or None
+        self.ttl_liderazgo = float(os.getenv("SCHEDULER_LEASE_TTL", "15"))
+        if self.ttl_liderazgo <= 0:
+            raise ValueError("❌ SCHEDULER_LEASE_TTL debe ser mayor que 0")
+
+        # Reparto de los envíos que vencen a la vez: mensajes por segundo, ventana
+        # máxima en segundos (0 = sin reparto) y SLA de retraso para el p99
+        self.tasa_despacho = float(os.getenv("REMINDER_DISPATCH_RATE", "25"))
+        self.ventana_dispersion = float(os.getenv("REMINDER_JITTER_WINDOW", "20"))
+        self.sla_entrega = float(os.getenv("REMINDER_DELIVERY_SLA", "60"))
+        # Cada cuánto se resumen en el log las métricas de entrega (0 = nunca)
+        self.intervalo_metricas = float(os.getenv("METRICS_LOG_INTERVAL", "300"))
+        # Puerto local (127.0.0.1) con las métricas en formato Prometheus (vacío = sin servidor)
+        self.puerto_metricas = int(os.getenv("METRICS_PORT") or 0)
+        # Sentencias SQL más lentas que esto (ms) se registran con su plan de consulta
+        self.umbral_consulta_lenta = float(os.getenv("DB_SLOW_QUERY_MS", "100")) / 1000
+        # Perfil de PRAGMAs de SQLite (ver PERFILES_ALMACENAMIENTO)
+        self.perfil_bd = os.getenv("DB_PROFILE", PERFIL_DEFECTO)
+        if self.perfil_bd not in PERFILES_ALMACENAMIENTO:
+            raise ValueError(
+                f"❌ DB_PROFILE debe ser uno de: {', '.join(PERFILES_ALMACENAMIENTO)}"
+            )
+        # Cada cuánto se hace checkpoint del WAL y, en momentos sin tráfico,
+        # vacuum incremental y ANALYZE (0 = sin mantenimiento)
+        self.intervalo_mantenimiento = float(os.getenv("DB_MAINTENANCE_INTERVAL", "300"))
+        # Copias de seguridad comprimidas en este directorio (vacío = sin copias),
+        # cada BACKUP_INTERVAL segundos y conservando las BACKUP_RETENTION últimas
+        self.directorio_copias = os.getenv("BACKUP_DIR") or None
+        self.intervalo_copias = float(os.getenv("BACKUP_INTERVAL", "86400"))
+        self.retencion_copias = int(os.getenv("BACKUP_RETENTION", "7"))
+        if self.directorio_copias and self.intervalo_copias <= 0:
+            raise ValueError("❌ BACKUP_INTERVAL debe ser mayor que 0")
+        # Almacén cifrado de las fotos y documentos adjuntos a las notas
+        self.directorio_adjuntos = os.getenv("ATTACHMENTS_DIR", "adjuntos")
+        # Usuarios de Telegram que pueden consultar /stats
+        self.ids_administradores = {
+            int(valor) for valor in os.getenv("ADMIN_TELEGRAM_IDS", "").split(",") if valor.strip()
+        }
+
+        # Cada cuánto se guarda la instantánea del planificador (0 = desactivada)
+        self.intervalo_instantanea = float(os.getenv("SCHEDULER_SNAPSHOT_INTERVAL", "300"))
+
+        # Procesos que se reparten el despacho de recordatorios (1 = en el propio bot)
+        self.procesos_despacho = int(os.getenv("REMINDER_WORKERS", "1"))
+        if self.procesos_despacho < 1:
+            raise ValueError("❌ REMINDER_WORKERS debe ser al menos 1")
+        # URL alternativa de la Bot API (servidor local), con {0}=token y {1}=método
+        self.api_url = os.getenv("TELEGRAM_API_URL") or None
+
+        # Zona horaria de los usuarios que no eligieron una (vacío = hora del servidor)
+        self.zona_defecto = os.getenv("DEFAULT_TIMEZONE") or None
+        if self.zona_defecto:
+            try:
+                ZoneInfo(self.zona_defecto)
+            except (ZoneInfoNotFoundError, ValueError) as e:
+                raise ValueError(f"❌ DEFAULT_TIMEZONE '{self.zona_defecto}' no es válida") from e
+        self.zonas_sugeridas = [
+            'Europe/Madrid', 'Europe/London', 'America/Mexico_City', 'America/Bogota',
+            'America/Argentina/Buenos_Aires', 'America/Sao_Paulo', 'America/New_York', 'UTC'
+        ]
+
         # Configuración de internacionalización
         self.locales_dir = Path(__file__).parent / 'locales'
         self.supported_langs = ['es', 'en', 'pt']
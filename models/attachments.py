@@ -0,0 +1,214 @@
+# ------------------------- ADJUNTOS -------------------------
+"""
+Almacén de ficheros adjuntos direccionado por contenido: cada fichero se
+guarda una sola vez, cifrado, fuera de SQLite y leído o escrito por bloques
+"""
+import base64
+import hashlib
+import hmac
+import os
+import struct
+import tempfile
+from pathlib import Path
+from threading import Lock
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+from models.database import SecureDB
+from models.metrics import FASE_CIFRADO, medido
+
+# Formato del blob: MAGIA | longitud de la clave envuelta (2 B) | clave envuelta |
+# bloques AES-256-GCM de TAMANO_BLOQUE bytes de texto (+16 B de tag) cada uno.
+# La cabecera va como datos asociados de cada bloque y el nonce lleva el número
+# de bloque y una marca de último bloque, así que reordenar o truncar se detecta
+MAGIA = b"RNA1"
+TAMANO_BLOQUE = 64 * 1024
+LONGITUD_TAG = 16
+# La Bot API no deja descargar ficheros de más de 20 MB
+MAX_TAMANO_ADJUNTO = 20 * 1024 * 1024
+_LONGITUD_CLAVE = struct.Struct(">H")
+# Estado donde se guarda, envuelta con la clave maestra, la clave de direcciones
+CLAVE_DIRECCION = "adjuntos_clave_direccion"
+
+
+def _nonce(indice: int, ultimo: bool) -> bytes:
+    # La clave es única por blob, así que un contador no repite nonces
+    return struct.pack(">Q3xB", indice, 1 if ultimo else 0)
+
+
+def cargar_clave_direccion(conn, cifrado) -> bytes:
+    """
+    Devuelve la clave HMAC de las direcciones. Se guarda envuelta con el
+    cifrado maestro para que no cambie al rotar la clave maestra (las
+    direcciones de los blobs existentes siguen deduplicando); la primera vez
+    se deriva de la clave principal, como la calculaban las versiones previas.
+    """
+    envuelta = SecureDB.leer_estado(conn, CLAVE_DIRECCION)
+    if envuelta:
+        return cifrado.cipher.descifrar(base64.b64decode(envuelta))
+    clave = HKDF(
+        algorithm=hashes.SHA256(), length=32, salt=None, info=b"reconotas-adjuntos-direccion"
+    ).derive(cifrado.claves_maestras[0])
+    SecureDB.guardar_estado(
+        conn, CLAVE_DIRECCION, base64.b64encode(cifrado.cipher.cifrar(clave)).decode()
+    )
+    conn.commit()
+    return clave
+
+
+def rotar_clave_direccion(conn, cifrado):
+    """Vuelve a envolver con la clave maestra actual la clave de direcciones, sin confirmar."""
+    envuelta = SecureDB.leer_estado(conn, CLAVE_DIRECCION)
+    if envuelta:
+        SecureDB.guardar_estado(conn, CLAVE_DIRECCION, base64.b64encode(
+            cifrado.cipher.rotar(base64.b64decode(envuelta))
+        ).decode())
+
+
+class AlmacenAdjuntos:
+    """
+    Blobs en `directorio/ab/cd/<dirección>`, donde la dirección es el
+    HMAC-SHA256 del contenido con `clave_direccion` (ver
+    cargar_clave_direccion): sin ella no se puede comprobar si alguien guardó
+    un fichero concreto. Cada blob se cifra con una clave aleatoria propia,
+    envuelta con el cifrado maestro (`cifrado.cipher`) en su cabecera, así que
+    un blob repetido se reutiliza tal cual; `reenvolver` lo pasa a la clave
+    maestra actual tras una rotación.
+    """
+
+    def __init__(self, directorio: str, cifrado, clave_direccion: bytes):
+        self.directorio = Path(directorio)
+        self._envoltorio = cifrado.cipher
+        self._clave_direccion = clave_direccion
+        self._temporales = self.directorio / "tmp"
+        # Publicar un blob y registrarlo no puede cruzarse con la recolección
+        self._lock = Lock()
+
+    def ruta(self, direccion: str) -> Path:
+        """Ruta del blob, repartida en dos niveles de subdirectorios."""
+        return self.directorio / direccion[:2] / direccion[2:4] / direccion
+
+    def guardar(self, bloques, registrar):
+        """
+        Cifra a un temporal los bloques de bytes de `bloques` (un iterable,
+        p. ej. una descarga por streaming), calculando a la vez su dirección.
+        Después, bajo el bloqueo del almacén, publica el blob si no existía y
+        llama a `registrar(direccion, tamano)`, cuyo resultado devuelve.
+        """
+        self._temporales.mkdir(parents=True, exist_ok=True)
+        descriptor, temporal = tempfile.mkstemp(dir=self._temporales)
+        try:
+            with os.fdopen(descriptor, "wb") as salida:
+                direccion, tamano = self._cifrar(bloques, salida)
+            ruta = self.ruta(direccion)
+            with self._lock:
+                nuevo = not ruta.exists()
+                if nuevo:
+                    ruta.parent.mkdir(parents=True, exist_ok=True)
+                    os.replace(temporal, ruta)
+                try:
+                    return registrar(direccion, tamano)
+                except Exception:
+                    if nuevo:
+                        ruta.unlink(missing_ok=True)
+                    raise
+        finally:
+            Path(temporal).unlink(missing_ok=True)
+
+    @medido(FASE_CIFRADO)
+    def _cifrar(self, bloques, salida) -> tuple:
+        clave = AESGCM.generate_key(bit_length=256)
+        envuelta = self._envoltorio.cifrar(clave)
+        cabecera = MAGIA + _LONGITUD_CLAVE.pack(len(envuelta)) + envuelta
+        salida.write(cabecera)
+        aead = AESGCM(clave)
+        resumen = hmac.new(self._clave_direccion, digestmod=hashlib.sha256)
+
+        tamano, indice, pendiente = 0, 0, bytearray()
+        for bloque in bloques:
+            tamano += len(bloque)
+            if tamano > MAX_TAMANO_ADJUNTO:
+                raise ValueError("El adjunto supera el tamaño máximo")
+            resumen.update(bloque)
+            pendiente += bloque
+            # Queda siempre al menos un bloque pendiente para cifrarlo como el último
+            desde = 0
+            while len(pendiente) - desde > TAMANO_BLOQUE:
+                salida.write(aead.encrypt(
+                    _nonce(indice, False), bytes(pendiente[desde:desde + TAMANO_BLOQUE]),
+                    cabecera
+                ))
+                desde += TAMANO_BLOQUE
+                indice += 1
+            del pendiente[:desde]
+        salida.write(aead.encrypt(_nonce(indice, True), bytes(pendiente), cabecera))
+        return resumen.hexdigest(), tamano
+
+    @staticmethod
+    def _leer_cabecera(entrada, direccion: str) -> tuple:
+        """Devuelve (cabecera completa, clave envuelta) del blob abierto"""
+        inicio = entrada.read(len(MAGIA) + _LONGITUD_CLAVE.size)
+        if inicio[:len(MAGIA)] != MAGIA:
+            raise ValueError(f"Blob {direccion} con formato desconocido")
+        envuelta = entrada.read(_LONGITUD_CLAVE.unpack_from(inicio, len(MAGIA))[0])
+        return inicio + envuelta, envuelta
+
+    def reenvolver(self, direccion: str) -> bool:
+        """
+        Si la clave del blob está envuelta con una clave maestra anterior, lo
+        vuelve a cifrar entero con una clave nueva (la cabecera autentica cada
+        bloque, así que no basta con cambiarla) y lo sustituye bajo el
+        bloqueo, salvo que la recolección lo haya borrado. Devuelve si cambió.
+        """
+        ruta = self.ruta(direccion)
+        with open(ruta, "rb") as entrada:
+            _, envuelta = self._leer_cabecera(entrada, direccion)
+        if self._envoltorio.rotar(envuelta) == envuelta:
+            return False
+        self._temporales.mkdir(parents=True, exist_ok=True)
+        descriptor, temporal = tempfile.mkstemp(dir=self._temporales)
+        try:
+            with os.fdopen(descriptor, "wb") as salida:
+                self._cifrar(self.leer(direccion), salida)
+            with self._lock:
+                if not ruta.exists():
+                    return False
+                os.replace(temporal, ruta)
+        finally:
+            Path(temporal).unlink(missing_ok=True)
+        return True
+
+    def leer(self, direccion: str):
+        """Genera el contenido descifrado del blob bloque a bloque."""
+        with open(self.ruta(direccion), "rb") as entrada:
+            cabecera, envuelta = self._leer_cabecera(entrada, direccion)
+            aead = AESGCM(self._envoltorio.descifrar(envuelta))
+
+            indice = 0
+            actual = entrada.read(TAMANO_BLOQUE + LONGITUD_TAG)
+            while True:
+                siguiente = entrada.read(TAMANO_BLOQUE + LONGITUD_TAG)
+                yield aead.decrypt(_nonce(indice, not siguiente), actual, cabecera)
+                if not siguiente:
+                    return
+                actual = siguiente
+                indice += 1
+
+    def copiar_a(self, direccion: str, destino):
+        """Escribe el contenido descifrado en el fichero binario `destino`."""
+        for bloque in self.leer(direccion):
+            destino.write(bloque)
+
+    def recolectar(self, huerfanos) -> int:
+        """
+        Borra los blobs sin referencias. `huerfanos()` los elimina de la BD y
+        devuelve sus direcciones; se llama bajo el bloqueo del almacén para que
+        un `guardar` concurrente no reutilice un blob que se va a borrar.
+        """
+        with self._lock:
+            direcciones = huerfanos()
+            for direccion in direcciones:
+                self.ruta(direccion).unlink(missing_ok=True)
+        return len(direcciones)
@@ -2,39 +2,315 @@
 """ 
 Aplica una conexion segura con al Base de dtos
 """
+import os
 import sqlite3
 import json
 import logging
+import time
+from functools import lru_cache
 from threading import Lock
 
+from models.metrics import FASE_DB, sumar_fase
+
+# Umbral por defecto (segundos) a partir del cual una sentencia es lenta
+UMBRAL_CONSULTA_LENTA = 0.1
+SENTENCIAS_CON_PLAN = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE")
+# Sentencias preparadas que guarda cada conexión (128 por defecto en sqlite3), con
+# margen para que las del planificador y el mantenimiento no desalojen las de los handlers
+SENTENCIAS_EN_CACHE = 256
+
+# Perfiles de almacenamiento (DB_PROFILE): PRAGMAs que se aplican a cada conexión.
+# cache_size negativo va en KiB; mmap_size en bytes; busy_timeout en ms;
+# wal_autocheckpoint en páginas. Con WAL, synchronous=NORMAL no corrompe la BD
+# pero un corte de luz puede perder las últimas transacciones; OFF también ante
+# un fallo del sistema operativo
+PERFILES_ALMACENAMIENTO = {
+    "durable": {
+        "synchronous": "FULL",
+        "cache_size": -2000,
+        "mmap_size": 0,
+        "temp_store": "DEFAULT",
+        "busy_timeout": 5000,
+        "wal_autocheckpoint": 1000,
+    },
+    "balanced": {
+        "synchronous": "NORMAL",
+        "cache_size": -16000,
+        "mmap_size": 64 * 1024 * 1024,
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,
+        "wal_autocheckpoint": 1000,
+    },
+    "throughput": {
+        "synchronous": "OFF",
+        "cache_size": -64000,
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "MEMORY",
+        "busy_timeout": 10000,
+        "wal_autocheckpoint": 4000,
+    },
+}
+PERFIL_DEFECTO = "durable"
+
+
+@lru_cache(maxsize=2048)
+def normalizar_sentencia(sql: str) -> str:
+    """Colapsa los espacios de la sentencia para agrupar sus ejecuciones."""
+    return " ".join(sql.split())
+
+
+class EstadisticasConsultas:
+    """
+    Tiempo acumulado, ejecuciones y filas de cada sentencia SQL, más el
+    registro de las lentas (por encima de `umbral` segundos) con su
+    EXPLAIN QUERY PLAN. Compartidas por todas las conexiones de un SecureDB.
+    """
+
+    def __init__(self, umbral: float = UMBRAL_CONSULTA_LENTA, logger=None):
+        self.umbral = umbral
+        self.logger = logger or logging.getLogger("SecureBot")
+        # sentencia -> [ejecuciones, segundos, máximo, filas, lentas]
+        self._sentencias = {}
+        self._planes = {}
+        self._lock = Lock()
+
+    def registrar(self, sentencia: str, segundos: float, filas: int, ejecucion: bool,
+                  acumulado: float):
+        """
+        Suma una ejecución (o una lectura posterior, con `ejecucion` False);
+        `acumulado` es el tiempo de esa ejecución con sus lecturas hasta ahora.
+        """
+        with self._lock:
+            datos = self._sentencias.get(sentencia)
+            if datos is None:
+                datos = self._sentencias[sentencia] = [0, 0.0, 0.0, 0, 0]
+            datos[0] += ejecucion
+            datos[1] += segundos
+            datos[2] = max(datos[2], acumulado)
+            datos[3] += filas
+
+    def registrar_lenta(self, conn, sentencia: str, parametros, segundos: float, filas: int):
+        """Anota y registra en el log una ejecución lenta con su plan."""
+        with self._lock:
+            datos = self._sentencias.get(sentencia)
+            if datos is not None:
+                datos[4] += 1
+        self.logger.warning(
+            "Consulta lenta (%.0f ms, %d filas): %s | plan: %s",
+            segundos * 1000, filas, sentencia, self.plan(conn, sentencia, parametros)
+        )
+
+    def plan(self, conn, sentencia: str, parametros) -> str:
+        """EXPLAIN QUERY PLAN de la sentencia, calculado una vez por sentencia."""
+        plan = self._planes.get(sentencia)
+        if plan is not None:
+            return plan
+        if parametros is None or not sentencia.upper().startswith(SENTENCIAS_CON_PLAN):
+            return "no disponible"
+        try:
+            # Cursor base: el EXPLAIN no debe contarse como una consulta más
+            filas = sqlite3.Cursor(conn).execute(
+                "EXPLAIN QUERY PLAN " + sentencia, parametros
+            ).fetchall()
+            plan = "; ".join(fila[-1] for fila in filas)
+        except sqlite3.Error as e:
+            plan = f"no disponible ({str(e)})"
+        self._planes[sentencia] = plan
+        return plan
+
+    def top(self, limite: int = 10) -> list:
+        """Las `limite` sentencias con más tiempo acumulado, como diccionarios."""
+        with self._lock:
+            copia = [(sentencia, list(datos)) for sentencia, datos in self._sentencias.items()]
+        copia.sort(key=lambda par: par[1][1], reverse=True)
+        return [
+            {"sentencia": sentencia, "ejecuciones": ejecuciones, "total": total,
+             "media": total / ejecuciones if ejecuciones else 0.0, "maximo": maximo,
+             "filas": filas, "lentas": lentas}
+            for sentencia, (ejecuciones, total, maximo, filas, lentas) in copia[:limite]
+        ]
+
+    def formatear_top(self, limite: int = 10, ancho: int = 80) -> str:
+        """Resumen en texto de las sentencias con más tiempo acumulado."""
+        lineas = []
+        for datos in self.top(limite):
+            sentencia = datos["sentencia"]
+            if len(sentencia) > ancho:
+                sentencia = sentencia[:ancho - 1] + "…"
+            lineas.append(
+                f"{datos['total'] * 1000:.0f} ms en {datos['ejecuciones']} ejecuciones "
+                f"(media {datos['media'] * 1000:.2f} ms, máx {datos['maximo'] * 1000:.0f} ms, "
+                f"{datos['filas']} filas, {datos['lentas']} lentas): {sentencia}"
+            )
+        return "\n".join(lineas)
+
+    def reiniciar(self):
+        """Olvida lo acumulado (los planes se conservan)."""
+        with self._lock:
+            self._sentencias.clear()
+
+
+class CursorMedido(sqlite3.Cursor):
+    """
+    Cursor por el que pasan todas las sentencias de SecureDB: mide cada
+    ejecución y lectura como tiempo de base de datos y, si la conexión tiene
+    EstadisticasConsultas, acumula tiempo y filas por sentencia y registra
+    las lentas. Recorrer el cursor fila a fila no se mide, para no pagar la
+    medición en cada fila.
+    """
+    _sentencia = None
+    _parametros = None
+    _acumulado = 0.0
+    _filas = 0
+    _lenta = False
+
+    def _medir(self, inicio: float, filas: int, ejecucion: bool):
+        segundos = time.perf_counter() - inicio
+        sumar_fase(FASE_DB, segundos)
+        estadisticas = self.connection.estadisticas
+        if estadisticas is None or self._sentencia is None:
+            return
+        self._acumulado += segundos
+        estadisticas.registrar(self._sentencia, segundos, filas, ejecucion, self._acumulado)
+        self._filas += filas
+        if not self._lenta and self._acumulado >= estadisticas.umbral:
+            self._lenta = True
+            estadisticas.registrar_lenta(
+                self.connection, self._sentencia, self._parametros, self._acumulado, self._filas
+            )
+
+    def _preparar(self, sql: str, parametros):
+        self._sentencia = normalizar_sentencia(sql)
+        self._parametros = parametros
+        self._acumulado, self._filas, self._lenta = 0.0, 0, False
+
+    def _ejecutar(self, metodo, *argumentos):
+        inicio = time.perf_counter()
+        resultado = metodo(*argumentos)
+        self._medir(inicio, max(self.rowcount, 0), True)
+        return resultado
+
+    def execute(self, sql, parametros=()):
+        self._preparar(sql, parametros)
+        return self._ejecutar(super().execute, sql, parametros)
+
+    def executemany(self, sql, parametros):
+        # Los parámetros pueden ser un generador: no se guardan para el plan
+        self._preparar(sql, None)
+        return self._ejecutar(super().executemany, sql, parametros)
+
+    def executescript(self, script):
+        self._preparar(script, None)
+        return self._ejecutar(super().executescript, script)
+
+    def fetchone(self):
+        inicio = time.perf_counter()
+        fila = super().fetchone()
+        self._medir(inicio, fila is not None, False)
+        return fila
+
+    def fetchmany(self, size=None):
+        inicio = time.perf_counter()
+        filas = super().fetchmany(self.arraysize if size is None else size)
+        self._medir(inicio, len(filas), False)
+        return filas
+
+    def fetchall(self):
+        inicio = time.perf_counter()
+        filas = super().fetchall()
+        self._medir(inicio, len(filas), False)
+        return filas
+
+
+class ConexionMedida(sqlite3.Connection):
+    """
+    Conexión cuyos cursores son CursorMedido y cuyos commit/rollback también
+    cuentan como tiempo de base de datos. `estadisticas` lo asigna SecureDB.
+    """
+    estadisticas = None
+
+    def cursor(self, factory=CursorMedido):
+        return super().cursor(factory)
+
+    def execute(self, sql, parametros=()):
+        return self.cursor().execute(sql, parametros)
+
+    def executemany(self, sql, parametros):
+        return self.cursor().executemany(sql, parametros)
+
+    def executescript(self, script):
+        return self.cursor().executescript(script)
+
+    def commit(self):
+        inicio = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            sumar_fase(FASE_DB, time.perf_counter() - inicio)
+
+    def rollback(self):
+        inicio = time.perf_counter()
+        try:
+            return super().rollback()
+        finally:
+            sumar_fase(FASE_DB, time.perf_counter() - inicio)
+
+
 class SecureDB:
     """Implementa una conexión segura y gestionada a la base de datos SQLite."""
     _instance = None
     _lock = Lock()
 
-    def __init__(self):
+    def __init__(self, ruta: str = "secure_reconotas.db", perfil: str = PERFIL_DEFECTO):
+        if perfil not in PERFILES_ALMACENAMIENTO:
+            raise ValueError(f"Perfil de almacenamiento desconocido: {perfil}")
+        self.ruta = ruta
+        self.perfil = perfil
         self.conn = None
+        # Tiempo por sentencia y consultas lentas de todas las conexiones
+        self.consultas = EstadisticasConsultas()
         self._initialize_db()
 
     @classmethod
-    def get_instance(cls):
-        """Obtiene la única instancia de la clase SecureDB (patrón Singleton)."""
+    def get_instance(cls, **opciones):
+        """
+        Obtiene la única instancia de la clase SecureDB (patrón Singleton).
+        Las opciones (ruta, perfil) solo se usan al crearla.
+        """
         if cls._instance is None:
             with cls._lock:
                 if cls._instance is None:
-                    cls._instance = cls()
+                    cls._instance = cls(**opciones)
         return cls._instance
 
     def _initialize_db(self):
         try:
-            self.conn = sqlite3.connect("secure_reconotas.db", check_same_thread=False)
-            self.conn.execute("PRAGMA journal_mode=WAL")
-            self.conn.execute("PRAGMA foreign_keys=ON")
+            self.conn = self.nueva_conexion()
             self._create_tables()
+            self._migrate_schema()
         except sqlite3.Error as e:
             logging.error("Error al inicializar la base de datos: %s", str(e))
             raise
 
+    def nueva_conexion(self) -> sqlite3.Connection:
+        """
+        Abre una conexión adicional a la misma base de datos para tareas en
+        segundo plano, de modo que sus transacciones no se mezclen con las del bot.
+        """
+        conn = sqlite3.connect(self.ruta, check_same_thread=False, factory=ConexionMedida,
+                               cached_statements=SENTENCIAS_EN_CACHE)
+        conn.estadisticas = self.consultas
+        # Solo tiene efecto al crear la BD (antes de pasar a WAL); las existentes
+        # las convierte el mantenimiento con un VACUUM
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        # Lo que se borra se sobrescribe con ceros en lugar de quedar en páginas libres
+        conn.execute("PRAGMA secure_delete=ON")
+        for pragma, valor in PERFILES_ALMACENAMIENTO[self.perfil].items():
+            conn.execute(f"PRAGMA {pragma}={valor}")
+        return conn
+
     def _create_tables(self):
         tables = [
             """CREATE TABLE IF NOT EXISTS usuarios (
@@ -60,6 +336,40 @@ class SecureDB:
                 fecha_modificacion TIMESTAMP,
                 FOREIGN KEY (usuario_id) REFERENCES usuarios(id)
             )""",
+            # Notas largas: cada fragmento se cifra por separado y la fila de
+            # `notas` queda con el contenido vacío y el número de fragmentos
+            """CREATE TABLE IF NOT EXISTS notas_fragmentos (
+                nota_id INTEGER NOT NULL,
+                indice INTEGER NOT NULL,
+                contenido_cifrado BLOB NOT NULL,
+                PRIMARY KEY (nota_id, indice),
+                FOREIGN KEY (nota_id) REFERENCES notas(id) ON DELETE CASCADE
+            ) WITHOUT ROWID""",
+            # Índice ciego: HMAC de cada palabra de la nota con una clave del usuario
+            """CREATE TABLE IF NOT EXISTS notas_indice (
+                usuario_id INTEGER NOT NULL,
+                token BLOB NOT NULL,
+                nota_id INTEGER NOT NULL,
+                PRIMARY KEY (usuario_id, token, nota_id),
+                FOREIGN KEY (nota_id) REFERENCES notas(id) ON DELETE CASCADE
+            ) WITHOUT ROWID""",
+            # Blobs del almacén de adjuntos; `referencias` la mantienen disparadores
+            """CREATE TABLE IF NOT EXISTS adjuntos_blobs (
+                direccion TEXT PRIMARY KEY,
+                tamano INTEGER NOT NULL,
+                referencias INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID""",
+            """CREATE TABLE IF NOT EXISTS adjuntos (
+                id INTEGER PRIMARY KEY,
+                nota_id INTEGER NOT NULL,
+                direccion TEXT NOT NULL,
+                tipo TEXT NOT NULL,
+                nombre_cifrado BLOB,
+                mime TEXT,
+                file_id TEXT,
+                FOREIGN KEY (nota_id) REFERENCES notas(id) ON DELETE CASCADE,
+                FOREIGN KEY (direccion) REFERENCES adjuntos_blobs(direccion)
+            )""",
             """CREATE TABLE IF NOT EXISTS recordatorios (
                 id INTEGER PRIMARY KEY,
                 usuario_id INTEGER NOT NULL,
@@ -75,6 +385,17 @@ class SecureDB:
                 secret TEXT NOT NULL,
                 activado BOOLEAN DEFAULT 0,
                 FOREIGN KEY (usuario_id) REFERENCES usuarios(id)
+            )""",
+            """CREATE TABLE IF NOT EXISTS mantenimiento_estado (
+                clave TEXT PRIMARY KEY,
+                valor TEXT NOT NULL,
+                actualizado TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )""",
+            """CREATE TABLE IF NOT EXISTS arrendamientos (
+                recurso TEXT PRIMARY KEY,
+                propietario TEXT NOT NULL,
+                expira REAL NOT NULL,
+                epoca INTEGER NOT NULL DEFAULT 0
             )"""
         ]
 
@@ -87,16 +408,170 @@ class SecureDB:
             logging.error("Error al crear tablas: %s", str(e))
             raise
 
+    def _migrate_schema(self):
+        """Añade a bases de datos existentes las columnas e índices de versiones nuevas"""
+        columnas = {
+            "usuarios": [("sal_clave", "BLOB"), ("zona_horaria", "TEXT")],
+            # vista_previa: inicio cifrado de las notas largas, para listarlas sin descifrarlas
+            "notas": [("vista_previa", "BLOB"), ("fragmentos", "INTEGER NOT NULL DEFAULT 0")],
+            "recordatorios": [("next_fire_at", "INTEGER"), ("regla_recurrencia", "TEXT")],
+        }
+        indices = [
+            "CREATE INDEX IF NOT EXISTS idx_notas_usuario ON notas (usuario_id)",
+            "CREATE INDEX IF NOT EXISTS idx_recordatorios_usuario ON recordatorios (usuario_id)",
+            "CREATE INDEX IF NOT EXISTS idx_auditoria_usuario ON auditoria (usuario_id)",
+            "CREATE INDEX IF NOT EXISTS idx_adjuntos_nota ON adjuntos (nota_id)",
+            # Para el ON DELETE CASCADE desde notas
+            "CREATE INDEX IF NOT EXISTS idx_notas_indice_nota ON notas_indice (nota_id)",
+            """CREATE INDEX IF NOT EXISTS idx_adjuntos_blobs_huerfanos
+            ON adjuntos_blobs (referencias) WHERE referencias = 0""",
+            """CREATE INDEX IF NOT EXISTS idx_recordatorios_next_fire
+            ON recordatorios (completado, next_fire_at)""",
+        ]
+        # Contador de cambios en lo que el planificador tiene en memoria, para
+        # saber si su instantánea binaria sigue siendo válida
+        incremento = """BEGIN
+                UPDATE mantenimiento_estado SET valor = CAST(valor AS INTEGER) + 1
+                WHERE clave = 'version_recordatorios';
+            END"""
+        disparadores = [
+            f"""CREATE TRIGGER IF NOT EXISTS trg_recordatorios_version_ins
+            AFTER INSERT ON recordatorios {incremento}""",
+            f"""CREATE TRIGGER IF NOT EXISTS trg_recordatorios_version_upd
+            AFTER UPDATE OF next_fire_at, completado, usuario_id ON recordatorios {incremento}""",
+            f"""CREATE TRIGGER IF NOT EXISTS trg_recordatorios_version_del
+            AFTER DELETE ON recordatorios {incremento}""",
+            f"""CREATE TRIGGER IF NOT EXISTS trg_usuarios_version_upd
+            AFTER UPDATE OF telegram_id ON usuarios {incremento}""",
+            # También se disparan con el ON DELETE CASCADE al borrar la nota
+            """CREATE TRIGGER IF NOT EXISTS trg_adjuntos_ref_ins AFTER INSERT ON adjuntos BEGIN
+                UPDATE adjuntos_blobs SET referencias = referencias + 1
+                WHERE direccion = NEW.direccion;
+            END""",
+            """CREATE TRIGGER IF NOT EXISTS trg_adjuntos_ref_del AFTER DELETE ON adjuntos BEGIN
+                UPDATE adjuntos_blobs SET referencias = referencias - 1
+                WHERE direccion = OLD.direccion;
+            END""",
+        ]
+        try:
+            cursor = self.conn.cursor()
+            for tabla, nuevas in columnas.items():
+                existentes = {fila[1] for fila in cursor.execute(f"PRAGMA table_info({tabla})")}
+                for nombre, definicion in nuevas:
+                    if nombre not in existentes:
+                        cursor.execute(f"ALTER TABLE {tabla} ADD COLUMN {nombre} {definicion}")
+            for indice in indices:
+                cursor.execute(indice)
+            cursor.execute(
+                """INSERT OR IGNORE INTO mantenimiento_estado (clave, valor)
+                VALUES ('version_recordatorios', '0')"""
+            )
+            for disparador in disparadores:
+                cursor.execute(disparador)
+            self.conn.commit()
+        except sqlite3.Error as e:
+            logging.error("Error al migrar el esquema: %s", str(e))
+            raise
+
+    @staticmethod
+    def obtener_sal_usuario(conn, usuario_id: int) -> bytes:
+        """
+        Devuelve la sal de la clave de datos del usuario, creándola si aún no
+        existe (usuarios anteriores a las claves por usuario).
+        """
+        fila = conn.execute(
+            "SELECT sal_clave FROM usuarios WHERE id = ?", (usuario_id,)
+        ).fetchone()
+        if fila is None:
+            raise ValueError(f"Usuario {usuario_id} no encontrado")
+        if fila[0] is not None:
+            return fila[0]
+        sal = os.urandom(16)
+        conn.execute(
+            "UPDATE usuarios SET sal_clave = ? WHERE id = ? AND sal_clave IS NULL",
+            (sal, usuario_id)
+        )
+        conn.commit()
+        return conn.execute(
+            "SELECT sal_clave FROM usuarios WHERE id = ?", (usuario_id,)
+        ).fetchone()[0]
+
+    @staticmethod
+    def destruir_sal_usuario(conn, usuario_id: int):
+        """
+        Sustituye la sal de la clave del usuario. No confirma. Con la BD actual
+        ya no se puede derivar su clave, pero el WAL y las copias de seguridad
+        conservan la sal antigua junto a las notas, y las notas aún cifradas
+        con la clave maestra no dependen de ella: no basta para borrar datos.
+        """
+        conn.execute(
+            "UPDATE usuarios SET sal_clave = ? WHERE id = ?", (os.urandom(16), usuario_id)
+        )
+
+    @staticmethod
+    def leer_estado(conn, clave: str, defecto=None):
+        """Lee (como JSON) el estado persistido de una tarea de mantenimiento."""
+        fila = conn.execute(
+            "SELECT valor FROM mantenimiento_estado WHERE clave = ?", (clave,)
+        ).fetchone()
+        return json.loads(fila[0]) if fila else defecto
+
+    @staticmethod
+    def guardar_estado(conn, clave: str, valor):
+        """Guarda el estado de una tarea sin confirmar, para hacerlo en su misma transacción."""
+        conn.execute(
+            """INSERT INTO mantenimiento_estado (clave, valor, actualizado)
+            VALUES (?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(clave) DO UPDATE SET
+                valor = excluded.valor, actualizado = excluded.actualizado""",
+            (clave, json.dumps(valor))
+        )
+
+    def _insertar_auditoria(self, cursor, usuario_id: int, tipo_evento: str, detalles: dict):
+        cursor.execute(
+            """INSERT INTO auditoria 
+            (usuario_id, tipo_evento, detalles) 
+            VALUES (?, ?, ?)""",
+            (usuario_id, tipo_evento, json.dumps(detalles))
+        )
+
     def registrar_auditoria(self, usuario_id: int, tipo_evento: str, detalles: dict):
         """Registra un evento de auditoría en la base de datos de forma segura."""
         try:
-            self.conn.execute(
-                """INSERT INTO auditoria 
-                (usuario_id, tipo_evento, detalles) 
-                VALUES (?, ?, ?)""",
-                (usuario_id, tipo_evento, json.dumps(detalles))
-            )
+            self._insertar_auditoria(self.conn, usuario_id, tipo_evento, detalles)
             self.conn.commit()
         except sqlite3.Error as e:
             logging.error("Error en auditoría: %s", str(e))
             raise
+
+    def insertar_recordatorios_lote(self, usuario_id: int, recordatorios: list) -> list:
+        """
+        Inserta varios recordatorios (texto, hora, recurrente, regla_recurrencia,
+        next_fire_at) y su evento de auditoría en una única transacción.
+        Devuelve las filas creadas como (id, texto, hora, recurrente, next_fire_at).
+        """
+        try:
+            cursor = self.conn.cursor()
+            # RETURNING devuelve cada fila creada sin depender de que los ids sean
+            # consecutivos (la conexión la comparten varios hilos)
+            creados = [
+                cursor.execute(
+                    """INSERT INTO recordatorios
+                    (usuario_id, texto, hora_recordatorio, recurrente, regla_recurrencia,
+                    next_fire_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    RETURNING id, texto, hora_recordatorio, recurrente, next_fire_at""",
+                    (usuario_id, *recordatorio)
+                ).fetchone()
+                for recordatorio in recordatorios
+            ]
+            self._insertar_auditoria(
+                cursor, usuario_id, "RECORDATORIOS_IMPORTADOS",
+                {"cantidad": len(recordatorios)}
+            )
+            self.conn.commit()
+            return creados
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            logging.error("Error insertando recordatorios en lote: %s", str(e))
+            raise
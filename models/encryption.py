@@ -3,34 +3,374 @@
 Permite cifrar algunos datos sencilbles que el usuario le asigne al bot
 """
 import base64
-from cryptography.fernet import Fernet
+import hashlib
+import hmac
+import os
+import re
+import struct
+import unicodedata
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from threading import Lock
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
 from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 
+from models.metrics import FASE_CIFRADO, medido
 
+# Por debajo de este número de elementos el coste de repartir trabajo supera la ganancia
+UMBRAL_PARALELO = 256
+CHUNK_MINIMO = 64
+CHUNKS_POR_TRABAJADOR = 4
 
-class CifradoManager:
-    """Crea un cifrado para encriptar info sensible"""
-    def __init__(self, salt: bytes, master_password: str):
-        self.cipher = self._configurar_cifrado(salt, master_password)
+# Versión del esquema de claves: cambiarla fuerza una nueva pasada de rotación
+# (v2: la pasada convierte los tokens Fernet al sobre compacto;
+#  v3: la pasada construye el índice ciego de las notas existentes)
+ESQUEMA_CLAVES = b"usuario-v3"
 
-    def _configurar_cifrado(self, salt: bytes, password: str) -> Fernet:
+# Índice ciego: cada palabra de la nota se guarda como un HMAC truncado con
+# una clave del usuario, así que la BD no revela las palabras pero sí permite
+# buscarlas con una consulta indexada
+LONGITUD_TOKEN_INDICE = 16
+_PALABRA = re.compile(r"\w+")
+LONGITUD_PALABRA = (2, 64)
+
+# Sobre compacto: versión (1 B) | flags (1 B) | id de clave (4 B) | nonce (12 B) |
+# AES-256-GCM del texto con la cabecera como datos asociados (texto + 16 B de tag).
+# Un token Fernet empieza por "g" (0x67), así que el primer byte distingue el formato
+VERSION_SOBRE = 1
+FLAG_ZLIB = 0x01
+CABECERA_SOBRE = struct.Struct(">BB4s")
+LONGITUD_NONCE = 12
+LONGITUD_TAG = 16
+# Textos más cortos no suelen ganar nada al comprimirse
+UMBRAL_COMPRESION = 128
+
+# Cifradores de cada proceso del pool, reconstruidos una vez por juego de claves
+_ciphers_proceso = {}
+
+
+class SobreCompacto:
+    """
+    Cifra en el sobre binario compacto con la primera de `claves` (claves
+    Fernet en base64) y descifra tanto sobres de cualquiera de ellas como
+    tokens Fernet antiguos. Los textos de `UMBRAL_COMPRESION` bytes o más se
+    comprimen con zlib antes de cifrar si así ocupan menos. Los errores se
+    señalan con `InvalidToken`, igual que con Fernet.
+    """
+
+    def __init__(self, claves: tuple):
+        self._fernet = MultiFernet([Fernet(clave) for clave in claves])
+        self._por_id = {}
+        for indice, clave in enumerate(claves):
+            material = HKDF(
+                algorithm=hashes.SHA256(), length=32, salt=None, info=b"reconotas-sobre-v1"
+            ).derive(base64.urlsafe_b64decode(clave))
+            id_clave = hashlib.sha256(b"id:" + material).digest()[:4]
+            self._por_id.setdefault(id_clave, []).append(AESGCM(material))
+            if indice == 0:
+                self._id_principal = id_clave
+                self._aead = self._por_id[id_clave][-1]
+
+    def cifrar(self, datos: bytes) -> bytes:
+        """Cifra `datos` con la clave principal."""
+        flags = 0
+        if len(datos) >= UMBRAL_COMPRESION:
+            comprimidos = zlib.compress(datos, 6)
+            if len(comprimidos) < len(datos):
+                datos, flags = comprimidos, FLAG_ZLIB
+        cabecera = CABECERA_SOBRE.pack(VERSION_SOBRE, flags, self._id_principal)
+        nonce = os.urandom(LONGITUD_NONCE)
+        return cabecera + nonce + self._aead.encrypt(nonce, datos, cabecera)
+
+    def descifrar(self, token: bytes) -> bytes:
+        """Descifra un sobre o un token Fernet antiguo."""
+        if not token or token[0] != VERSION_SOBRE:
+            return self._fernet.decrypt(token)
+        inicio = CABECERA_SOBRE.size + LONGITUD_NONCE
+        if len(token) < inicio + LONGITUD_TAG:
+            raise InvalidToken
+        _, flags, id_clave = CABECERA_SOBRE.unpack_from(token)
+        if flags & ~FLAG_ZLIB:
+            raise InvalidToken
+        cabecera, nonce = token[:CABECERA_SOBRE.size], token[CABECERA_SOBRE.size:inicio]
+        for aead in self._por_id.get(id_clave, ()):
+            try:
+                datos = aead.decrypt(nonce, token[inicio:], cabecera)
+                break
+            except InvalidTag:
+                continue
+        else:
+            raise InvalidToken
+        return zlib.decompress(datos) if flags & FLAG_ZLIB else datos
+
+    def rotar(self, token: bytes) -> bytes:
+        """
+        Vuelve a cifrar con la clave principal; un sobre que ya la usa se
+        devuelve tal cual.
+        """
+        if (token and token[0] == VERSION_SOBRE
+                and token[2:CABECERA_SOBRE.size] == self._id_principal):
+            return token
+        return self.cifrar(self.descifrar(token))
+
+
+def _cipher_de_proceso(claves: tuple) -> SobreCompacto:
+    cipher = _ciphers_proceso.get(claves)
+    if cipher is None:
+        cipher = _ciphers_proceso[claves] = SobreCompacto(claves)
+    return cipher
+
+
+def _cifrar_chunk_proceso(claves, textos):
+    cipher = _cipher_de_proceso(claves)
+    return [cipher.cifrar(texto.encode('utf-8')) for texto in textos]
+
+
+def _descifrar_chunk_proceso(claves, datos):
+    cipher = _cipher_de_proceso(claves)
+    return [cipher.descifrar(token).decode('utf-8') for token in datos]
+
+
+def _rotar_chunk_proceso(claves, datos):
+    cipher = _cipher_de_proceso(claves)
+    return [cipher.rotar(token) for token in datos]
+
+
+def tamano_chunk(total: int, trabajadores: int) -> int:
+    """
+    Reparte `total` elementos en unos pocos chunks por trabajador para
+    equilibrar la carga sin pagar el envío de cada elemento por separado.
+    """
+    return max(CHUNK_MINIMO, -(-total // (trabajadores * CHUNKS_POR_TRABAJADOR)))
+
+
+class _CifradorBase:
+    """Operaciones de cifrado sencillas y por lotes sobre un juego de claves"""
+
+    def __init__(self, claves: tuple, gestor):
+        self._claves = claves
+        self.cipher = SobreCompacto(claves)
+        self._gestor = gestor
+
+    def _procesar_lote(self, elementos, funcion_hilo, funcion_proceso) -> list:
+        elementos = list(elementos)
+        gestor = self._gestor
+        if len(elementos) < UMBRAL_PARALELO or gestor.trabajadores < 2:
+            return funcion_hilo(elementos)
+
+        tamano = tamano_chunk(len(elementos), gestor.trabajadores)
+        chunks = [elementos[i:i + tamano] for i in range(0, len(elementos), tamano)]
+        if gestor.modo_paralelo == 'procesos':
+            funcion = partial(funcion_proceso, self._claves)
+        else:
+            funcion = funcion_hilo
+        resultado = []
+        for parcial in gestor.obtener_pool().map(funcion, chunks):
+            resultado.extend(parcial)
+        return resultado
+
+    def _cifrar_chunk(self, textos):
+        return [self.cipher.cifrar(texto.encode('utf-8')) for texto in textos]
+
+    def _descifrar_chunk(self, datos):
+        return [self.cipher.descifrar(token).decode('utf-8') for token in datos]
+
+    def _rotar_chunk(self, datos):
+        return [self.cipher.rotar(token) for token in datos]
+
+    @medido(FASE_CIFRADO)
+    def cifrar(self, texto: str) -> bytes:
+        """Cifra un texto plano usando la clave principal."""
+        return self.cipher.cifrar(texto.encode('utf-8'))
+
+    @medido(FASE_CIFRADO)
+    def descifrar(self, datos: bytes) -> str:
+        """Descifra datos previamente cifrados con cualquiera de las claves conocidas."""
+        try:
+            return self.cipher.descifrar(datos).decode('utf-8')
+        except Exception as e:
+            raise ValueError(f"Error de descifrado: {str(e)}") from e
+
+    @medido(FASE_CIFRADO)
+    def cifrar_lote(self, textos) -> list:
+        """
+        Cifra una secuencia de textos repartiendo el trabajo entre varios hilos
+        o procesos. Devuelve los tokens en el mismo orden.
+        """
+        return self._procesar_lote(textos, self._cifrar_chunk, _cifrar_chunk_proceso)
+
+    @medido(FASE_CIFRADO)
+    def descifrar_lote(self, datos) -> list:
+        """Descifra una secuencia de tokens en paralelo manteniendo el orden."""
+        try:
+            return self._procesar_lote(datos, self._descifrar_chunk, _descifrar_chunk_proceso)
+        except Exception as e:
+            raise ValueError(f"Error de descifrado: {str(e)}") from e
+
+    @medido(FASE_CIFRADO)
+    def rotar(self, datos: bytes) -> bytes:
+        """Vuelve a cifrar con la clave principal un token cifrado con cualquier clave conocida."""
+        return self.cipher.rotar(datos)
+
+    @medido(FASE_CIFRADO)
+    def rotar_lote(self, datos) -> list:
+        """Rota en paralelo una secuencia de tokens manteniendo el orden."""
+        return self._procesar_lote(datos, self._rotar_chunk, _rotar_chunk_proceso)
+
+
+def terminos(texto: str) -> set:
+    """
+    Palabras distintas del texto normalizadas para el índice ciego: en
+    minúsculas y sin tildes, de modo que "Reunión" y "reunion" coinciden.
+    """
+    plano = unicodedata.normalize("NFKD", texto.casefold())
+    plano = "".join(c for c in plano if not unicodedata.combining(c))
+    minima, maxima = LONGITUD_PALABRA
+    return {palabra for palabra in _PALABRA.findall(plano) if minima <= len(palabra) <= maxima}
+
+
+class CifradorUsuario(_CifradorBase):
+    """
+    Cifrador con las claves de datos de un usuario. Descifra también las
+    notas antiguas cifradas directamente con la clave maestra.
+    """
+
+    def __init__(self, usuario_id: int, sal: bytes, gestor):
+        self.usuario_id = usuario_id
+        self.sal = sal
+        claves = tuple(
+            self._derivar_clave_usuario(maestra, usuario_id, sal)
+            for maestra in gestor.claves_maestras
+        )
+        super().__init__(claves + gestor.claves_maestras, gestor)
+        # Una clave de índice por clave de usuario; la primera indexa y el resto
+        # solo sirve para encontrar notas que la rotación aún no reindexó
+        self._claves_indice = tuple(
+            HKDF(
+                algorithm=hashes.SHA256(), length=32, salt=None, info=b"reconotas-indice"
+            ).derive(base64.urlsafe_b64decode(clave))
+            for clave in claves
+        )
+
+    @staticmethod
+    def _token(clave: bytes, termino: str) -> bytes:
+        return hmac.new(clave, termino.encode('utf-8'), hashlib.sha256).digest()[
+            :LONGITUD_TOKEN_INDICE]
+
+    def indice_ciego(self, texto: str) -> list:
+        """Tokens del índice ciego de las palabras del texto con la clave actual."""
+        clave = self._claves_indice[0]
+        return [self._token(clave, termino) for termino in terminos(texto)]
+
+    def tokens_busqueda(self, consulta: str) -> list:
+        """
+        Por cada palabra distinta de la consulta, la tupla de sus tokens con
+        todas las claves de índice del usuario.
+        """
+        return [
+            tuple(self._token(clave, termino) for clave in self._claves_indice)
+            for termino in sorted(terminos(consulta))
+        ]
+
+    @staticmethod
+    def _derivar_clave_usuario(maestra: bytes, usuario_id: int, sal: bytes) -> bytes:
+        hkdf = HKDF(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=sal,
+            info=b"reconotas-notas:" + str(usuario_id).encode(),
+        )
+        return base64.urlsafe_b64encode(hkdf.derive(base64.urlsafe_b64decode(maestra)))
+
+
+class CifradoManager(_CifradorBase):
+    """
+    Crea un cifrado para encriptar info sensible.
+    `claves_anteriores` son pares (salt, password) que solo se usan para
+    descifrar datos antiguos mientras se rotan a la clave actual.
+    Las notas se cifran con claves por usuario obtenidas con `para_usuario`.
+    """
+    def __init__(self, salt: bytes, master_password: str, modo_paralelo: str = 'hilos',
+                 trabajadores: int = None, claves_anteriores=(), tamano_cache: int = 1024):
+        claves = [self._derivar_clave(salt, master_password)]
+        claves += [self._derivar_clave(s, p) for s, p in claves_anteriores]
+        self.claves_maestras = tuple(claves)
+        super().__init__(self.claves_maestras, self)
+        self.modo_paralelo = modo_paralelo
+        self.trabajadores = trabajadores or os.cpu_count() or 1
+        self._pool = None
+        self._pool_lock = Lock()
+        self.tamano_cache = tamano_cache
+        self._cache_usuarios = OrderedDict()
+        self._cache_lock = Lock()
+
+    def _derivar_clave(self, salt: bytes, password: str) -> bytes:
         kdf = PBKDF2HMAC(
             algorithm=hashes.SHA512(),
             length=32,
             salt=salt,
             iterations=480000,
         )
-        key = base64.urlsafe_b64encode(kdf.derive(password.encode()))
-        return Fernet(key)
+        return base64.urlsafe_b64encode(kdf.derive(password.encode()))
 
-    def cifrar(self, texto: str) -> bytes:
-        """Cifra un texto plano usando la clave maestra configurada."""
-        return self.cipher.encrypt(texto.encode('utf-8'))
+    @property
+    def tiene_claves_anteriores(self) -> bool:
+        """Indica si hay claves antiguas pendientes de rotar."""
+        return len(self.claves_maestras) > 1
 
-    def descifrar(self, datos: bytes) -> str:
-        """Descifra datos previamente cifrados usando la clave maestra configurada."""
-        try:
-            return self.cipher.decrypt(datos).decode('utf-8')
-        except Exception as e:
-            raise ValueError(f"Error de descifrado: {str(e)}") from e
+    @property
+    def huella(self) -> str:
+        """Identificador corto (no secreto) de la clave principal y el esquema de claves."""
+        return hashlib.sha256(ESQUEMA_CLAVES + self.claves_maestras[0]).hexdigest()[:16]
+
+    @medido(FASE_CIFRADO)
+    def para_usuario(self, usuario_id: int, sal: bytes) -> CifradorUsuario:
+        """
+        Devuelve el cifrador del usuario desde una caché LRU; la derivación
+        HKDF solo se paga cuando la entrada no está en caché.
+        """
+        clave_cache = (usuario_id, sal)
+        with self._cache_lock:
+            cifrador = self._cache_usuarios.get(clave_cache)
+            if cifrador is not None:
+                self._cache_usuarios.move_to_end(clave_cache)
+                return cifrador
+
+        cifrador = CifradorUsuario(usuario_id, sal, self)
+        with self._cache_lock:
+            self._cache_usuarios[clave_cache] = cifrador
+            while len(self._cache_usuarios) > self.tamano_cache:
+                self._cache_usuarios.popitem(last=False)
+        return cifrador
+
+    def olvidar_usuario(self, usuario_id: int):
+        """Expulsa de la caché las claves del usuario (tras destruir su sal)."""
+        with self._cache_lock:
+            for clave_cache in [c for c in self._cache_usuarios if c[0] == usuario_id]:
+                del self._cache_usuarios[clave_cache]
+
+    def obtener_pool(self):
+        """Crea bajo demanda el pool de hilos o procesos y lo reutiliza"""
+        with self._pool_lock:
+            if self._pool is None:
+                if self.modo_paralelo == 'procesos':
+                    self._pool = ProcessPoolExecutor(max_workers=self.trabajadores)
+                else:
+                    self._pool = ThreadPoolExecutor(
+                        max_workers=self.trabajadores,
+                        thread_name_prefix="cifrado"
+                    )
+            return self._pool
+
+    def cerrar(self):
+        """Libera el pool de trabajadores si se llegó a crear."""
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
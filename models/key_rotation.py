@@ -0,0 +1,275 @@
+# ------------------------- ROTACIÓN DE CLAVES -------------------------
+"""
+Vuelve a cifrar en segundo plano las notas con la clave actual de cada
+usuario cuando todavía hay notas cifradas con una clave anterior, rehace
+su índice ciego con la clave de índice actual y pasa los adjuntos a la clave
+maestra actual
+"""
+import logging
+import time
+from threading import Event, Thread
+from cryptography.fernet import InvalidToken
+
+from models.attachments import rotar_clave_direccion
+from models.database import SecureDB
+
+CLAVE_ESTADO = "rotacion_notas"
+
+
+class RotacionClaves:
+    """
+    Recorre `notas` en lotes paginados por id, rota cada token (contenido,
+    vista previa y fragmentos de las notas largas) con el `rotar_lote` del
+    cifrador de su usuario, reindexa las notas del lote y confirma lote a lote
+    junto con el progreso, de modo que el trabajo puede reanudarse tras un
+    reinicio. Mientras tanto las búsquedas prueban también las claves de
+    índice anteriores.
+
+    Con `almacen` (un AlmacenAdjuntos), al terminar las notas recorre los
+    blobs por dirección y vuelve a cifrar los que aún dependen de una clave
+    maestra anterior, de modo que después puede retirarse sin perderlos.
+    """
+
+    def __init__(self, db: SecureDB, cifrado, tamano_lote: int = 500,
+                 factor_pausa: float = 1.0, pausa_minima: float = 0.05, logger=None,
+                 almacen=None):
+        self.db = db
+        self.cifrado = cifrado
+        self.almacen = almacen
+        self.tamano_lote = tamano_lote
+        # Tras cada lote se duerme factor_pausa veces lo que tardó (≈50% de carga con 1.0)
+        self.factor_pausa = factor_pausa
+        self.pausa_minima = pausa_minima
+        self.logger = logger or logging.getLogger("SecureBot")
+        self._detener = Event()
+        self._hilo = None
+        self.procesadas = 0
+        self.fallidas = 0
+        self.total = 0
+        self.completado = False
+        self.adjuntos_reenvueltos = 0
+
+    @property
+    def porcentaje(self) -> float:
+        """Progreso de la rotación en tanto por ciento."""
+        if self.completado or not self.total:
+            return 100.0
+        return min(100.0, 100.0 * self.procesadas / self.total)
+
+    def progreso(self) -> dict:
+        """Métrica de progreso para logs o paneles de administración."""
+        return {
+            "procesadas": self.procesadas,
+            "fallidas": self.fallidas,
+            "total": self.total,
+            "porcentaje": round(self.porcentaje, 2),
+            "completado": self.completado
+        }
+
+    def iniciar(self):
+        """Lanza la rotación en un hilo en segundo plano."""
+        self._hilo = Thread(target=self.ejecutar, name="rotacion-claves", daemon=True)
+        self._hilo.start()
+
+    def detener(self):
+        """Pide al hilo que termine tras el lote en curso."""
+        self._detener.set()
+
+    def ejecutar(self):
+        """Rota todas las notas pendientes; reanuda desde el último lote confirmado."""
+        conn = self.db.nueva_conexion()
+        try:
+            estado = SecureDB.leer_estado(conn, CLAVE_ESTADO, {})
+            if estado.get("huella") != self.cifrado.huella:
+                estado = {"huella": self.cifrado.huella, "ultimo_id": 0, "procesadas": 0}
+            elif estado.get("completado"):
+                # Las notas creadas después ya usan la clave actual
+                self.completado = True
+                if self.almacen is not None and not estado.get("adjuntos_completado"):
+                    self._rotar_adjuntos(conn, estado)
+                return
+            ultimo_id = estado["ultimo_id"]
+            self.procesadas = estado["procesadas"]
+            self.total = self.procesadas + conn.execute(
+                "SELECT COUNT(*) FROM notas WHERE id > ?", (ultimo_id,)
+            ).fetchone()[0]
+            self.logger.info("Rotación de claves iniciada: %s", self.progreso())
+
+            while not self._detener.is_set():
+                inicio = time.monotonic()
+                filas = conn.execute(
+                    """SELECT id, usuario_id, contenido_cifrado, vista_previa, fragmentos
+                    FROM notas WHERE id > ? ORDER BY id LIMIT ?""",
+                    (ultimo_id, self.tamano_lote)
+                ).fetchall()
+                if not filas:
+                    self.completado = True
+                    break
+
+                # Las notas largas tienen el contenido vacío y el texto en fragmentos
+                contenidos = [(fila[1], (fila[0],), fila[2]) for fila in filas if not fila[4]]
+                vistas = [(fila[1], (fila[0],), fila[3]) for fila in filas if fila[3]]
+                # Solo se sobrescribe si el token no cambió mientras se rotaba
+                conn.executemany(
+                    """UPDATE notas SET contenido_cifrado = ?
+                    WHERE id = ? AND contenido_cifrado = ?""",
+                    self._rotar_por_usuario(conn, contenidos)
+                )
+                conn.executemany(
+                    "UPDATE notas SET vista_previa = ? WHERE id = ? AND vista_previa = ?",
+                    self._rotar_por_usuario(conn, vistas)
+                )
+                if any(fila[4] for fila in filas):
+                    self._rotar_fragmentos(conn, ultimo_id, filas[-1][0])
+                self._reindexar(conn, filas)
+
+                ultimo_id = filas[-1][0]
+                self.procesadas += len(filas)
+                estado.update(ultimo_id=ultimo_id, procesadas=self.procesadas)
+                SecureDB.guardar_estado(conn, CLAVE_ESTADO, estado)
+                conn.commit()
+
+                self.logger.debug("Rotación de claves: %s", self.progreso())
+                duracion = time.monotonic() - inicio
+                self._detener.wait(max(self.pausa_minima, duracion * self.factor_pausa))
+
+            estado["completado"] = self.completado
+            SecureDB.guardar_estado(conn, CLAVE_ESTADO, estado)
+            conn.commit()
+            self.logger.info("Rotación de claves %s: %s",
+                             "completada" if self.completado else "pausada", self.progreso())
+            if self.completado and self.almacen is not None:
+                self._rotar_adjuntos(conn, estado)
+        except Exception as e: # pylint: disable=broad-except
+            conn.rollback()
+            self.logger.error(f"Error en la rotación de claves: {str(e)}")
+        finally:
+            conn.close()
+
+    def _rotar_adjuntos(self, conn, estado: dict):
+        """
+        Vuelve a envolver la clave de direcciones y cifra de nuevo, por lotes
+        de direcciones y con la misma pausa que las notas, los blobs cuya
+        clave sigue envuelta con una clave maestra anterior
+        """
+        rotar_clave_direccion(conn, self.cifrado)
+        conn.commit()
+        desde = estado.get("adjuntos_desde", "")
+        while not self._detener.is_set():
+            inicio = time.monotonic()
+            direcciones = [direccion for (direccion,) in conn.execute(
+                """SELECT direccion FROM adjuntos_blobs WHERE direccion > ?
+                ORDER BY direccion LIMIT ?""",
+                (desde, self.tamano_lote)
+            )]
+            if not direcciones:
+                estado["adjuntos_completado"] = True
+                break
+            for direccion in direcciones:
+                if self._detener.is_set():
+                    break
+                try:
+                    if self.almacen.reenvolver(direccion):
+                        self.adjuntos_reenvueltos += 1
+                except FileNotFoundError:
+                    # Borrado por la recolección mientras tanto
+                    pass
+                except Exception as e: # pylint: disable=broad-except
+                    self.fallidas += 1
+                    self.logger.warning(f"Adjunto {direccion} no se pudo volver a cifrar: {str(e)}")
+                desde = direccion
+            estado["adjuntos_desde"] = desde
+            SecureDB.guardar_estado(conn, CLAVE_ESTADO, estado)
+            conn.commit()
+            duracion = time.monotonic() - inicio
+            self._detener.wait(max(self.pausa_minima, duracion * self.factor_pausa))
+
+        SecureDB.guardar_estado(conn, CLAVE_ESTADO, estado)
+        conn.commit()
+        self.logger.info("Rotación de adjuntos %s: %d blobs cifrados de nuevo",
+                         "completada" if estado.get("adjuntos_completado") else "pausada",
+                         self.adjuntos_reenvueltos)
+
+    def _rotar_por_usuario(self, conn, elementos) -> list:
+        """
+        Rota tokens dados como (usuario_id, clave, token) con el cifrador de
+        cada usuario. Devuelve (token_nuevo, *clave, token_antiguo).
+        """
+        por_usuario = {}
+        for usuario_id, clave, token in elementos:
+            por_usuario.setdefault(usuario_id, []).append((clave, token))
+        cambios = []
+        for usuario_id, filas in por_usuario.items():
+            cifrador = self.cifrado.para_usuario(
+                usuario_id, SecureDB.obtener_sal_usuario(conn, usuario_id)
+            )
+            cambios += self._rotar_filas(cifrador, filas)
+        return cambios
+
+    def _rotar_fragmentos(self, conn, desde_id: int, hasta_id: int):
+        """Rota, de `tamano_lote` en `tamano_lote`, los fragmentos de las notas del lote"""
+        cursor = conn.cursor()
+        cursor.execute(
+            """SELECT n.usuario_id, f.nota_id, f.indice, f.contenido_cifrado
+            FROM notas_fragmentos f JOIN notas n ON n.id = f.nota_id
+            WHERE f.nota_id > ? AND f.nota_id <= ?""",
+            (desde_id, hasta_id)
+        )
+        while True:
+            filas = cursor.fetchmany(self.tamano_lote)
+            if not filas:
+                break
+            conn.executemany(
+                """UPDATE notas_fragmentos SET contenido_cifrado = ?
+                WHERE nota_id = ? AND indice = ? AND contenido_cifrado = ?""",
+                self._rotar_por_usuario(
+                    conn, [(usuario_id, (nota_id, indice), token)
+                           for usuario_id, nota_id, indice, token in filas]
+                )
+            )
+
+    def _reindexar(self, conn, filas):
+        """Rehace el índice ciego de las notas del lote a partir de su texto"""
+        por_usuario = {}
+        for nota_id, usuario_id, contenido, _vista, fragmentos in filas:
+            por_usuario.setdefault(usuario_id, []).append((nota_id, contenido, fragmentos))
+        for usuario_id, notas in por_usuario.items():
+            cifrador = self.cifrado.para_usuario(
+                usuario_id, SecureDB.obtener_sal_usuario(conn, usuario_id)
+            )
+            for nota_id, contenido, fragmentos in notas:
+                if fragmentos:
+                    contenido = [token for (token,) in conn.execute(
+                        """SELECT contenido_cifrado FROM notas_fragmentos
+                        WHERE nota_id = ? ORDER BY indice""", (nota_id,)
+                    )]
+                else:
+                    contenido = [contenido]
+                try:
+                    texto = "".join(cifrador.descifrar_lote(contenido))
+                except ValueError:
+                    self.logger.warning("Nota %s no descifrable, no se reindexa", nota_id)
+                    continue
+                conn.execute("DELETE FROM notas_indice WHERE nota_id = ?", (nota_id,))
+                # Si la nota se borró mientras tanto no se inserta nada
+                conn.executemany(
+                    """INSERT OR IGNORE INTO notas_indice (usuario_id, token, nota_id)
+                    SELECT usuario_id, ?, id FROM notas WHERE id = ?""",
+                    [(token, nota_id) for token in cifrador.indice_ciego(texto)]
+                )
+
+    def _rotar_filas(self, cifrador, filas) -> list:
+        """Devuelve (token_nuevo, *clave, token_antiguo) para cada token que pudo rotarse"""
+        try:
+            nuevos = cifrador.rotar_lote(token for _, token in filas)
+            return [(nuevo, *clave, token) for (clave, token), nuevo in zip(filas, nuevos)]
+        except InvalidToken:
+            # Algún token no se puede descifrar con ninguna clave: rotar uno a uno
+            cambios = []
+            for clave, token in filas:
+                try:
+                    cambios.append((cifrador.rotar(token), *clave, token))
+                except InvalidToken:
+                    self.fallidas += 1
+                    self.logger.warning("Nota %s no descifrable con ninguna clave", clave[0])
+            return cambios
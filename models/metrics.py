@@ -0,0 +1,350 @@
+# ------------------------- MÉTRICAS -------------------------
+"""
+Histogramas de latencia y contadores en memoria, con percentiles aproximados,
+un resumen periódico en el log, exportación en formato Prometheus y medición
+por fases (base de datos, cifrado, API de Telegram) del trabajo de cada hilo
+"""
+import bisect
+import logging
+import time
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Event, Lock, Thread, local
+
+# Límites superiores (segundos) de los cubos, al estilo de Prometheus
+CUBOS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+FASE_DB = "db"
+FASE_CIFRADO = "cifrado"
+FASE_TELEGRAM = "telegram"
+FASES = (FASE_DB, FASE_CIFRADO, FASE_TELEGRAM)
+
+
+def nombre_completo(nombre: str, etiquetas: dict) -> str:
+    """Nombre con etiquetas al estilo Prometheus: nombre{clave="valor"}."""
+    if not etiquetas:
+        return nombre
+    pares = ",".join(
+        '{}="{}"'.format(clave, str(valor).replace("\\", "\\\\").replace('"', '\\"')
+                         .replace("\n", "\\n"))
+        for clave, valor in sorted(etiquetas.items())
+    )
+    return f"{nombre}{{{pares}}}"
+
+
+class Histograma:
+    """
+    Histograma de cubos fijos. Guarda solo los recuentos por cubo, la suma y
+    el máximo, así que su tamaño no crece con las observaciones; los
+    percentiles se interpolan dentro del cubo.
+    """
+
+    def __init__(self, nombre: str, descripcion: str = "", cubos=CUBOS_SEGUNDOS,
+                 etiquetas: dict = None):
+        self.nombre = nombre
+        self.descripcion = descripcion
+        self.etiquetas = etiquetas or {}
+        self.cubos = tuple(cubos)
+        self._recuentos = [0] * (len(self.cubos) + 1)
+        self.total = 0
+        self.suma = 0.0
+        self.maximo = 0.0
+        self._lock = Lock()
+
+    def observar(self, valor: float):
+        """Registra una observación."""
+        with self._lock:
+            self._recuentos[bisect.bisect_left(self.cubos, valor)] += 1
+            self.total += 1
+            self.suma += valor
+            self.maximo = max(self.maximo, valor)
+
+    def recuentos_acumulados(self) -> list:
+        """Pares (límite, observaciones <= límite), con float('inf') al final."""
+        with self._lock:
+            recuentos = list(self._recuentos)
+        acumulado, resultado = 0, []
+        for limite, recuento in zip(self.cubos + (float('inf'),), recuentos):
+            acumulado += recuento
+            resultado.append((limite, acumulado))
+        return resultado
+
+    def percentil(self, fraccion: float) -> float:
+        """Percentil aproximado (0 < fraccion <= 1) por interpolación lineal."""
+        with self._lock:
+            if not self.total:
+                return 0.0
+            objetivo = fraccion * self.total
+            acumulado, inferior = 0, 0.0
+            for indice, recuento in enumerate(self._recuentos):
+                if recuento and acumulado + recuento >= objetivo:
+                    superior = self.cubos[indice] if indice < len(self.cubos) else self.maximo
+                    superior = min(superior, self.maximo)
+                    return inferior + (superior - inferior) * (objetivo - acumulado) / recuento
+                acumulado += recuento
+                inferior = self.cubos[indice] if indice < len(self.cubos) else inferior
+            return self.maximo
+
+    def resumen(self) -> dict:
+        """Recuento, media, p50/p95/p99 y máximo."""
+        return {
+            "n": self.total,
+            "media": round(self.suma / self.total, 4) if self.total else 0.0,
+            "p50": round(self.percentil(0.50), 4),
+            "p95": round(self.percentil(0.95), 4),
+            "p99": round(self.percentil(0.99), 4),
+            "max": round(self.maximo, 4)
+        }
+
+
+class Contador:
+    """Contador monotónico"""
+
+    tipo = "counter"
+
+    def __init__(self, nombre: str, descripcion: str = "", etiquetas: dict = None):
+        self.nombre = nombre
+        self.descripcion = descripcion
+        self.etiquetas = etiquetas or {}
+        self.valor = 0
+        self._lock = Lock()
+
+    def incrementar(self, cantidad: int = 1):
+        """Suma `cantidad` al contador."""
+        with self._lock:
+            self.valor += cantidad
+
+
+class Indicador(Contador):
+    """Valor que sube y baja (tamaño de un fichero, páginas libres...)"""
+
+    tipo = "gauge"
+
+    def fijar(self, valor):
+        """Sustituye el valor actual."""
+        with self._lock:
+            self.valor = valor
+
+
+class RegistroMetricas:
+    """
+    Registro de métricas por nombre y etiquetas; `histograma`, `contador` e
+    `indicador` las crean bajo demanda.
+    """
+
+    def __init__(self):
+        self.inicio = time.time()
+        self._metricas = {}
+        self._lock = Lock()
+
+    def _obtener(self, clase, nombre, descripcion, etiquetas, **opciones):
+        clave = (nombre, tuple(sorted((etiquetas or {}).items())))
+        with self._lock:
+            metrica = self._metricas.get(clave)
+            if metrica is None:
+                metrica = self._metricas[clave] = clase(
+                    nombre, descripcion, etiquetas=etiquetas, **opciones
+                )
+            return metrica
+
+    def histograma(self, nombre: str, descripcion: str = "", cubos=CUBOS_SEGUNDOS,
+                   etiquetas: dict = None) -> Histograma:
+        """Devuelve (creándolo si hace falta) el histograma `nombre` con `etiquetas`."""
+        return self._obtener(Histograma, nombre, descripcion, etiquetas, cubos=cubos)
+
+    def contador(self, nombre: str, descripcion: str = "", etiquetas: dict = None) -> Contador:
+        """Devuelve (creándolo si hace falta) el contador `nombre` con `etiquetas`."""
+        return self._obtener(Contador, nombre, descripcion, etiquetas)
+
+    def indicador(self, nombre: str, descripcion: str = "", etiquetas: dict = None) -> Indicador:
+        """Devuelve (creándolo si hace falta) el indicador `nombre` con `etiquetas`."""
+        return self._obtener(Indicador, nombre, descripcion, etiquetas)
+
+    def metricas(self) -> list:
+        """Todas las métricas registradas, ordenadas por nombre y etiquetas."""
+        with self._lock:
+            return [self._metricas[clave] for clave in sorted(self._metricas)]
+
+    def resumen(self) -> dict:
+        """Resumen de cada métrica con observaciones."""
+        resultado = {}
+        for metrica in self.metricas():
+            nombre = nombre_completo(metrica.nombre, metrica.etiquetas)
+            if isinstance(metrica, Histograma):
+                if metrica.total:
+                    resultado[nombre] = metrica.resumen()
+            elif metrica.valor:
+                resultado[nombre] = metrica.valor
+        return resultado
+
+    def formato_prometheus(self) -> str:
+        """Todas las métricas en el formato de texto de Prometheus (versión 0.0.4)."""
+        lineas, anterior = [], None
+        for metrica in self.metricas():
+            histograma = isinstance(metrica, Histograma)
+            if metrica.nombre != anterior:
+                anterior = metrica.nombre
+                lineas.append(f"# HELP {metrica.nombre} {metrica.descripcion or metrica.nombre}")
+                lineas.append(f"# TYPE {metrica.nombre} {'histogram' if histograma else metrica.tipo}")
+            if not histograma:
+                lineas.append(f"{nombre_completo(metrica.nombre, metrica.etiquetas)} {metrica.valor}")
+                continue
+            for limite, acumulado in metrica.recuentos_acumulados():
+                etiquetas = dict(metrica.etiquetas, le="+Inf" if limite == float('inf')
+                                 else repr(float(limite)))
+                lineas.append(f"{nombre_completo(metrica.nombre + '_bucket', etiquetas)} {acumulado}")
+            lineas.append(f"{nombre_completo(metrica.nombre + '_sum', metrica.etiquetas)} "
+                          f"{metrica.suma!r}")
+            lineas.append(f"{nombre_completo(metrica.nombre + '_count', metrica.etiquetas)} "
+                          f"{acumulado}")
+        return "\n".join(lineas) + "\n"
+
+
+# Registro del proceso; cada proceso de despacho tiene el suyo
+REGISTRO = RegistroMetricas()
+
+
+class ResumenPeriodico:
+    """
+    Escribe en el log el resumen del registro cada `intervalo` segundos. Con
+    `slas` ({histograma: segundos}) avisa con WARNING cuando el p99 de un
+    histograma supera su umbral.
+    """
+
+    def __init__(self, registro: RegistroMetricas = REGISTRO, intervalo: float = 300,
+                 logger=None, slas: dict = None):
+        self.registro = registro
+        self.intervalo = intervalo
+        self.logger = logger or logging.getLogger("SecureBot")
+        self.slas = slas or {}
+        self._detener = Event()
+
+    def iniciar(self):
+        """Lanza el hilo del resumen."""
+        Thread(target=self._run, name="metricas", daemon=True).start()
+
+    def detener(self):
+        """Detiene el hilo del resumen."""
+        self._detener.set()
+
+    def registrar(self):
+        """Escribe el resumen actual y comprueba los SLA."""
+        resumen = self.registro.resumen()
+        if not resumen:
+            return
+        self.logger.info("Métricas: %s", resumen)
+        for nombre, umbral in self.slas.items():
+            p99 = resumen.get(nombre, {}).get("p99", 0.0)
+            if p99 > umbral:
+                self.logger.warning("SLA incumplido: p99 de %s = %.2f s (SLA %g s)",
+                                    nombre, p99, umbral)
+
+    def _run(self):
+        while not self._detener.wait(self.intervalo):
+            try:
+                self.registrar()
+            except Exception as e: # pylint: disable=broad-except
+                self.logger.error(f"Error resumiendo métricas: {str(e)}")
+
+
+class ServidorMetricas:
+    """
+    Servidor HTTP local que publica el registro en /metrics con el formato
+    de texto de Prometheus
+    """
+
+    def __init__(self, puerto: int, registro: RegistroMetricas = REGISTRO,
+                 host: str = "127.0.0.1", logger=None):
+        self.registro = registro
+        self.logger = logger or logging.getLogger("SecureBot")
+        registro_servido = registro
+
+        class _Peticion(BaseHTTPRequestHandler):
+            def do_GET(self):  # pylint: disable=invalid-name
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                cuerpo = registro_servido.formato_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(cuerpo)))
+                self.end_headers()
+                self.wfile.write(cuerpo)
+
+            def log_message(self, *args):  # pylint: disable=arguments-differ
+                pass
+
+        self._servidor = ThreadingHTTPServer((host, puerto), _Peticion)
+        self._servidor.daemon_threads = True
+
+    @property
+    def puerto(self) -> int:
+        """Puerto en el que escucha (útil con puerto 0)."""
+        return self._servidor.server_port
+
+    def iniciar(self):
+        """Atiende peticiones en un hilo en segundo plano."""
+        Thread(target=self._servidor.serve_forever, name="metricas-http", daemon=True).start()
+        self.logger.info("Métricas en http://%s:%d/metrics", *self._servidor.server_address[:2])
+
+    def detener(self):
+        """Deja de atender peticiones."""
+        self._servidor.shutdown()
+        self._servidor.server_close()
+
+
+# ------------------------- FASES -------------------------
+# Cada hilo lleva una pila de acumuladores {fase: segundos}; `instrumentado`
+# apila uno por llamada y `fase`/`medido` suman el tiempo al de la cima.
+# Sin acumulador activo (hilos del planificador, pools) no se mide nada.
+
+_hilo = local()
+
+
+def pila_fases() -> list:
+    """Pila de acumuladores del hilo actual."""
+    pila = getattr(_hilo, "pila", None)
+    if pila is None:
+        pila = _hilo.pila = []
+    return pila
+
+
+def sumar_fase(nombre: str, segundos: float):
+    """Suma `segundos` a la fase `nombre` del acumulador activo, si lo hay."""
+    pila = getattr(_hilo, "pila", None)
+    if pila:
+        tiempos = pila[-1]
+        tiempos[nombre] = tiempos.get(nombre, 0.0) + segundos
+
+
+class fase:  # pylint: disable=invalid-name
+    """Gestor de contexto que mide su bloque como tiempo de la fase `nombre`"""
+    __slots__ = ("nombre", "inicio")
+
+    def __init__(self, nombre: str):
+        self.nombre = nombre
+        self.inicio = 0.0
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *excepcion):
+        sumar_fase(self.nombre, time.perf_counter() - self.inicio)
+        return False
+
+
+def medido(nombre_fase: str):
+    """Decorador que mide cada llamada como tiempo de la fase `nombre_fase`."""
+    def decorador(funcion):
+        @wraps(funcion)
+        def envoltura(*args, **kwargs):
+            if not getattr(_hilo, "pila", None):
+                return funcion(*args, **kwargs)
+            inicio = time.perf_counter()
+            try:
+                return funcion(*args, **kwargs)
+            finally:
+                sumar_fase(nombre_fase, time.perf_counter() - inicio)
+        return envoltura
+    return decorador
@@ -0,0 +1,382 @@
+# ------------------------- REPOSITORIOS -------------------------
+"""
+Capa de acceso a datos sobre SecureDB: cada operación de un handler es una
+sola llamada que resuelve el telegram_id del usuario en la misma consulta
+(JOIN o subconsulta) y confirma su propia transacción. Las sentencias son
+constantes del módulo para que la caché de sentencias de sqlite3 las reutilice.
+"""
+import json
+from collections import namedtuple
+
+from models.database import SecureDB
+
+Usuario = namedtuple("Usuario", "id lenguaje zona_horaria sal_clave")
+
+_COLUMNAS_USUARIO = "u.id, u.lenguaje, u.zona_horaria, u.sal_clave"
+_ID_POR_TELEGRAM = "(SELECT id FROM usuarios WHERE telegram_id = ?)"
+
+_SQL_USUARIO = f"SELECT {_COLUMNAS_USUARIO} FROM usuarios u WHERE u.telegram_id = ?"
+_SQL_REGISTRAR = "INSERT OR IGNORE INTO usuarios (telegram_id, lenguaje) VALUES (?, ?)"
+_SQL_USUARIO_2FA = f"""SELECT {_COLUMNAS_USUARIO}, a.secret, a.activado
+    FROM usuarios u
+    LEFT JOIN auth_2fa a ON a.usuario_id = u.id
+    WHERE u.telegram_id = ?"""
+_SQL_SECRETO_2FA = "SELECT secret FROM auth_2fa WHERE usuario_id = ?"
+_SQL_GUARDAR_2FA = """INSERT OR REPLACE INTO auth_2fa (usuario_id, secret, activado)
+    SELECT id, ?, 1 FROM usuarios WHERE telegram_id = ?"""
+_SQL_IDIOMA = "SELECT lenguaje FROM usuarios WHERE telegram_id = ?"
+_SQL_ZONA = "SELECT zona_horaria FROM usuarios WHERE telegram_id = ?"
+_SQL_CAMBIAR_IDIOMA = "UPDATE usuarios SET lenguaje = ? WHERE telegram_id = ?"
+_SQL_CAMBIAR_ZONA = "UPDATE usuarios SET zona_horaria = ? WHERE telegram_id = ?"
+_SQL_AUDITORIA = """INSERT INTO auditoria (usuario_id, tipo_evento, detalles)
+    SELECT id, ?, ? FROM usuarios WHERE telegram_id = ?"""
+_SQL_BORRAR_USUARIO = (
+    "DELETE FROM notas WHERE usuario_id = ?",
+    "DELETE FROM recordatorios WHERE usuario_id = ?",
+    "DELETE FROM auth_2fa WHERE usuario_id = ?",
+    "DELETE FROM auditoria WHERE usuario_id = ?",
+    "DELETE FROM usuarios WHERE id = ?",
+)
+
+# Los listados solo leen la vista previa (o el contenido de las notas cortas)
+_SQL_NOTAS = f"""SELECT {_COLUMNAS_USUARIO}, n.id,
+    COALESCE(n.vista_previa, n.contenido_cifrado), n.fecha_creacion, n.fragmentos,
+    (SELECT COUNT(*) FROM adjuntos a WHERE a.nota_id = n.id)
+    FROM usuarios u
+    LEFT JOIN notas n ON n.usuario_id = u.id
+    WHERE u.telegram_id = ?
+    ORDER BY n.id"""
+_SQL_CREAR_NOTA = """INSERT INTO notas
+    (usuario_id, contenido_cifrado, vista_previa, fragmentos, fecha_creacion)
+    VALUES (?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))"""
+_SQL_CREAR_FRAGMENTO = """INSERT INTO notas_fragmentos (nota_id, indice, contenido_cifrado)
+    VALUES (?, ?, ?)"""
+_SQL_CREAR_TOKEN = """INSERT OR IGNORE INTO notas_indice (usuario_id, token, nota_id)
+    VALUES (?, ?, ?)"""
+# Notas con todas las palabras: cada palabra aporta como mucho un token por nota
+_SQL_BUSCAR = """SELECT n.id, COALESCE(n.vista_previa, n.contenido_cifrado), n.fecha_creacion,
+    n.fragmentos, (SELECT COUNT(*) FROM adjuntos a WHERE a.nota_id = n.id)
+    FROM (SELECT nota_id FROM notas_indice WHERE usuario_id = ? AND token IN ({marcas})
+          GROUP BY nota_id HAVING COUNT(*) = ?) c
+    JOIN notas n ON n.id = c.nota_id
+    ORDER BY n.id DESC
+    LIMIT ?"""
+_SQL_NOTA = f"""SELECT {_COLUMNAS_USUARIO}, n.id, n.contenido_cifrado, n.fragmentos
+    FROM usuarios u
+    LEFT JOIN notas n ON n.usuario_id = u.id AND n.id = ?
+    WHERE u.telegram_id = ?"""
+_SQL_FRAGMENTOS = """SELECT contenido_cifrado FROM notas_fragmentos
+    WHERE nota_id = ? ORDER BY indice"""
+_SQL_BORRAR_NOTA = f"DELETE FROM notas WHERE id = ? AND usuario_id = {_ID_POR_TELEGRAM}"
+
+_SQL_CREAR_BLOB = """INSERT OR IGNORE INTO adjuntos_blobs (direccion, tamano) VALUES (?, ?)"""
+_SQL_CREAR_ADJUNTO = """INSERT INTO adjuntos
+    (nota_id, direccion, tipo, nombre_cifrado, mime, file_id) VALUES (?, ?, ?, ?, ?, ?)"""
+_SQL_ADJUNTOS_NOTA = """SELECT id, direccion, tipo, nombre_cifrado, mime, file_id
+    FROM adjuntos WHERE nota_id = ? ORDER BY id"""
+_SQL_FILE_ID = "UPDATE adjuntos SET file_id = ? WHERE id = ?"
+_SQL_HUERFANOS = "SELECT direccion FROM adjuntos_blobs WHERE referencias = 0"
+_SQL_BORRAR_HUERFANO = "DELETE FROM adjuntos_blobs WHERE direccion = ? AND referencias = 0"
+
+_SQL_RECORDATORIOS = f"""SELECT {_COLUMNAS_USUARIO}, r.id, r.texto, r.hora_recordatorio,
+    r.recurrente, r.regla_recurrencia
+    FROM usuarios u
+    LEFT JOIN recordatorios r ON r.usuario_id = u.id AND r.completado = 0
+    WHERE u.telegram_id = ?
+    ORDER BY r.hora_recordatorio"""
+_SQL_CREAR_RECORDATORIO = """INSERT INTO recordatorios
+    (usuario_id, texto, hora_recordatorio, recurrente, regla_recurrencia, next_fire_at)
+    VALUES (?, ?, ?, ?, ?, ?)"""
+_SQL_BORRAR_RECORDATORIO = (
+    f"DELETE FROM recordatorios WHERE id = ? AND usuario_id = {_ID_POR_TELEGRAM}"
+)
+_SQL_PENDIENTES_USUARIO = """SELECT r.id, r.hora_recordatorio, r.recurrente, r.regla_recurrencia
+    FROM recordatorios r
+    JOIN usuarios u ON r.usuario_id = u.id
+    WHERE u.telegram_id = ? AND r.completado = 0"""
+_SQL_REPROGRAMAR = "UPDATE recordatorios SET next_fire_at = ? WHERE id = ?"
+
+
+def _separar(filas, columnas_usuario: int = 4):
+    """
+    Divide las filas de un LEFT JOIN usuario → elementos en el Usuario (o
+    None si no existe) y la lista de elementos, vacía si no tiene ninguno.
+    """
+    if not filas:
+        return None, []
+    usuario = Usuario(*filas[0][:columnas_usuario])
+    elementos = [fila[columnas_usuario:] for fila in filas if fila[columnas_usuario] is not None]
+    return usuario, elementos
+
+
+class _Repositorio:
+    """Base común: conexión del bot y confirmación o deshacer por operación"""
+
+    def __init__(self, db: SecureDB):
+        self.db = db
+
+    @property
+    def conn(self):
+        """Conexión principal de SecureDB."""
+        return self.db.conn
+
+    def _transaccion(self, operacion):
+        """Ejecuta `operacion(conn)` y confirma; deshace si falla."""
+        try:
+            resultado = operacion(self.conn)
+            self.conn.commit()
+            return resultado
+        except Exception:
+            self.conn.rollback()
+            raise
+
+    @staticmethod
+    def _auditar(conn, telegram_id: int, tipo_evento: str, detalles: dict):
+        conn.execute(_SQL_AUDITORIA, (tipo_evento, json.dumps(detalles), telegram_id))
+
+
+class UsersRepo(_Repositorio):
+    """Usuarios, sus preferencias y su 2FA"""
+
+    def obtener(self, telegram_id: int):
+        """Usuario con su idioma, zona y sal de clave, o None si no existe."""
+        fila = self.conn.execute(_SQL_USUARIO, (telegram_id,)).fetchone()
+        return Usuario(*fila) if fila else None
+
+    def registrar(self, telegram_id: int, lenguaje: str) -> tuple:
+        """
+        Da de alta al usuario si es nuevo. Devuelve (Usuario, 2fa_activado)
+        resolviendo ambos en la misma consulta.
+        """
+        def operacion(conn):
+            conn.execute(_SQL_REGISTRAR, (telegram_id, lenguaje))
+            fila = conn.execute(_SQL_USUARIO_2FA, (telegram_id,)).fetchone()
+            return Usuario(*fila[:4]), bool(fila[4] and fila[5])
+        return self._transaccion(operacion)
+
+    def idioma(self, telegram_id: int):
+        """Idioma elegido por el usuario, o None si no existe."""
+        fila = self.conn.execute(_SQL_IDIOMA, (telegram_id,)).fetchone()
+        return fila[0] if fila else None
+
+    def zona(self, telegram_id: int):
+        """Nombre de la zona horaria elegida por el usuario (o None)."""
+        fila = self.conn.execute(_SQL_ZONA, (telegram_id,)).fetchone()
+        return fila[0] if fila else None
+
+    def cambiar_idioma(self, telegram_id: int, lenguaje: str):
+        """Guarda el idioma del usuario."""
+        self._transaccion(lambda conn: conn.execute(_SQL_CAMBIAR_IDIOMA, (lenguaje, telegram_id)))
+
+    def con_2fa(self, telegram_id: int) -> tuple:
+        """(Usuario, secreto 2FA o None) en una sola consulta."""
+        fila = self.conn.execute(_SQL_USUARIO_2FA, (telegram_id,)).fetchone()
+        if fila is None:
+            return None, None
+        return Usuario(*fila[:4]), fila[4]
+
+    def secreto_2fa(self, usuario_id: int):
+        """Secreto 2FA del usuario por su id interno, o None."""
+        fila = self.conn.execute(_SQL_SECRETO_2FA, (usuario_id,)).fetchone()
+        return fila[0] if fila else None
+
+    def guardar_2fa(self, telegram_id: int, secreto: str):
+        """Activa el 2FA del usuario con `secreto`."""
+        self._transaccion(lambda conn: conn.execute(_SQL_GUARDAR_2FA, (secreto, telegram_id)))
+
+    def auditar(self, telegram_id: int, tipo_evento: str, detalles: dict):
+        """Registra un evento de auditoría resolviendo el usuario por su telegram_id."""
+        self._transaccion(lambda conn: self._auditar(conn, telegram_id, tipo_evento, detalles))
+
+    def eliminar_datos(self, usuario_id: int):
+        """
+        Borra todos los datos del usuario en una única transacción. Con
+        secure_delete las filas borradas se sobrescriben en la BD; las páginas
+        anteriores siguen en el WAL hasta que el mantenimiento lo trunca (ver
+        MantenimientoBD.pedir_truncado). Las copias de seguridad ya hechas
+        conservan los datos hasta que la retención las elimina.
+        """
+        def operacion(conn):
+            SecureDB.destruir_sal_usuario(conn, usuario_id)
+            for sql in _SQL_BORRAR_USUARIO:
+                conn.execute(sql, (usuario_id,))
+        self._transaccion(operacion)
+
+
+class NotesRepo(_Repositorio):
+    """Notas cifradas de cada usuario"""
+
+    def listar(self, telegram_id: int) -> tuple:
+        """
+        (Usuario, [(id, vista_previa_cifrada, fecha_creacion, fragmentos,
+        adjuntos)]) con un solo JOIN; Usuario es None si el telegram_id no
+        está registrado.
+        """
+        return _separar(self.conn.execute(_SQL_NOTAS, (telegram_id,)).fetchall())
+
+    @staticmethod
+    def insertar(conn, usuario_id: int, nota, fecha=None) -> int:
+        """
+        Inserta una NotaCifrada (ver core.notes) con sus fragmentos y su
+        índice ciego, sin confirmar. Devuelve el id de la nota.
+        """
+        nota_id = conn.execute(
+            _SQL_CREAR_NOTA,
+            (usuario_id, nota.contenido, nota.vista_previa, len(nota.fragmentos), fecha)
+        ).lastrowid
+        conn.executemany(
+            _SQL_CREAR_FRAGMENTO,
+            [(nota_id, indice, token) for indice, token in enumerate(nota.fragmentos)]
+        )
+        conn.executemany(
+            _SQL_CREAR_TOKEN, [(usuario_id, token, nota_id) for token in nota.indice]
+        )
+        return nota_id
+
+    def buscar(self, usuario_id: int, grupos: list, limite: int) -> list:
+        """
+        [(id, vista_previa_cifrada, fecha_creacion, fragmentos, adjuntos)] de
+        las notas más recientes del usuario que contienen todas las palabras.
+        `grupos` tiene, por palabra, sus tokens con cada clave de índice
+        (ver CifradorUsuario.tokens_busqueda).
+        """
+        tokens = [token for grupo in grupos for token in grupo]
+        sql = _SQL_BUSCAR.format(marcas=", ".join("?" * len(tokens)))
+        return self.conn.execute(sql, (usuario_id, *tokens, len(grupos), limite)).fetchall()
+
+    def crear(self, usuario_id: int, telegram_id: int, nota, tamano: int) -> int:
+        """Guarda la nota cifrada y su evento de auditoría. Devuelve el id de la nota."""
+        def operacion(conn):
+            nota_id = self.insertar(conn, usuario_id, nota)
+            self._auditar(conn, telegram_id, "NOTA_CREADA", {
+                "tamaño": tamano, "fragmentos": len(nota.fragmentos)
+            })
+            return nota_id
+        return self._transaccion(operacion)
+
+    def contenido(self, telegram_id: int, nota_id: int) -> tuple:
+        """
+        (Usuario, generador de los tokens de la nota en orden) si la nota es
+        del usuario; (Usuario o None, None) si no. Los fragmentos se leen del
+        cursor a medida que se consumen.
+        """
+        fila = self.conn.execute(_SQL_NOTA, (nota_id, telegram_id)).fetchone()
+        if fila is None:
+            return None, None
+        usuario = Usuario(*fila[:4])
+        if fila[4] is None:
+            return usuario, None
+        if not fila[6]:
+            return usuario, iter([fila[5]])
+        cursor = self.conn.execute(_SQL_FRAGMENTOS, (nota_id,))
+        return usuario, (token for (token,) in cursor)
+
+    def eliminar(self, telegram_id: int, nota_id: int) -> bool:
+        """Borra la nota si pertenece al usuario y lo audita. Devuelve si se borró."""
+        def operacion(conn):
+            if conn.execute(_SQL_BORRAR_NOTA, (nota_id, telegram_id)).rowcount == 0:
+                return False
+            self._auditar(conn, telegram_id, "NOTA_ELIMINADA", {"nota_id": nota_id})
+            return True
+        return self._transaccion(operacion)
+
+
+class AttachmentsRepo(_Repositorio):
+    """Adjuntos de las notas y recuento de referencias de sus blobs"""
+
+    def crear(self, usuario_id: int, telegram_id: int, nota, adjunto: dict) -> int:
+        """
+        Crea la nota con su adjunto (direccion, tamano, tipo, nombre_cifrado,
+        mime, file_id) y la auditoría en una transacción. Devuelve el id de la nota.
+        """
+        def operacion(conn):
+            conn.execute(_SQL_CREAR_BLOB, (adjunto["direccion"], adjunto["tamano"]))
+            nota_id = NotesRepo.insertar(conn, usuario_id, nota)
+            conn.execute(_SQL_CREAR_ADJUNTO, (
+                nota_id, adjunto["direccion"], adjunto["tipo"], adjunto["nombre_cifrado"],
+                adjunto["mime"], adjunto["file_id"]
+            ))
+            self._auditar(conn, telegram_id, "NOTA_CREADA", {
+                "adjunto": adjunto["tipo"], "tamaño_adjunto": adjunto["tamano"]
+            })
+            return nota_id
+        return self._transaccion(operacion)
+
+    def de_nota(self, nota_id: int) -> list:
+        """[(id, direccion, tipo, nombre_cifrado, mime, file_id)] de la nota."""
+        return self.conn.execute(_SQL_ADJUNTOS_NOTA, (nota_id,)).fetchall()
+
+    def guardar_file_id(self, adjunto_id: int, file_id: str):
+        """Recuerda el file_id con el que Telegram ya tiene el fichero."""
+        self._transaccion(lambda conn: conn.execute(_SQL_FILE_ID, (file_id, adjunto_id)))
+
+    def huerfanos(self) -> list:
+        """Borra los blobs sin referencias y devuelve sus direcciones."""
+        def operacion(conn):
+            return [
+                direccion for (direccion,) in conn.execute(_SQL_HUERFANOS).fetchall()
+                if conn.execute(_SQL_BORRAR_HUERFANO, (direccion,)).rowcount
+            ]
+        return self._transaccion(operacion)
+
+
+class RemindersRepo(_Repositorio):
+    """Recordatorios y su programación (next_fire_at)"""
+
+    def pendientes(self, telegram_id: int) -> tuple:
+        """
+        (Usuario, [(id, texto, hora, recurrente, regla)]) de los pendientes,
+        ordenados por hora, con un solo JOIN.
+        """
+        return _separar(self.conn.execute(_SQL_RECORDATORIOS, (telegram_id,)).fetchall())
+
+    def crear(self, usuario_id: int, telegram_id: int, texto: str, hora: str,
+              regla, next_fire_at: int) -> int:
+        """Guarda el recordatorio y su evento de auditoría. Devuelve su id."""
+        def operacion(conn):
+            reminder_id = conn.execute(
+                _SQL_CREAR_RECORDATORIO,
+                (usuario_id, texto, hora, regla is not None, str(regla) if regla else None,
+                 next_fire_at)
+            ).lastrowid
+            self._auditar(conn, telegram_id, "RECORDATORIO_CREADO", {
+                "hora": hora, "tamaño_texto": len(texto),
+                "recurrencia": str(regla) if regla else None
+            })
+            return reminder_id
+        return self._transaccion(operacion)
+
+    def crear_lote(self, usuario_id: int, recordatorios: list) -> list:
+        """Ver SecureDB.insertar_recordatorios_lote."""
+        return self.db.insertar_recordatorios_lote(usuario_id, recordatorios)
+
+    def eliminar(self, telegram_id: int, reminder_id: int) -> bool:
+        """Borra el recordatorio si pertenece al usuario y lo audita. Devuelve si se borró."""
+        def operacion(conn):
+            if conn.execute(_SQL_BORRAR_RECORDATORIO, (reminder_id, telegram_id)).rowcount == 0:
+                return False
+            self._auditar(conn, telegram_id, "RECORDATORIO_ELIMINADO",
+                          {"reminder_id": reminder_id})
+            return True
+        return self._transaccion(operacion)
+
+    def cambiar_zona(self, telegram_id: int, zona: str, calcular) -> list:
+        """
+        Guarda la zona del usuario y recalcula con `calcular(hora, recurrente,
+        regla)` el próximo disparo de sus pendientes, con su auditoría, en la
+        misma transacción. Devuelve los pares (reminder_id, next_fire_at).
+        """
+        def operacion(conn):
+            conn.execute(_SQL_CAMBIAR_ZONA, (zona, telegram_id))
+            nuevos = [
+                (reminder_id, calcular(hora, recurrente, regla))
+                for reminder_id, hora, recurrente, regla
+                in conn.execute(_SQL_PENDIENTES_USUARIO, (telegram_id,)).fetchall()
+            ]
+            conn.executemany(
+                _SQL_REPROGRAMAR, [(fire_at, reminder_id) for reminder_id, fire_at in nuevos]
+            )
+            self._auditar(conn, telegram_id, "ZONA_HORARIA_CAMBIADA",
+                          {"zona": zona, "recordatorios": len(nuevos)})
+            return nuevos
+        return self._transaccion(operacion)
@@ -0,0 +1,24 @@
+"""Fixtures compartidas por las pruebas (se ejecutan con `python -m pytest`)"""
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# pylint: disable=wrong-import-position
+from models.database import SecureDB
+
+
+@pytest.fixture
+def db(tmp_path):
+    """Base de datos vacía en un directorio temporal"""
+    return SecureDB(str(tmp_path / "bot.db"))
+
+
+@pytest.fixture
+def usuario(db):
+    """Id interno de un usuario con telegram_id 1"""
+    usuario_id = db.conn.execute("INSERT INTO usuarios (telegram_id) VALUES (1)").lastrowid
+    db.conn.commit()
+    return usuario_id
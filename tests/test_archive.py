@@ -0,0 +1,65 @@
+"""Pruebas de /export y /import de notas"""
+import gzip
+import io
+import json
+import os
+
+import pytest
+
+from core import archive
+from models.encryption import CifradoManager
+
+
+@pytest.fixture
+def cifrador(usuario):
+    cifrado = CifradoManager(os.urandom(16), "pruebas")
+    yield cifrado.para_usuario(usuario, os.urandom(16))
+    cifrado.cerrar()
+
+
+def jsonl_gz(lineas) -> io.BytesIO:
+    datos = io.BytesIO()
+    with gzip.GzipFile(fileobj=datos, mode="wb") as gz:
+        for linea in lineas:
+            gz.write((linea + "\n").encode("utf-8"))
+    datos.seek(0)
+    return datos
+
+
+def contar_notas(db):
+    return db.conn.execute("SELECT COUNT(*) FROM notas").fetchone()[0]
+
+
+def test_exportar_e_importar_conserva_las_notas(db, usuario, cifrador):
+    origen = jsonl_gz(json.dumps({"contenido": f"nota {i}"}) for i in range(5))
+    assert archive.importar_notas(db, cifrador, usuario, origen) == 5
+
+    destino = io.BytesIO()
+    assert archive.exportar_notas(db, cifrador, usuario, destino) == 5
+    destino.seek(0)
+    with gzip.GzipFile(fileobj=destino) as gz:
+        textos = sorted(json.loads(linea)["contenido"] for linea in gz)
+    assert textos == [f"nota {i}" for i in range(5)]
+
+
+def test_importacion_invalida_no_importa_nada(db, usuario, cifrador, monkeypatch):
+    monkeypatch.setattr(archive, "TAMANO_LOTE", 2)
+    lineas = [json.dumps({"contenido": f"nota {i}"}) for i in range(6)] + ["no es json"]
+    with pytest.raises(ValueError):
+        archive.importar_notas(db, cifrador, usuario, jsonl_gz(lineas))
+    assert contar_notas(db) == 0
+
+
+def test_rollback_de_otro_handler_no_descarta_lotes(db, usuario, cifrador, monkeypatch):
+    monkeypatch.setattr(archive, "TAMANO_LOTE", 2)
+    insertar = archive._insertar
+
+    def insertar_y_deshacer_otra_cosa(*args):
+        insertar(*args)
+        # Otro handler deshace su propia transacción en la conexión compartida
+        db.conn.rollback()
+
+    monkeypatch.setattr(archive, "_insertar", insertar_y_deshacer_otra_cosa)
+    origen = jsonl_gz(json.dumps({"contenido": f"nota {i}"}) for i in range(7))
+    assert archive.importar_notas(db, cifrador, usuario, origen) == 7
+    assert contar_notas(db) == 7
@@ -0,0 +1,137 @@
+"""Pruebas del formato de los blobs de adjuntos y de su rotación de clave"""
+import os
+import struct
+
+import pytest
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import InvalidToken
+
+from models.attachments import (LONGITUD_TAG, MAGIA, TAMANO_BLOQUE, AlmacenAdjuntos,
+                                cargar_clave_direccion)
+from models.encryption import CifradoManager
+from models.key_rotation import RotacionClaves
+
+SAL_ANTIGUA, SAL_NUEVA = os.urandom(16), os.urandom(16)
+# Tres bloques completos y uno parcial
+DATOS = os.urandom(3 * TAMANO_BLOQUE + 1000)
+
+
+@pytest.fixture(scope="module")
+def cifrado():
+    gestor = CifradoManager(SAL_ANTIGUA, "clave-antigua")
+    yield gestor
+    gestor.cerrar()
+
+
+@pytest.fixture
+def almacen(db, cifrado, tmp_path):
+    return AlmacenAdjuntos(str(tmp_path / "adjuntos"), cifrado,
+                           cargar_clave_direccion(db.conn, cifrado))
+
+
+def registrador(db):
+    """`registrar` de guardar que da de alta el blob y devuelve su dirección"""
+    def registrar(direccion, tamano):
+        db.conn.execute("INSERT OR IGNORE INTO adjuntos_blobs (direccion, tamano) VALUES (?, ?)",
+                        (direccion, tamano))
+        db.conn.commit()
+        return direccion
+    return registrar
+
+
+def trocear(datos, tamano):
+    return [datos[i:i + tamano] for i in range(0, len(datos), tamano)]
+
+
+def partes_blob(ruta):
+    """Devuelve (cabecera, bloques cifrados) de un blob"""
+    contenido = ruta.read_bytes()
+    longitud = len(MAGIA) + 2 + struct.unpack_from(">H", contenido, len(MAGIA))[0]
+    return contenido[:longitud], trocear(contenido[longitud:], TAMANO_BLOQUE + LONGITUD_TAG)
+
+
+def test_ida_y_vuelta_por_bloques(db, almacen):
+    # Trozos que no coinciden con los bloques del formato
+    direccion = almacen.guardar(trocear(DATOS, 50_000), registrador(db))
+    cabecera, bloques = partes_blob(almacen.ruta(direccion))
+    assert cabecera.startswith(MAGIA)
+    assert len(bloques) == 4
+    assert b"".join(almacen.leer(direccion)) == DATOS
+
+
+def test_contenido_vacio(db, almacen):
+    direccion = almacen.guardar([], registrador(db))
+    assert b"".join(almacen.leer(direccion)) == b""
+
+
+def test_mismo_contenido_misma_direccion(db, almacen):
+    registrar = registrador(db)
+    primera = almacen.guardar([DATOS], registrar)
+    segunda = almacen.guardar(trocear(DATOS, 4096), registrar)
+    assert primera == segunda
+    assert almacen.guardar([b"otro contenido"], registrar) != primera
+    assert db.conn.execute("SELECT COUNT(*) FROM adjuntos_blobs").fetchone()[0] == 2
+
+
+@pytest.mark.parametrize("modificar", [
+    pytest.param(lambda cabecera, bloques: (cabecera, bloques[:-1]), id="sin_ultimo_bloque"),
+    pytest.param(lambda cabecera, bloques: (cabecera, bloques[:-1] + [bloques[-1][:-1]]),
+                 id="ultimo_bloque_cortado"),
+    pytest.param(lambda cabecera, bloques: (cabecera, [bloques[1], bloques[0]] + bloques[2:]),
+                 id="bloques_intercambiados"),
+    pytest.param(lambda cabecera, bloques: (cabecera, bloques[:1] + bloques[2:]),
+                 id="bloque_eliminado"),
+    pytest.param(lambda cabecera, bloques: (
+        cabecera, bloques[:1] + [bytes([bloques[1][0] ^ 1]) + bloques[1][1:]] + bloques[2:]
+    ), id="bloque_modificado"),
+])
+def test_blob_manipulado_se_rechaza(db, almacen, modificar):
+    direccion = almacen.guardar([DATOS], registrador(db))
+    ruta = almacen.ruta(direccion)
+    cabecera, bloques = modificar(*partes_blob(ruta))
+    ruta.write_bytes(cabecera + b"".join(bloques))
+    with pytest.raises(InvalidTag):
+        b"".join(almacen.leer(direccion))
+
+
+def test_cabecera_manipulada_se_rechaza(db, almacen):
+    direccion = almacen.guardar([DATOS], registrador(db))
+    ruta = almacen.ruta(direccion)
+    contenido = bytearray(ruta.read_bytes())
+
+    # La clave envuelta no se puede desenvolver
+    contenido[len(MAGIA) + 2 + 20] ^= 1
+    ruta.write_bytes(bytes(contenido))
+    with pytest.raises(InvalidToken):
+        b"".join(almacen.leer(direccion))
+
+    contenido[len(MAGIA) + 2 + 20] ^= 1
+    contenido[0] ^= 1
+    ruta.write_bytes(bytes(contenido))
+    with pytest.raises(ValueError):
+        b"".join(almacen.leer(direccion))
+
+
+def test_rotacion_reenvuelve_los_blobs(db, cifrado, tmp_path):
+    directorio = str(tmp_path / "adjuntos")
+    antiguo = AlmacenAdjuntos(directorio, cifrado, cargar_clave_direccion(db.conn, cifrado))
+    direccion = antiguo.guardar([DATOS], registrador(db))
+
+    gestor = CifradoManager(SAL_NUEVA, "clave-nueva",
+                            claves_anteriores=[(SAL_ANTIGUA, "clave-antigua")])
+    rotacion = RotacionClaves(
+        db, gestor, pausa_minima=0,
+        almacen=AlmacenAdjuntos(directorio, gestor, cargar_clave_direccion(db.conn, gestor)),
+    )
+    rotacion.ejecutar()
+    assert rotacion.adjuntos_reenvueltos == 1
+
+    # Con solo la clave nueva se lee el blob y el mismo contenido se deduplica
+    nuevo = CifradoManager(SAL_NUEVA, "clave-nueva")
+    almacen = AlmacenAdjuntos(directorio, nuevo, cargar_clave_direccion(db.conn, nuevo))
+    assert b"".join(almacen.leer(direccion)) == DATOS
+    assert almacen.guardar([DATOS], registrador(db)) == direccion
+    with pytest.raises(InvalidToken):
+        b"".join(antiguo.leer(direccion))
+    gestor.cerrar()
+    nuevo.cerrar()
@@ -0,0 +1,116 @@
+"""Pruebas del sobre compacto AES-GCM y su compatibilidad con Fernet"""
+import os
+
+import pytest
+from cryptography.fernet import Fernet, InvalidToken
+
+from models.encryption import (CABECERA_SOBRE, FLAG_ZLIB, LONGITUD_NONCE, UMBRAL_COMPRESION,
+                               VERSION_SOBRE, CifradoManager, SobreCompacto)
+
+CLAVE_NUEVA = Fernet.generate_key()
+CLAVE_ANTIGUA = Fernet.generate_key()
+
+
+def test_sobre_ida_y_vuelta():
+    sobre = SobreCompacto((CLAVE_NUEVA,))
+    for datos in (b"", b"SECRET123", "Reunión mañana ✓".encode("utf-8"), os.urandom(4096)):
+        token = sobre.cifrar(datos)
+        assert token[0] == VERSION_SOBRE
+        assert sobre.descifrar(token) == datos
+
+
+def test_sobre_comprime_solo_si_gana():
+    sobre = SobreCompacto((CLAVE_NUEVA,))
+    repetitivo = b"a" * (UMBRAL_COMPRESION * 4)
+    token = sobre.cifrar(repetitivo)
+    assert token[1] & FLAG_ZLIB
+    assert len(token) < len(repetitivo)
+    assert sobre.descifrar(token) == repetitivo
+
+    aleatorio = os.urandom(UMBRAL_COMPRESION * 4)
+    assert not sobre.cifrar(aleatorio)[1] & FLAG_ZLIB
+    assert not sobre.cifrar(b"corto")[1] & FLAG_ZLIB
+
+
+def test_nonce_distinto_en_cada_cifrado():
+    sobre = SobreCompacto((CLAVE_NUEVA,))
+    assert sobre.cifrar(b"mismo texto") != sobre.cifrar(b"mismo texto")
+
+
+@pytest.mark.parametrize("posicion", [
+    0,                                              # versión
+    1,                                              # flags
+    2,                                              # id de clave
+    CABECERA_SOBRE.size,                            # nonce
+    CABECERA_SOBRE.size + LONGITUD_NONCE,           # texto cifrado
+    -1,                                             # tag
+])
+def test_sobre_manipulado_se_rechaza(posicion):
+    sobre = SobreCompacto((CLAVE_NUEVA,))
+    token = bytearray(sobre.cifrar(b"texto de la nota"))
+    token[posicion] ^= 0x01
+    with pytest.raises(InvalidToken):
+        sobre.descifrar(bytes(token))
+
+
+def test_sobre_truncado_se_rechaza():
+    sobre = SobreCompacto((CLAVE_NUEVA,))
+    token = sobre.cifrar(b"texto de la nota")
+    for longitud in (0, 1, CABECERA_SOBRE.size + LONGITUD_NONCE, len(token) - 1):
+        with pytest.raises(InvalidToken):
+            sobre.descifrar(token[:longitud])
+
+
+def test_descifra_tokens_fernet_antiguos():
+    antiguo = Fernet(CLAVE_ANTIGUA).encrypt(b"nota de antes del sobre")
+    sobre = SobreCompacto((CLAVE_NUEVA, CLAVE_ANTIGUA))
+    assert sobre.descifrar(antiguo) == b"nota de antes del sobre"
+    with pytest.raises(InvalidToken):
+        SobreCompacto((CLAVE_NUEVA,)).descifrar(antiguo)
+
+
+def test_rotar_pasa_a_la_clave_principal():
+    anterior = SobreCompacto((CLAVE_ANTIGUA,))
+    rotacion = SobreCompacto((CLAVE_NUEVA, CLAVE_ANTIGUA))
+    nuevo = SobreCompacto((CLAVE_NUEVA,))
+
+    for token in (anterior.cifrar(b"sobre antiguo"), Fernet(CLAVE_ANTIGUA).encrypt(b"fernet")):
+        rotado = rotacion.rotar(token)
+        assert rotado[0] == VERSION_SOBRE
+        # Tras rotar basta la clave nueva
+        assert nuevo.descifrar(rotado) == rotacion.descifrar(token)
+
+
+def test_rotar_no_toca_lo_que_ya_usa_la_clave_principal():
+    sobre = SobreCompacto((CLAVE_NUEVA, CLAVE_ANTIGUA))
+    token = sobre.cifrar(b"ya rotado")
+    assert sobre.rotar(token) is token
+
+
+def test_clave_desconocida_se_rechaza():
+    token = SobreCompacto((CLAVE_ANTIGUA,)).cifrar(b"otra clave")
+    with pytest.raises(InvalidToken):
+        SobreCompacto((CLAVE_NUEVA,)).descifrar(token)
+
+
+def test_gestor_rota_notas_de_usuario_con_la_clave_anterior():
+    sal_usuario = os.urandom(16)
+    anterior = CifradoManager(b"sal-anterior", "clave-anterior")
+    gestor = CifradoManager(b"sal-nueva", "clave-nueva",
+                            claves_anteriores=[(b"sal-anterior", "clave-anterior")])
+    solo_nueva = CifradoManager(b"sal-nueva", "clave-nueva")
+    assert gestor.tiene_claves_anteriores and not solo_nueva.tiene_claves_anteriores
+
+    # Notas de usuario y notas antiguas cifradas con la maestra y en Fernet
+    tokens = [
+        anterior.para_usuario(7, sal_usuario).cifrar("nota de usuario"),
+        anterior.cifrar("nota con la maestra"),
+        Fernet(anterior.claves_maestras[0]).encrypt("nota en Fernet".encode("utf-8")),
+    ]
+    cifrador = gestor.para_usuario(7, sal_usuario)
+    rotados = cifrador.rotar_lote(tokens)
+    assert [solo_nueva.para_usuario(7, sal_usuario).descifrar(t) for t in rotados] == [
+        "nota de usuario", "nota con la maestra", "nota en Fernet"]
+    with pytest.raises(ValueError):
+        solo_nueva.para_usuario(7, sal_usuario).descifrar(tokens[0])
+    gestor.cerrar()
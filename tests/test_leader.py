@@ -0,0 +1,96 @@
+"""Pruebas del arrendamiento que elige la instancia que despacha recordatorios"""
+import time
+
+from core.leader import ArrendamientoLider
+from core.scheduler import ReminderScheduler
+
+TTL = 0.3
+
+
+def arrendamiento(db, propietario):
+    return ArrendamientoLider(db, ttl=TTL, propietario=propietario)
+
+
+def fila(db):
+    return db.conn.execute(
+        "SELECT propietario, epoca FROM arrendamientos WHERE recurso = 'planificador'"
+    ).fetchone()
+
+
+def test_solo_una_instancia_es_lider(db):
+    primera, segunda = arrendamiento(db, "a"), arrendamiento(db, "b")
+    assert primera.intentar() and primera.es_lider
+    assert not segunda.intentar() and not segunda.es_lider
+    # Renovar no cambia de época
+    assert primera.intentar()
+    assert fila(db) == ("a", 1)
+    assert primera.epoca == 1
+
+
+def test_otra_instancia_toma_el_relevo_al_caducar(db):
+    primera, segunda = arrendamiento(db, "a"), arrendamiento(db, "b")
+    assert primera.intentar()
+    time.sleep(TTL + 0.05)
+
+    # El antiguo líder ya no se considera líder aunque no haya renovado
+    assert not primera.es_lider
+    assert segunda.intentar() and segunda.epoca == 2
+    assert fila(db) == ("b", 2)
+    # Ni recupera el arrendamiento mientras el nuevo líder lo mantenga
+    assert not primera.intentar()
+    assert not primera.mantener()
+
+
+def test_liberar_cede_el_liderazgo_sin_esperar_al_ttl(db):
+    primera, segunda = arrendamiento(db, "a"), arrendamiento(db, "b")
+    assert primera.intentar()
+    primera.liberar()
+    assert not primera.es_lider
+    assert segunda.intentar()
+    assert fila(db) == ("b", 2)
+
+
+def test_mantener_solo_renueva_cada_intervalo(db):
+    lider = arrendamiento(db, "a")
+    assert lider.mantener()
+    renovacion = lider._ultima_renovacion
+    assert lider.mantener()
+    assert lider._ultima_renovacion == renovacion
+
+    time.sleep(lider.intervalo_renovacion)
+    assert lider.mantener()
+    assert lider._ultima_renovacion > renovacion
+
+
+def test_solo_despacha_la_instancia_lider(db, usuario):
+    fire_at = int(time.time()) - 5
+    reminder_id = db.conn.execute(
+        """INSERT INTO recordatorios (usuario_id, texto, hora_recordatorio, next_fire_at)
+        VALUES (?, 'recordatorio', '08:00', ?)""",
+        (usuario, fire_at)
+    ).lastrowid
+    db.conn.commit()
+    enviados = {"a": [], "b": []}
+
+    def instancia(nombre):
+        lider = arrendamiento(db, nombre)
+        planificador = ReminderScheduler(
+            db, lambda telegram_id, texto, programado: enviados[nombre].append(texto),
+            lider=lider, tasa_despacho=0
+        )
+        planificador.conn = db.nueva_conexion()
+        return planificador
+
+    primera, segunda = instancia("a"), instancia("b")
+    assert primera._es_despachador() and not segunda._es_despachador()
+
+    # La instancia sin arrendamiento no envía lo que tenga encolado
+    segunda._despachar_tramo([(fire_at, reminder_id, 1)])
+    assert enviados == {"a": [], "b": []}
+
+    # Tras ceder el arrendamiento, la otra lo toma en su siguiente renovación
+    primera.lider.liberar()
+    time.sleep(segunda.lider.intervalo_renovacion)
+    segunda._despachar_tramo([(fire_at, reminder_id, 1)])
+    assert enviados == {"a": [], "b": ["recordatorio"]}
+    assert not primera._es_despachador()
@@ -0,0 +1,139 @@
+"""Pruebas de las reglas de recurrencia y de las opciones `--` de /remind"""
+from datetime import date, datetime, timezone
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from core.recurrence import (MASCARA_LABORABLES, REGLA_DIARIA, ReglaRecurrencia, extraer_regla,
+                             proximo_disparo)
+
+UTC = timezone.utc
+MADRID = ZoneInfo("Europe/Madrid")
+
+
+def instante(anio, mes, dia, hora, minuto=0, zona=UTC) -> int:
+    return int(datetime(anio, mes, dia, hora, minuto, tzinfo=zona).timestamp())
+
+
+# ---- extraer_regla ----
+
+@pytest.mark.parametrize("texto, restantes, regla", [
+    ("llamar a Ana 14:30", "llamar a Ana 14:30", None),
+    ("revisar --verbose en el log 14:30", "revisar --verbose en el log 14:30", None),
+    ("ejecutar make 09:00 --recurrente", "ejecutar make 09:00", "FREQ=DAILY"),
+    ("standup 09:00 --laborables", "standup 09:00", "FREQ=WEEKLY;BYDAY=MO,TU,WE,TH,FR"),
+    ("gimnasio 19:00 --semanal=LU,MI", "gimnasio 19:00", "FREQ=WEEKLY;BYDAY=MO,WE"),
+    ("pagar alquiler 10:00 --mensual=31", "pagar alquiler 10:00", "FREQ=MONTHLY;BYMONTHDAY=31"),
+    ("comprar pan 10:00 --cada=3h", "comprar pan 10:00", "FREQ=HOURLY;INTERVAL=3"),
+    ("regar 08:00 --cada=2d", "regar 08:00", "FREQ=DAILY;INTERVAL=2"),
+    ("informe 08:00 --rrule=FREQ=WEEKLY;BYDAY=VI", "informe 08:00", "FREQ=WEEKLY;BYDAY=FR"),
+    # Sin hora delante solo se toman si todas son opciones conocidas
+    ("probar el flag --force", "probar el flag --force", None),
+    ("algo --diario", "algo", "FREQ=DAILY"),
+])
+def test_extraer_regla(texto, restantes, regla):
+    tokens, resultado = extraer_regla(texto.split())
+    assert " ".join(tokens) == restantes
+    assert (str(resultado) if resultado else None) == regla
+
+
+def test_extraer_regla_mensual_sin_dia_usa_hoy():
+    _, regla = extraer_regla(["factura", "10:00", "--mensual"], hoy=date(2026, 1, 17))
+    assert regla.dia_mes == 17
+
+
+@pytest.mark.parametrize("texto", [
+    "texto 10:00 --foo",
+    "texto 10:00 --diario --laborables",
+    "texto 10:00 --cada=3",
+    "texto 10:00 --cada=xh",
+    "texto 10:00 --semanal=XX",
+])
+def test_extraer_regla_rechaza_opciones_invalidas(texto):
+    with pytest.raises(ValueError):
+        extraer_regla(texto.split())
+
+
+# ---- parsear ----
+
+def test_parsear_y_serializar():
+    regla = ReglaRecurrencia.parsear("RRULE:freq=weekly;byday=LU,MI;wkst=MO")
+    assert regla.frecuencia == 'WEEKLY'
+    assert str(regla) == "FREQ=WEEKLY;BYDAY=MO,WE"
+    assert str(ReglaRecurrencia.parsear(str(regla))) == str(regla)
+    assert str(ReglaRecurrencia.parsear("FREQ=DAILY;BYDAY=MO")) == "FREQ=WEEKLY;BYDAY=MO"
+
+
+@pytest.mark.parametrize("texto", [
+    "FREQ=YEARLY",
+    "FREQ=WEEKLY",
+    "FREQ=MONTHLY;BYMONTHDAY=32",
+    "FREQ=WEEKLY;INTERVAL=2;BYDAY=MO",
+    "FREQ=DAILY;INTERVAL=0",
+    "FREQ=DAILY;INTERVAL=x",
+    "FREQ=DAILY;COUNT=3",
+])
+def test_parsear_rechaza_reglas_no_soportadas(texto):
+    with pytest.raises(ValueError):
+        ReglaRecurrencia.parsear(texto)
+
+
+# ---- siguiente ocurrencia ----
+# El 5 de enero de 2026 es lunes
+
+def test_diaria():
+    desde = instante(2026, 1, 5, 10)
+    assert REGLA_DIARIA.siguiente("11:00", desde, UTC) == instante(2026, 1, 5, 11)
+    assert REGLA_DIARIA.siguiente("10:00", desde, UTC) == desde
+    assert REGLA_DIARIA.siguiente("09:00", desde, UTC) == instante(2026, 1, 6, 9)
+
+
+def test_diaria_con_intervalo_mantiene_la_fase():
+    regla = ReglaRecurrencia('DAILY', 2)
+    anterior = instante(2026, 1, 1, 9)
+    # Días 1, 3, 5, 7...: sin disparar desde el día 1, el siguiente es el 7
+    assert regla.siguiente("09:00", instante(2026, 1, 6, 10), UTC, anterior) == \
+        instante(2026, 1, 7, 9)
+    assert regla.siguiente("09:00", instante(2026, 1, 2, 10), UTC, anterior) == \
+        instante(2026, 1, 3, 9)
+
+
+def test_semanal():
+    regla = ReglaRecurrencia.parsear("FREQ=WEEKLY;BYDAY=LU,MI")
+    assert regla.siguiente("09:00", instante(2026, 1, 6, 10), UTC) == instante(2026, 1, 7, 9)
+    assert regla.siguiente("09:00", instante(2026, 1, 7, 10), UTC) == instante(2026, 1, 12, 9)
+    # El mismo día si la hora aún no ha pasado
+    assert regla.siguiente("11:00", instante(2026, 1, 5, 10), UTC) == instante(2026, 1, 5, 11)
+
+
+def test_laborables_salta_el_fin_de_semana():
+    regla = ReglaRecurrencia('WEEKLY', dias=MASCARA_LABORABLES)
+    assert regla.siguiente("09:00", instante(2026, 1, 9, 10), UTC) == instante(2026, 1, 12, 9)
+
+
+def test_mensual_ajusta_al_ultimo_dia_del_mes():
+    regla = ReglaRecurrencia('MONTHLY', dia_mes=31)
+    assert regla.siguiente("09:00", instante(2026, 1, 31, 10), UTC) == instante(2026, 2, 28, 9)
+    assert regla.siguiente("09:00", instante(2026, 3, 1, 0), UTC) == instante(2026, 3, 31, 9)
+    assert regla.siguiente("09:00", instante(2026, 12, 31, 10), UTC) == instante(2027, 1, 31, 9)
+
+
+def test_cada_n_horas():
+    regla = ReglaRecurrencia('HOURLY', 3)
+    # Sin disparos previos la serie arranca a la hora indicada
+    assert regla.siguiente("08:00", instante(2026, 1, 5, 10, 30), UTC) == instante(2026, 1, 5, 11)
+    # Tras una caída larga se salta a la siguiente ocurrencia de la serie
+    assert regla.siguiente("08:00", instante(2026, 1, 6, 0, 30), UTC, instante(2026, 1, 5, 8)) == \
+        instante(2026, 1, 6, 2)
+
+
+def test_cambio_de_horario():
+    # En Madrid el 29 de marzo de 2026 las 02:00 pasan a ser las 03:00
+    desde = instante(2026, 3, 28, 12, zona=MADRID)
+    assert REGLA_DIARIA.siguiente("02:30", desde, MADRID) == instante(2026, 3, 29, 3, 30, MADRID)
+    assert REGLA_DIARIA.siguiente("09:00", desde, MADRID) == instante(2026, 3, 29, 9, zona=MADRID)
+
+
+def test_proximo_disparo_puntual():
+    desde = instante(2026, 1, 5, 10)
+    assert proximo_disparo("09:00", None, desde, UTC) == instante(2026, 1, 6, 9)
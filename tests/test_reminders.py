@@ -0,0 +1,213 @@
+"""Pruebas del planificador de recordatorios"""
+import time
+
+import pytest
+
+from core.scheduler import CLAVE_LATIDO, ESPERA_REINTENTO, REINTENTOS_ENVIO, ReminderScheduler
+from models.database import SecureDB
+
+
+def crear_recordatorio(db, usuario_id, fire_at, texto="recordatorio", recurrente=0):
+    reminder_id = db.conn.execute(
+        """INSERT INTO recordatorios
+        (usuario_id, texto, hora_recordatorio, recurrente, next_fire_at)
+        VALUES (?, ?, '08:00', ?, ?)""",
+        (usuario_id, texto, recurrente, fire_at)
+    ).lastrowid
+    db.conn.commit()
+    return reminder_id
+
+
+def estado(db, reminder_id):
+    return db.conn.execute(
+        "SELECT completado, next_fire_at FROM recordatorios WHERE id = ?", (reminder_id,)
+    ).fetchone()
+
+
+def planificador(db, enviar, **opciones):
+    opciones.setdefault("politica_recuperacion", "entregar")
+    opciones.setdefault("tasa_recuperacion", 0)
+    planificador = ReminderScheduler(db, enviar, **opciones)
+    planificador.conn = db.nueva_conexion()
+    return planificador
+
+
+def test_recuperacion_con_envio_fallido_deja_el_recordatorio_pendiente(db, usuario):
+    ahora = int(time.time())
+    SecureDB.guardar_estado(db.conn, CLAVE_LATIDO, ahora - 600)
+    puntual = crear_recordatorio(db, usuario, ahora - 300)
+    diario = crear_recordatorio(db, usuario, ahora - 200, recurrente=1)
+
+    def enviar_con_error(telegram_id, texto, programado):
+        raise ConnectionError("Telegram no responde")
+
+    recuperador = planificador(db, enviar_con_error)
+    resumen = recuperador.recuperar_perdidos()
+
+    assert resumen["fallidos"] == 2 and resumen["entregados"] == 0
+    assert estado(db, puntual) == (0, ahora - 300)
+    assert estado(db, diario) == (0, ahora - 200)
+    # Quedan encolados como reintentos, fuera de la ventana de la recuperación
+    assert set(recuperador._reintentos) == {puntual, diario}
+    assert all(not recuperador._en_recuperacion(reintento[2])
+               for reintento in recuperador._reintentos.values())
+
+
+def test_reintento_tras_recuperacion_fallida_entrega_el_recordatorio(db, usuario):
+    ahora = int(time.time())
+    SecureDB.guardar_estado(db.conn, CLAVE_LATIDO, ahora - 600)
+    reminder_id = crear_recordatorio(db, usuario, ahora - 300)
+    enviados, fallar = [], [True]
+
+    def enviar(telegram_id, texto, programado):
+        if fallar[0]:
+            raise ConnectionError("Telegram no responde")
+        enviados.append(texto)
+
+    recuperador = planificador(db, enviar)
+    recuperador.recuperar_perdidos()
+    fire_at, _, telegram_id = recuperador._heap.extraer()
+
+    fallar[0] = False
+    assert recuperador._disparar(fire_at, reminder_id, telegram_id)
+    assert enviados == ["recordatorio"]
+    assert estado(db, reminder_id) == (1, None)
+
+
+def test_recuperacion_con_gracia_solo_entrega_los_recientes(db, usuario):
+    ahora = int(time.time())
+    SecureDB.guardar_estado(db.conn, CLAVE_LATIDO, ahora - 7200)
+    anterior = crear_recordatorio(db, usuario, ahora - 9000, "antes de la caída")
+    antiguo = crear_recordatorio(db, usuario, ahora - 5000, "antiguo")
+    diario = crear_recordatorio(db, usuario, ahora - 4000, "diario", recurrente=1)
+    reciente = crear_recordatorio(db, usuario, ahora - 100, "reciente")
+    enviados = []
+
+    recuperador = planificador(db, lambda telegram_id, texto, programado: enviados.append(texto),
+                               politica_recuperacion="gracia", gracia=3600)
+    resumen = recuperador.recuperar_perdidos()
+
+    assert enviados == ["reciente"]
+    assert (resumen["entregados"], resumen["omitidos"], resumen["anteriores_caida"]) == (1, 2, 1)
+    assert estado(db, antiguo) == (1, None)
+    assert estado(db, reciente) == (1, None)
+    # El recurrente omitido pasa a su siguiente ocurrencia futura y se encola
+    completado, siguiente = estado(db, diario)
+    assert completado == 0 and siguiente > ahora
+    assert recuperador._heap.extraer() == (siguiente, diario, 1)
+    # Lo anterior a la ventana de la caída lo despacha el montículo
+    assert estado(db, anterior) == (0, ahora - 9000)
+
+
+def test_recuperacion_omitir_no_envia_nada(db, usuario):
+    ahora = int(time.time())
+    SecureDB.guardar_estado(db.conn, CLAVE_LATIDO, ahora - 600)
+    puntual = crear_recordatorio(db, usuario, ahora - 300)
+    enviados = []
+
+    recuperador = planificador(db, lambda telegram_id, texto, programado: enviados.append(texto),
+                               politica_recuperacion="omitir")
+    resumen = recuperador.recuperar_perdidos()
+
+    assert not enviados and resumen["omitidos"] == 1
+    assert estado(db, puntual) == (1, None)
+
+
+def test_recuperacion_entrega_una_sola_vez_un_recurrente_con_varias_perdidas(db, usuario):
+    ahora = int(time.time())
+    SecureDB.guardar_estado(db.conn, CLAVE_LATIDO, ahora - 4 * 86400)
+    diario = crear_recordatorio(db, usuario, ahora - 3 * 86400, "diario", recurrente=1)
+    enviados = []
+
+    recuperador = planificador(db, lambda telegram_id, texto, programado: enviados.append(texto))
+    recuperador.recuperar_perdidos()
+
+    assert enviados == ["diario"]
+    completado, siguiente = estado(db, diario)
+    assert completado == 0 and ahora < siguiente <= ahora + 86400 + 1
+
+
+def test_politica_de_recuperacion_desconocida(db):
+    with pytest.raises(ValueError):
+        ReminderScheduler(db, print, politica_recuperacion="todas")
+
+
+def enviar_con_error(telegram_id, texto, programado):
+    raise ConnectionError("Telegram no responde")
+
+
+def test_envio_fallido_se_reintenta_con_espera_exponencial(db, usuario):
+    fire_at = int(time.time()) - 5
+    reminder_id = crear_recordatorio(db, usuario, fire_at)
+    despachador = planificador(db, enviar_con_error)
+
+    for intento in (1, 2, 3):
+        entrada = (fire_at, reminder_id, 1) if intento == 1 else despachador._heap.extraer()
+        antes = time.time()
+        with pytest.raises(ConnectionError):
+            despachador._disparar(*entrada)
+        original, intentos, cuando = despachador._reintentos[reminder_id]
+        assert (original, intentos) == (fire_at, intento)
+        espera = ESPERA_REINTENTO * 2 ** (intento - 1)
+        assert antes + espera - 1 <= cuando <= time.time() + espera
+        # La fila no cambia mientras queden reintentos
+        assert estado(db, reminder_id) == (0, fire_at)
+
+
+@pytest.mark.parametrize("recurrente", [0, 1])
+def test_recordatorio_abandonado_tras_agotar_los_reintentos(db, usuario, recurrente):
+    fire_at = int(time.time()) - 5
+    reminder_id = crear_recordatorio(db, usuario, fire_at, recurrente=recurrente)
+    despachador = planificador(db, enviar_con_error)
+
+    entrada = (fire_at, reminder_id, 1)
+    for intento in range(REINTENTOS_ENVIO + 1):
+        if intento:
+            entrada = despachador._heap.extraer()
+        with pytest.raises(ConnectionError):
+            despachador._disparar(*entrada)
+
+    assert reminder_id not in despachador._reintentos
+    completado, siguiente = estado(db, reminder_id)
+    if recurrente:
+        # Pasa a la ocurrencia de mañana, que es la que queda encolada
+        assert completado == 0 and siguiente > time.time()
+        assert despachador._heap.extraer() == (siguiente, reminder_id, 1)
+    else:
+        assert (completado, siguiente) == (1, None)
+        assert not despachador._heap
+
+
+def test_reintento_con_exito_completa_el_recordatorio(db, usuario):
+    fire_at = int(time.time()) - 5
+    reminder_id = crear_recordatorio(db, usuario, fire_at)
+    enviados, fallar = [], [True]
+
+    def enviar(telegram_id, texto, programado):
+        if fallar[0]:
+            raise ConnectionError("Telegram no responde")
+        enviados.append(texto)
+
+    despachador = planificador(db, enviar)
+    with pytest.raises(ConnectionError):
+        despachador._disparar(fire_at, reminder_id, 1)
+
+    fallar[0] = False
+    assert despachador._disparar(*despachador._heap.extraer())
+    assert enviados == ["recordatorio"]
+    assert estado(db, reminder_id) == (1, None)
+    assert not despachador._reintentos
+
+
+def test_reintento_de_un_recordatorio_reprogramado_se_descarta(db, usuario):
+    fire_at = int(time.time()) - 5
+    reminder_id = crear_recordatorio(db, usuario, fire_at)
+    despachador = planificador(db, enviar_con_error)
+    with pytest.raises(ConnectionError):
+        despachador._disparar(fire_at, reminder_id, 1)
+
+    db.conn.execute("UPDATE recordatorios SET next_fire_at = ? WHERE id = ?",
+                    (fire_at + 86400, reminder_id))
+    db.conn.commit()
+    assert not despachador._disparar(*despachador._heap.extraer())
+    assert not despachador._reintentos